@@ -0,0 +1,249 @@
+import datetime
+from typing import Dict, List, Optional, Sequence
+
+from loan_history import NOT_RETURNED, LoanHistory, to_micros
+
+try:
+    import numpy as np
+except ImportError:  # Only the reports need NumPy; the rest of the library runs without it
+    np = None
+
+_DAY_MICROS = 24 * 3600 * 10 ** 6
+DURATION_BINS = (1, 2, 3, 7, 14, 21, 30, 60, 90)  # Upper bounds in days of the loan-duration buckets
+PERCENTILES = (50, 75, 90, 95, 99)
+
+
+def _month_index(when: datetime.datetime) -> int:
+    # Months since 1970-01, the unit of datetime64[M]
+    return (when.year - 1970) * 12 + when.month - 1
+
+
+def _month_label(index: int) -> str:
+    return f"{1970 + index // 12}-{index % 12 + 1:02d}"
+
+
+def _column(column, dtype) -> 'np.ndarray':
+    # Reads a LoanHistory column through the buffer protocol, without decoding loan by loan
+    chunks = [np.frombuffer(chunk, dtype=dtype) for chunk in column.buffers() if len(chunk)]
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype)
+
+
+class LoanColumns:
+    # Loan history as NumPy columns, one entry per loan in position order: ISBN, member and
+    # category as integer codes into the lists below, times in microseconds since 1970 with
+    # returned set to NOT_RETURNED while the loan is open. Loans count under their book's
+    # current category, None once the book is deleted. Reports are group-bys over these arrays.
+    # The library keeps a built projection in sync: loans are appended to spare capacity at
+    # the end of each column and returns patch the returned column in place.
+    def __init__(self, history: LoanHistory, books: Dict):
+        if np is None:
+            raise ImportError("loan reports need NumPy (pip install numpy)")
+        isbn_codes: Dict[str, int] = {}
+        member_codes: Dict[str, int] = {}
+        isbns, members, borrowed, returned = [], [], [], []
+        for part in history.parts():
+            # Every part interns its own codes, so map them onto codes shared by all parts
+            isbn_map = np.array([isbn_codes.setdefault(isbn, len(isbn_codes)) for isbn in part.isbn_table],
+                                dtype=np.int32)
+            member_map = np.array([member_codes.setdefault(member_id, len(member_codes))
+                                   for member_id in part.member_table], dtype=np.int32)
+            isbns.append(isbn_map[_column(part.isbn_ids, np.uint32)])
+            members.append(member_map[_column(part.member_ids, np.uint32)])
+            borrowed.append(_column(part.borrow_times, np.int64))
+            returned.append(_column(part.return_times, np.int64))
+        self._isbn_codes = isbn_codes
+        self._member_codes = member_codes
+        self.isbns: List[str] = list(isbn_codes)
+        self.members: List[str] = list(member_codes)
+        self._isbn = np.concatenate(isbns)
+        self._member = np.concatenate(members)
+        self._borrowed = np.concatenate(borrowed)
+        self._returned = np.concatenate(returned)  # A copy, so the overlays below never touch the history
+        self._size = len(self._borrowed)
+        # Archived segments keep the return time a loan had when it was archived
+        if history.archived_open:
+            self._returned[np.fromiter(history.archived_open, np.int64)] = NOT_RETURNED
+        if history.late_returns:
+            self._returned[np.fromiter(history.late_returns, np.int64)] = np.fromiter(
+                history.late_returns.values(), np.int64)
+
+        self._category_codes: Dict[Optional[str], int] = {}
+        self.categories: List[Optional[str]] = []
+        self._isbn_category = [self._category_code(books[isbn].category if isbn in books else None)
+                               for isbn in self.isbns]  # ISBN code -> category code
+        self._category = (np.array(self._isbn_category, dtype=np.int32)[self._isbn] if self._size
+                          else np.empty(0, np.int32))
+        self._months: Optional['np.ndarray'] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    # The columns, without the spare capacity behind them
+    @property
+    def isbn(self) -> 'np.ndarray':
+        return self._isbn[:self._size]
+
+    @property
+    def member(self) -> 'np.ndarray':
+        return self._member[:self._size]
+
+    @property
+    def borrowed(self) -> 'np.ndarray':
+        return self._borrowed[:self._size]
+
+    @property
+    def returned(self) -> 'np.ndarray':
+        return self._returned[:self._size]
+
+    @property
+    def category(self) -> 'np.ndarray':
+        return self._category[:self._size]
+
+    def _category_code(self, category: Optional[str]) -> int:
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self.categories)
+            self.categories.append(category)
+        return code
+
+    def add(self, isbn: str, member_id: str, borrowed: int, returned: int, category: Optional[str]):
+        # Appends the loan at the next position; category is its book's current one
+        if self._size == len(self._borrowed):
+            capacity = max(1024, 2 * self._size)
+            for name in ('_isbn', '_member', '_borrowed', '_returned', '_category'):
+                column = getattr(self, name)
+                grown = np.empty(capacity, column.dtype)
+                grown[:self._size] = column[:self._size]
+                setattr(self, name, grown)
+        isbn_code = self._isbn_codes.get(isbn)
+        if isbn_code is None:
+            isbn_code = self._isbn_codes[isbn] = len(self.isbns)
+            self.isbns.append(isbn)
+            self._isbn_category.append(self._category_code(category))
+        member_code = self._member_codes.get(member_id)
+        if member_code is None:
+            member_code = self._member_codes[member_id] = len(self.members)
+            self.members.append(member_id)
+        index = self._size
+        self._isbn[index] = isbn_code
+        self._member[index] = member_code
+        self._borrowed[index] = borrowed
+        self._returned[index] = returned
+        self._category[index] = self._isbn_category[isbn_code]
+        self._size += 1
+
+    def set_return(self, position: int, returned: int):
+        self._returned[position] = returned
+
+    def set_category(self, isbn: str, category: Optional[str]):
+        # Moves the loans of a book whose category changed, or None once it is deleted
+        isbn_code = self._isbn_codes.get(isbn)
+        if isbn_code is None:
+            return
+        code = self._category_code(category)
+        if code != self._isbn_category[isbn_code]:
+            self._isbn_category[isbn_code] = code
+            self.category[self.isbn == isbn_code] = code
+
+    def borrow_months(self) -> 'np.ndarray':
+        # Month of each loan's borrow date, as months since 1970-01; loans added since the
+        # last call are converted on their own
+        done = 0 if self._months is None else len(self._months)
+        if done < self._size:
+            months = self.borrowed[done:].astype('datetime64[us]').astype('datetime64[M]').astype(np.int64)
+            self._months = months if self._months is None else np.concatenate((self._months, months))
+        return self._months
+
+    def _category_mask(self, category: Optional[str]) -> 'np.ndarray':
+        if category not in self.categories:
+            return np.zeros(len(self), bool)
+        return self.category == self.categories.index(category)
+
+    def duration_report(self, category: Optional[str] = None,
+                        bins: Sequence[int] = DURATION_BINS) -> Dict:
+        # How long returned loans were out, in days, as a histogram and summary figures
+        selected = np.ones(len(self), bool) if category is None else self._category_mask(category)
+        done = selected & (self.returned != NOT_RETURNED)
+        days = (self.returned[done] - self.borrowed[done]) / _DAY_MICROS
+        counts = np.bincount(np.searchsorted(np.asarray(bins), days, side='right'), minlength=len(bins) + 1)
+        bounds = [0, *bins]
+        labels = [f"{low}-{high}" for low, high in zip(bounds, bins)] + [f"{bins[-1]}+"]
+        summary = np.percentile(days, (50, 90)) if days.size else (0.0, 0.0)
+        return {
+            'category': category,
+            'returned': int(days.size),
+            'open': int(selected.sum()) - int(days.size),
+            'mean_days': float(days.mean()) if days.size else 0.0,
+            'median_days': float(summary[0]),
+            'p90_days': float(summary[1]),
+            'histogram': [{'days': label, 'loans': int(count)} for label, count in zip(labels, counts)]
+        }
+
+    def monthly_circulation(self, months: int = 12, now: Optional[datetime.datetime] = None) -> Dict:
+        # Loans borrowed per month and category over the last `months` months, this one included
+        current = _month_index(now or datetime.datetime.now())
+        first = current - months + 1
+        month = self.borrow_months()
+        keep = (month >= first) & (month <= current)
+        width = len(self.categories)
+        counts = np.bincount((month[keep] - first) * width + self.category[keep],
+                             minlength=months * width).reshape(months, width)
+        return {
+            'months': [_month_label(first + offset) for offset in range(months)],
+            'total': counts.sum(axis=1).tolist(),
+            'categories': {category: counts[:, code].tolist() for code, category in enumerate(self.categories)
+                           if counts[:, code].any()}
+        }
+
+    def lateness_report(self, loan_days: int = 14, percentiles: Sequence[int] = PERCENTILES,
+                        now: Optional[datetime.datetime] = None) -> Dict:
+        # A loan is late once it is out more than loan_days full days, as in get_overdue_books();
+        # percentiles are of the days late of loans returned late
+        done = self.returned != NOT_RETURNED
+        days_out = (self.returned[done] - self.borrowed[done]) // _DAY_MICROS
+        late = days_out > loan_days
+        days_late = days_out[late] - loan_days
+        values = np.percentile(days_late, percentiles) if days_late.size else np.zeros(len(percentiles))
+        now_micros = to_micros(now or datetime.datetime.now())
+        open_days = (now_micros - self.borrowed[~done]) // _DAY_MICROS
+        width = len(self.categories)
+        returned_by_category = np.bincount(self.category[done], minlength=width)
+        late_by_category = np.bincount(self.category[done][late], minlength=width)
+        return {
+            'loan_days': loan_days,
+            'returned': int(days_out.size),
+            'returned_late': int(days_late.size),
+            'late_ratio': days_late.size / days_out.size if days_out.size else 0.0,
+            'percentiles_days': {f"p{percentile}": float(value) for percentile, value in zip(percentiles, values)},
+            'open_overdue': int((open_days > loan_days).sum()),
+            'categories': {category: {'returned': int(returned_by_category[code]),
+                                      'late': int(late_by_category[code]),
+                                      'late_ratio': float(late_by_category[code] / returned_by_category[code])}
+                           for code, category in enumerate(self.categories) if returned_by_category[code]}
+        }
+
+    def member_cohorts(self, months: int = 12, now: Optional[datetime.datetime] = None) -> List[Dict]:
+        # Members grouped by the month of their first loan, for cohorts from the last `months`
+        # months; active[k] is how many of them borrowed k months after joining
+        current = _month_index(now or datetime.datetime.now())
+        oldest = current - months + 1
+        month = self.borrow_months()
+        if not len(month):
+            return []
+        # Distinct (member, month) pairs, sorted by member and then month
+        low = int(month.min())
+        span = int(month.max()) - low + 1
+        pairs = np.unique(self.member.astype(np.int64) * span + (month - low))
+        pair_member, pair_month = pairs // span, pairs % span + low
+        starts = np.flatnonzero(np.diff(pair_member, prepend=-1))
+        joined = np.repeat(pair_month[starts], np.diff(np.append(starts, len(pairs))))
+        offset = pair_month - joined
+        keep = (joined >= oldest) & (pair_month <= current)
+        active = np.bincount((joined[keep] - oldest) * months + offset[keep],
+                             minlength=months * months).reshape(months, months)
+        cohorts = []
+        for row in range(months):
+            if active[row, 0]:
+                cohorts.append({'cohort': _month_label(oldest + row), 'members': int(active[row, 0]),
+                                'active': active[row, :months - row].tolist()})
+        return cohorts
@@ -0,0 +1,216 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from library import LibrarySystem
+from storage import PickleStorage, SQLiteStorage, SnapshotStorage
+
+WORDS = ['history', 'science', 'garden', 'ocean', 'winter', 'shadow', 'empire', 'river', 'silent',
+         'golden', 'night', 'journey', 'secret', 'mountain', 'city', 'dream', 'fire', 'stone', 'light',
+         'forest', 'island', 'storm', 'king', 'paper', 'glass', 'iron', 'song', 'memory', 'north', 'star']
+SURNAMES = ['Ahmadi', 'Hosseini', 'Karimi', 'Rahimi', 'Moradi', 'Smith', 'Garcia', 'Tanaka', 'Novak',
+            'Okafor', 'Larsen', 'Rossi', 'Kowalski', 'Haddad', 'Silva', 'Nguyen']
+CATEGORIES = ['fiction', 'history', 'science', 'poetry', 'children', 'biography', 'travel', 'art']
+
+
+def make_storage(kind: str, directory: str):
+    if kind == 'sqlite':
+        return SQLiteStorage(os.path.join(directory, 'bench.db'))
+    if kind == 'snapshot':
+        return SnapshotStorage(os.path.join(directory, 'bench.snap'))
+    return PickleStorage(os.path.join(directory, 'bench.pkl'), journaled=(kind == 'journal'))
+
+
+def generate_library(library: LibrarySystem, books: int, members: int, loans: int,
+                     seed: int = 42, days: int = 3 * 365, open_ratio: float = 0.02) -> None:
+    # Deterministic for a given seed: same titles, members and loan history every run
+    rng = random.Random(seed)
+    with library.batch():
+        for i in range(books):
+            title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+            author = f"{rng.choice(WORDS).title()} {rng.choice(SURNAMES)}"
+            library.add_book(title, author, rng.choice(CATEGORIES), f"978{i:010d}")
+        for i in range(members):
+            library.add_member(f"Member {i}", f"M{i:07d}", f"09{rng.randrange(10 ** 9):09d}")
+    if not books or not members:
+        return
+
+    # Loans are generated in borrow-date order, most of them already returned
+    now = datetime.datetime.now()
+    start = now - datetime.timedelta(days=days)
+    step = datetime.timedelta(days=days) / max(loans, 1)
+    batch_size = 10000
+    for first in range(0, loans, batch_size):
+        with library.batch():
+            for i in range(first, min(first + batch_size, loans)):
+                borrow_date = start + step * i
+                isbn = f"978{rng.randrange(books):010d}"
+                member_id = f"M{rng.randrange(members):07d}"
+                if rng.random() < open_ratio and library.books[isbn].is_available:
+                    library.import_loan(isbn, member_id, borrow_date)
+                else:
+                    return_date = min(borrow_date + datetime.timedelta(days=rng.randint(1, 30)), now)
+                    library.import_loan(isbn, member_id, borrow_date, return_date)
+
+
+def _time_calls(call: Callable[[], object], iterations: int, trace_memory: bool) -> Dict:
+    timings = []
+    peak = 0
+    for _ in range(iterations):
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+        if trace_memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    timings.sort()
+    result = {
+        'iterations': iterations,
+        'total_s': sum(timings),
+        'min_ms': timings[0] * 1e3,
+        'median_ms': statistics.median(timings) * 1e3,
+        'mean_ms': statistics.fmean(timings) * 1e3,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1e3,
+        'max_ms': timings[-1] * 1e3,
+        'peak_rss_kb': _peak_rss_kb()
+    }
+    if trace_memory:
+        result['peak_traced_bytes'] = peak
+    return result
+
+
+def _peak_rss_kb() -> int:
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if platform.system() == 'Darwin' else peak
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(library: LibrarySystem, iterations: int = 20, seed: int = 42,
+                   methods: Optional[List[str]] = None, trace_memory: bool = False) -> Dict[str, Dict]:
+    rng = random.Random(seed + 1)
+    isbns = list(library.books)
+    member_ids = list(library.members)
+    queries = [rng.choice(WORDS)[:rng.randint(3, 6)] for _ in range(iterations)]
+    results: Dict[str, Dict] = {}
+
+    def pick(values: List[str]) -> str:
+        return values[rng.randrange(len(values))]
+
+    # Every borrow is returned by the return_book run, so the library ends as it started
+    loans = []
+
+    def borrow():
+        isbn, member_id = pick(isbns), pick(member_ids)
+        if library.borrow_book(isbn, member_id):
+            loans.append((isbn, member_id))
+
+    def give_back():
+        if loans:
+            library.return_book(*loans.pop())
+
+    cases = [
+        ('search_books', lambda: library.search_books(queries[rng.randrange(len(queries))])),
+        ('borrow_book', borrow),
+        ('return_book', give_back),
+        ('get_overdue_books', library.get_overdue_books),
+        ('get_top_borrowers', library.get_top_borrowers),
+        ('get_member_borrow_history', lambda: library.get_member_borrow_history(pick(member_ids))),
+        ('get_statistics', library.get_statistics),
+        ('save_data', library.save_data),
+        ('load_data', library.load_data)
+    ]
+    for name, call in cases:
+        if methods and name not in methods:
+            continue
+        if (not isbns or not member_ids) and name in ('borrow_book', 'return_book', 'get_member_borrow_history'):
+            continue
+        count = 1 if name in ('save_data', 'load_data') else iterations
+        results[name] = _time_calls(call, count, trace_memory)
+        print(f"{name:28} median {results[name]['median_ms']:10.3f} ms   p95 {results[name]['p95_ms']:10.3f} ms")
+    while loans:
+        give_back()
+    return results
+
+
+def compare_results(baseline_file: str, current_file: str):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    with open(current_file) as f:
+        current = json.load(f)
+    print(f"{'method':28} {'baseline ms':>12} {'current ms':>12} {'speedup':>8}")
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        speedup = before['median_ms'] / result['median_ms'] if result['median_ms'] else float('inf')
+        print(f"{name:28} {before['median_ms']:12.3f} {result['median_ms']:12.3f} {speedup:7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LibrarySystem on a synthetic library")
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--members', type=int, default=20000)
+    parser.add_argument('--loans', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=20, help="calls per method (load/save run once)")
+    parser.add_argument('--storage', choices=['pickle', 'journal', 'snapshot', 'sqlite'],
+                        default='snapshot')
+    parser.add_argument('--methods', nargs='*', help="only run these methods")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="record tracemalloc peaks per call (slows every call down)")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON results file")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="compare two results files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        library = LibrarySystem(storage=make_storage(args.storage, directory))
+        started = time.perf_counter()
+        generate_library(library, args.books, args.members, args.loans, args.seed)
+        generate_s = time.perf_counter() - started
+        print(f"Generated {len(library.books)} books, {len(library.members)} members and "
+              f"{len(library.borrow_records)} loans in {generate_s:.1f} s")
+        results = run_benchmarks(library, args.iterations, args.seed, args.methods, args.trace_memory)
+        library.close()
+
+    report = {
+        'revision': _git_revision(),
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': vars(args),
+        'generate_s': generate_s,
+        'peak_rss_kb': _peak_rss_kb(),
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
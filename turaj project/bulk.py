@@ -0,0 +1,246 @@
+import argparse
+import csv
+import datetime
+import json
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from library import DATA_FILE, SNAPSHOT_FILE, LibrarySystem
+from storage import SQLiteStorage, SnapshotStorage
+
+# A book's availability is not a field: importing the loans checks out the books still on loan
+BOOK_FIELDS = ['isbn', 'title', 'author', 'category']
+MEMBER_FIELDS = ['member_id', 'name', 'contact', 'is_active']
+LOAN_FIELDS = ['isbn', 'member_id', 'borrow_date', 'return_date']
+
+
+class ImportReport:
+    def __init__(self):
+        self.accepted = 0
+        self.rejected: List[Tuple[int, str, dict]] = []  # (line number, reason, row)
+
+    def reject(self, line: int, reason: str, row: dict):
+        self.rejected.append((line, reason, row))
+
+
+def _is_jsonl(path: str) -> bool:
+    if path.endswith('.json'):
+        # Rows are streamed one line at a time, which a single JSON array does not allow
+        raise ValueError(f"{path}: use JSON lines (.jsonl or .ndjson) or CSV, not a .json file")
+    return path.endswith(('.jsonl', '.ndjson'))
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, dict]]:
+    # Streams (line number, row) from a CSV file with a header or from JSON lines
+    jsonl = _is_jsonl(path)
+    with open(path, newline='', encoding='utf-8') as f:
+        if jsonl:
+            for line, text in enumerate(f, 1):
+                if text.strip():
+                    try:
+                        row = json.loads(text)
+                    except ValueError:
+                        row = None
+                    yield line, row if isinstance(row, dict) else {'_raw': text.rstrip('\n')}
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+
+class _RowWriter:
+    def __init__(self, path: str, fields: List[str]):
+        self.jsonl = _is_jsonl(path)
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.fields = fields
+        if not self.jsonl:
+            self.writer = csv.DictWriter(self.file, fieldnames=fields)
+            self.writer.writeheader()
+
+    def write(self, row: dict):
+        if self.jsonl:
+            self.file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        else:
+            self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+def _text(row: dict, field: str) -> str:
+    value = row.get(field)
+    return '' if value is None else str(value).strip()
+
+
+def _flag(row: dict, field: str, default: bool) -> Optional[bool]:
+    # JSON true/false, or the True/False (also 1/0, yes/no) CSV export writes; None if unreadable
+    value = row.get(field)
+    if isinstance(value, bool):
+        return value
+    text = _text(row, field).lower()
+    if not text:
+        return default
+    if text in ('true', '1', 'yes'):
+        return True
+    if text in ('false', '0', 'no'):
+        return False
+    return None
+
+
+def _parse_date(value: str) -> Optional[datetime.datetime]:
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def _import(library: LibrarySystem, path: str, batch_size: int,
+            apply_row: Callable[[dict], Optional[str]]) -> ImportReport:
+    # apply_row returns None when the row was applied, otherwise the rejection reason
+    report = ImportReport()
+    rows = read_rows(path)
+    while True:
+        batch_done = True
+        with library.batch():
+            for count, (line, row) in enumerate(rows, 1):
+                reason = apply_row(row)
+                if reason:
+                    report.reject(line, reason, row)
+                else:
+                    report.accepted += 1
+                if count == batch_size:
+                    batch_done = False
+                    break
+        if batch_done:
+            return report
+
+
+def import_books(library: LibrarySystem, path: str, batch_size: int = 1000) -> ImportReport:
+    def apply_row(row: dict) -> Optional[str]:
+        isbn, title, author = _text(row, 'isbn'), _text(row, 'title'), _text(row, 'author')
+        if not isbn or not title or not author:
+            return "missing isbn, title or author"
+        if isbn in library.books:
+            return f"duplicate ISBN {isbn}"
+        library.add_book(title, author, _text(row, 'category'), isbn)
+        return None
+
+    return _import(library, path, batch_size, apply_row)
+
+
+def import_members(library: LibrarySystem, path: str, batch_size: int = 1000) -> ImportReport:
+    def apply_row(row: dict) -> Optional[str]:
+        member_id, name = _text(row, 'member_id'), _text(row, 'name')
+        if not member_id or not name:
+            return "missing member_id or name"
+        if member_id in library.members:
+            return f"duplicate member ID {member_id}"
+        is_active = _flag(row, 'is_active', True)
+        if is_active is None:
+            return "is_active must be true or false"
+        library.add_member(name, member_id, _text(row, 'contact'), is_active)
+        return None
+
+    return _import(library, path, batch_size, apply_row)
+
+
+def import_loans(library: LibrarySystem, path: str, batch_size: int = 1000) -> ImportReport:
+    def apply_row(row: dict) -> Optional[str]:
+        isbn, member_id = _text(row, 'isbn'), _text(row, 'member_id')
+        if isbn not in library.books:
+            return f"unknown ISBN {isbn}"
+        if member_id not in library.members:
+            return f"unknown member ID {member_id}"
+        try:
+            borrow_date = _parse_date(_text(row, 'borrow_date'))
+            return_date = _parse_date(_text(row, 'return_date'))
+        except ValueError:
+            return "dates must be ISO 8601"
+        if borrow_date is None:
+            return "missing borrow_date"
+        if borrow_date.utcoffset() is not None or (return_date and return_date.utcoffset() is not None):
+            return "dates must be naive local ISO 8601"  # Loan times compare with datetime.now()
+        if not library.import_loan(isbn, member_id, borrow_date, return_date):
+            return "book already on loan or return_date before borrow_date"
+        return None
+
+    return _import(library, path, batch_size, apply_row)
+
+
+def _export(path: str, fields: List[str], rows: Iterable[Dict]) -> int:
+    writer = _RowWriter(path, fields)
+    count = 0
+    try:
+        for row in rows:
+            writer.write(row)
+            count += 1
+    finally:
+        writer.close()
+    return count
+
+
+def export_books(library: LibrarySystem, path: str) -> int:
+    return _export(path, BOOK_FIELDS, ({
+        'isbn': book.isbn,
+        'title': book.title,
+        'author': book.author,
+        'category': book.category
+    } for book in library.books.values()))
+
+
+def export_members(library: LibrarySystem, path: str) -> int:
+    return _export(path, MEMBER_FIELDS, ({
+        'member_id': member.member_id,
+        'name': member.name,
+        'contact': member.contact,
+        'is_active': member.is_active
+    } for member in library.members.values()))
+
+
+def export_loans(library: LibrarySystem, path: str) -> int:
+    history = library.borrow_records
+
+    def loan_row(position: int) -> dict:
+        return_date = history.return_date(position)
+        return {
+            'isbn': history.book_isbn(position),
+            'member_id': history.member_id(position),
+            'borrow_date': history.borrow_date(position).isoformat(),
+            'return_date': return_date.isoformat() if return_date else ''
+        }
+
+    return _export(path, LOAN_FIELDS, (loan_row(position) for position in range(len(history))))
+
+
+IMPORTERS = {'books': import_books, 'members': import_members, 'loans': import_loans}
+EXPORTERS = {'books': export_books, 'members': export_members, 'loans': export_loans}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import or export library data as CSV or JSON lines")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('kind', choices=sorted(IMPORTERS))
+    parser.add_argument('path', help="CSV file, or .jsonl/.ndjson for JSON lines")
+    parser.add_argument('--batch-size', type=int, default=1000, help="rows persisted together")
+    parser.add_argument('--snapshot', default=SNAPSHOT_FILE, help="snapshot data file used by main.py")
+    parser.add_argument('--sqlite', help="use this SQLite database instead of the pickle file")
+    args = parser.parse_args()
+    if args.path.endswith('.json'):
+        parser.error("JSON files must be JSON lines, named .jsonl or .ndjson")
+
+    if args.sqlite:
+        library = LibrarySystem(storage=SQLiteStorage(args.sqlite))
+    else:
+        library = LibrarySystem(storage=SnapshotStorage(args.snapshot, legacy_file=DATA_FILE))
+    try:
+        if args.action == 'export':
+            count = EXPORTERS[args.kind](library, args.path)
+            print(f"Exported {count} {args.kind} to {args.path}")
+            return
+        report = IMPORTERS[args.kind](library, args.path, args.batch_size)
+        library.checkpoint()
+        print(f"Imported {report.accepted} {args.kind}, rejected {len(report.rejected)}")
+        for line, reason, row in report.rejected:
+            print(f"  line {line}: {reason}")
+    finally:
+        library.close()
+
+
+if __name__ == "__main__":
+    main()
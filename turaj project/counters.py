@@ -0,0 +1,75 @@
+import datetime
+from typing import Dict, Optional
+
+
+class LibraryCounters:
+    # Running totals behind get_statistics(); every mutation adjusts them so
+    # reading the statistics never scans books, members or loans
+    def __init__(self):
+        self.total_books = 0
+        self.available_books = 0
+        self.total_members = 0
+        self.active_members = 0
+        self.category_total: Dict[str, int] = {}
+        self.category_available: Dict[str, int] = {}
+        self._loans_day: Optional[datetime.date] = None
+        self._loans_today = 0
+
+    def book_added(self, book):
+        self.total_books += 1
+        self.category_total[book.category] = self.category_total.get(book.category, 0) + 1
+        if book.is_available:
+            self.available_books += 1
+            self.category_available[book.category] = self.category_available.get(book.category, 0) + 1
+
+    def book_removed(self, book):
+        self.total_books -= 1
+        self._decrement(self.category_total, book.category)
+        if book.is_available:
+            self.available_books -= 1
+            self._decrement(self.category_available, book.category)
+
+    def availability_changed(self, book, available: bool):
+        # Called before book.is_available is updated
+        if book.is_available == available:
+            return
+        step = 1 if available else -1
+        self.available_books += step
+        if available:
+            self.category_available[book.category] = self.category_available.get(book.category, 0) + 1
+        else:
+            self._decrement(self.category_available, book.category)
+
+    def member_added(self, member):
+        self.total_members += 1
+        if member.is_active:
+            self.active_members += 1
+
+    def member_removed(self, member):
+        self.total_members -= 1
+        if member.is_active:
+            self.active_members -= 1
+
+    def loan_recorded(self, borrow_date: datetime.datetime, count: int = 1):
+        # Only loans dated today count; the tally restarts when the day changes
+        today = datetime.date.today()
+        if borrow_date.date() != today:
+            return
+        if self._loans_day != today:
+            self._loans_day = today
+            self._loans_today = 0
+        self._loans_today += count
+
+    def loans_today(self, today: Optional[datetime.date] = None) -> int:
+        today = today or datetime.date.today()
+        return self._loans_today if self._loans_day == today else 0
+
+    def categories(self) -> Dict[str, Dict[str, int]]:
+        return {category: {'total': total, 'available': self.category_available.get(category, 0)}
+                for category, total in self.category_total.items()}
+
+    @staticmethod
+    def _decrement(counts: Dict[str, int], key: str):
+        counts[key] -= 1
+        if not counts[key]:
+            del counts[key]
@@ -0,0 +1,84 @@
+import bisect
+import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from loan_history import LoanHistory, to_micros
+
+DAY_MICROS = 24 * 3600 * 10 ** 6
+
+
+def overdue_cutoff(now: datetime.datetime, days_threshold: int) -> int:
+    # A loan is overdue once it has been out more than days_threshold full days, that is
+    # once it was borrowed at or before this time (microseconds since 1970)
+    return to_micros(now) - (days_threshold + 1) * DAY_MICROS
+
+
+class DueIndex:
+    # Open loans bucketed by the day they were borrowed: a timing wheel with one slot per
+    # day, plus the sorted list of days that have a slot. Every threshold orders loans by
+    # due date the same way, so "overdue now", "due in the next N days" and "became overdue
+    # since" are all borrow-time ranges; a range visits only its own days, and only its
+    # first and last day can hold loans outside it.
+    def __init__(self):
+        self._days: List[int] = []  # Days since 1970 with open loans, ascending
+        self._buckets: Dict[int, Dict[int, int]] = {}  # day -> position -> borrow time
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    @classmethod
+    def build(cls, history: LoanHistory, positions: Iterable[int]) -> 'DueIndex':
+        index = cls()
+        buckets = index._buckets
+        for position in sorted(positions):
+            borrowed = history.row(position)[2]
+            buckets.setdefault(borrowed // DAY_MICROS, {})[position] = borrowed
+        index._days = sorted(buckets)
+        return index
+
+    def add(self, position: int, borrowed: int):
+        day = borrowed // DAY_MICROS
+        bucket = self._buckets.get(day)
+        if bucket is None:
+            bucket = self._buckets[day] = {}
+            bisect.insort(self._days, day)  # New loans are borrowed today, so this appends
+        bucket[position] = borrowed
+
+    def remove(self, position: int, borrowed: int):
+        day = borrowed // DAY_MICROS
+        bucket = self._buckets[day]
+        del bucket[position]
+        if not bucket:
+            del self._buckets[day]
+            del self._days[bisect.bisect_left(self._days, day)]
+
+    def between(self, start: Optional[int], end: int) -> Iterator[Tuple[int, int]]:
+        # (borrow time, position) of the loans borrowed after start (None: from the oldest)
+        # and at or before end, in borrow order
+        days = self._days
+        low = 0 if start is None else bisect.bisect_left(days, start // DAY_MICROS)
+        high = bisect.bisect_right(days, end // DAY_MICROS)
+        for day in days[low:high]:
+            bucket = self._buckets[day]
+            yield from sorted((borrowed, position) for position, borrowed in bucket.items()
+                              if (start is None or borrowed > start) and borrowed <= end)
+
+    def walk(self, end: int, after: Optional[Tuple[int, int]] = None) -> Iterator[Tuple[int, int]]:
+        # (borrow time, position) of the loans borrowed at or before end, in borrow order,
+        # resuming after the loan with the given (borrow time, position) key; a caller taking
+        # a page at a time only sorts the days the page reaches
+        days = self._days
+        index = 0 if after is None else bisect.bisect_left(days, after[0] // DAY_MICROS)
+        while index < len(days) and days[index] <= end // DAY_MICROS:
+            yield from sorted((borrowed, position) for position, borrowed in self._buckets[days[index]].items()
+                              if (after is None or (borrowed, position) > after) and borrowed <= end)
+            index += 1
+
+    def next_after(self, time: int) -> Optional[int]:
+        # Borrow time of the oldest loan borrowed after time, or None
+        days = self._days
+        for index in range(bisect.bisect_left(days, time // DAY_MICROS), len(days)):
+            later = [borrowed for borrowed in self._buckets[days[index]].values() if borrowed > time]
+            if later:
+                return min(later)
+        return None
@@ -0,0 +1,159 @@
+import re
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+# Author facet counts need a walk over the matching books; above this many they are left out
+AUTHOR_FACET_MAX = 20000
+_NONZERO_BYTE = re.compile(rb'[^\x00]')
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def bitmap_of(doc_ids: Iterable[int]) -> int:
+    # Sets one bit per doc id through a bytearray: setting bits on an int one at a time
+    # would copy the whole int for every id
+    doc_ids = list(doc_ids)
+    if not doc_ids:
+        return 0
+    data = bytearray(max(doc_ids) // 8 + 1)
+    for doc_id in doc_ids:
+        data[doc_id >> 3] |= 1 << (doc_id & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_bits(bitmap: int, start: int = 0) -> Iterator[int]:
+    # Doc ids of the set bits, ascending from start; runs of empty bytes are skipped in C
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for match in _NONZERO_BYTE.finditer(data, start >> 3):
+        position = match.start()
+        for bit in _BYTE_BITS[data[position]]:
+            doc_id = position * 8 + bit
+            if doc_id >= start:
+                yield doc_id
+
+
+class FacetIndex:
+    # Books get a doc id in insertion order, so results keep the catalogue's order.
+    # Availability and categories have few values and many books each, so they are
+    # bitmaps (Python ints, one bit per doc id) that combine with & and count with
+    # bit_count(). Authors have many values with few books each, so they are posting sets.
+    def __init__(self):
+        self._doc_ids: Dict[str, int] = {}  # ISBN -> doc id
+        self._isbns: List[Optional[str]] = []  # doc id -> ISBN, None once deleted
+        self._authors: List[Optional[str]] = []  # doc id -> author, for author facet counts
+        self.live = 0  # Every book in the catalogue
+        self.available = 0
+        self.categories: Dict[str, int] = {}
+        self.authors: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    @classmethod
+    def build(cls, books: Iterable) -> 'FacetIndex':
+        index = cls()
+        available: List[int] = []
+        categories: Dict[str, List[int]] = {}
+        for doc_id, book in enumerate(books):
+            index._doc_ids[book.isbn] = doc_id
+            index._isbns.append(book.isbn)
+            index._authors.append(book.author)
+            if book.is_available:
+                available.append(doc_id)
+            categories.setdefault(book.category, []).append(doc_id)
+            index.authors.setdefault(book.author, set()).add(doc_id)
+        count = len(index._isbns)
+        index.live = (1 << count) - 1
+        index.available = bitmap_of(available)
+        index.categories = {category: bitmap_of(doc_ids) for category, doc_ids in categories.items()}
+        return index
+
+    def bitmap_for(self, isbns: Iterable[str]) -> int:
+        doc_ids = self._doc_ids
+        return bitmap_of([doc_ids[isbn] for isbn in isbns])
+
+    def isbn(self, doc_id: int) -> str:
+        return self._isbns[doc_id]
+
+    def add(self, book):
+        doc_id = self._doc_ids[book.isbn] = len(self._isbns)
+        self._isbns.append(book.isbn)
+        self._authors.append(book.author)
+        bit = 1 << doc_id
+        self.live |= bit
+        if book.is_available:
+            self.available |= bit
+        self.categories[book.category] = self.categories.get(book.category, 0) | bit
+        self.authors.setdefault(book.author, set()).add(doc_id)
+
+    def remove(self, book):
+        doc_id = self._doc_ids.pop(book.isbn)
+        self._isbns[doc_id] = None
+        self._authors[doc_id] = None
+        mask = ~(1 << doc_id)
+        self.live &= mask
+        self.available &= mask
+        self._drop(book.category, book.author, doc_id)
+
+    def update(self, book, old_category: str, old_author: str):
+        # Called after an edit; the doc id and so the book's place in results stay the same
+        if book.category == old_category and book.author == old_author:
+            return
+        doc_id = self._doc_ids[book.isbn]
+        self._drop(old_category, old_author, doc_id)
+        self._authors[doc_id] = book.author
+        self.categories[book.category] = self.categories.get(book.category, 0) | (1 << doc_id)
+        self.authors.setdefault(book.author, set()).add(doc_id)
+
+    def _drop(self, category: str, author: str, doc_id: int):
+        bitmap = self.categories[category] & ~(1 << doc_id)
+        if bitmap:
+            self.categories[category] = bitmap
+        else:
+            del self.categories[category]
+        doc_ids = self.authors[author]
+        doc_ids.discard(doc_id)
+        if not doc_ids:
+            del self.authors[author]
+
+    def set_available(self, isbn: str, available: bool):
+        bit = 1 << self._doc_ids[isbn]
+        if available:
+            self.available |= bit
+        else:
+            self.available &= ~bit
+
+    def filters(self, category: Optional[str], author: Optional[str], available: Optional[bool]) -> Dict[str, int]:
+        # One bitmap per active filter; AND them for the matching books
+        filters = {}
+        if category is not None:
+            filters['category'] = self.categories.get(category, 0)
+        if author is not None:
+            filters['author'] = bitmap_of(self.authors.get(author, ()))
+        if available is not None:
+            filters['available'] = self.available if available else self.live & ~self.available
+        return filters
+
+    def match(self, filters: Dict[str, int], without: Optional[str] = None) -> int:
+        bitmap = self.live
+        for name, filter_bitmap in filters.items():
+            if name != without:
+                bitmap &= filter_bitmap
+        return bitmap
+
+    def facet_counts(self, filters: Dict[str, int], limit: int = 10) -> Dict:
+        # Each facet is counted with every other filter applied but its own, so the counts
+        # say how many books picking that value would give
+        by_category = self.match(filters, 'category')
+        categories = Counter({category: (bitmap & by_category).bit_count()
+                              for category, bitmap in self.categories.items()})
+        by_availability = self.match(filters, 'available')
+        available = (by_availability & self.available).bit_count()
+        by_author = self.match(filters, 'author')
+        authors = None
+        if by_author.bit_count() <= AUTHOR_FACET_MAX:
+            authors = dict(Counter(self._authors[doc_id] for doc_id in iter_bits(by_author)).most_common(limit))
+        return {
+            'category': {category: count for category, count in categories.most_common() if count},
+            'author': authors,
+            'availability': {'available': available, 'borrowed': by_availability.bit_count() - available}
+        }
@@ -0,0 +1,103 @@
+import os
+import pickle
+import struct
+import zlib
+from typing import BinaryIO, Iterator, List, Optional
+
+# Each record: payload length, crc32 of payload, sequence number, then the pickled op
+_HEADER = struct.Struct('<IIQ')
+
+
+def fsync_directory(path: str):
+    # A new or renamed file survives a power cut only once its directory entry is on disk;
+    # Windows cannot open a directory, and its renames need no such step
+    if os.name == 'nt':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class MutationJournal:
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self.last_seq = 0
+        self.entries = 0  # Records currently in the file (stale ones included)
+        self.bytes_written = 0  # Appended by this process
+        self._file: Optional[BinaryIO] = None
+
+    def replay(self, after_seq: int = 0) -> Iterator[tuple]:
+        self.last_seq = max(self.last_seq, after_seq)
+        self.entries = 0
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        good_offset = 0
+        with f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc, seq = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                good_offset = f.tell()
+                self.entries += 1
+                if seq > self.last_seq:
+                    self.last_seq = seq
+                    yield pickle.loads(payload)
+            torn = f.tell() != good_offset
+        # A crash mid-append leaves a torn tail; drop it so new records follow a valid one
+        if torn:
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_offset)
+
+    def append(self, op: tuple) -> int:
+        return self.append_many([op])
+
+    def append_many(self, ops: List[tuple]) -> int:
+        # One write and one fsync for the whole group
+        chunks = []
+        for op in ops:
+            payload = pickle.dumps(op, protocol=pickle.HIGHEST_PROTOCOL)
+            self.last_seq += 1
+            chunks.append(_HEADER.pack(len(payload), zlib.crc32(payload), self.last_seq))
+            chunks.append(payload)
+        created = False
+        if self._file is None:
+            created = not os.path.exists(self.path)
+            self._file = open(self.path, 'ab')
+        data = b''.join(chunks)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+            if created:
+                fsync_directory(self.path)
+        self.entries += len(ops)
+        self.bytes_written += len(data)
+        return self.last_seq
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def reset(self):
+        # Called after a checkpoint: every record is now covered by the snapshot
+        self.close()
+        with open(self.path, 'wb') as f:
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.entries = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,179 @@
+import datetime
+import heapq
+from collections import Counter
+from operator import itemgetter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loan_history import LoanHistory, to_micros
+
+WINDOWS = ('last_30_days', 'this_year')
+_RECENT_DAYS = 30
+_DAY_MICROS = 24 * 3600 * 10 ** 6
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+class BorrowCounter:
+    # Borrow counts per key (member, ISBN or category): all-time totals, plus
+    # daily buckets covering the last 30 days and monthly buckets for this year
+    def __init__(self):
+        self.totals: Dict[str, int] = {}
+        self._days: Dict[int, Dict[str, int]] = {}  # date ordinal -> key -> count
+        self._months: Dict[int, Dict[str, int]] = {}  # month of the current year -> key -> count
+        self._today: Optional[datetime.date] = None
+
+    def add(self, key: str, when: datetime.datetime, count: int = 1):
+        self.totals[key] = self.totals.get(key, 0) + count
+        self.add_recent(key, when, count)
+
+    def add_recent(self, key: str, when: datetime.datetime, count: int = 1):
+        # Window buckets only; the caller has counted the loan in totals
+        self.add_day(when.date(), {key: count})
+
+    def add_day(self, day: datetime.date, counts: Dict[str, int]):
+        today = self._roll()
+        buckets = []
+        if day.year == today.year:
+            buckets.append(self._months.setdefault(day.month, {}))
+        if today.toordinal() - day.toordinal() < _RECENT_DAYS:
+            buckets.append(self._days.setdefault(day.toordinal(), {}))
+        for bucket in buckets:
+            for key, count in counts.items():
+                bucket[key] = bucket.get(key, 0) + count
+
+    def _roll(self) -> datetime.date:
+        # Drops buckets that fell out of their window since the last call
+        today = datetime.date.today()
+        if today != self._today:
+            if self._today is None or today.year != self._today.year:
+                self._months = {}
+            oldest = today.toordinal() - _RECENT_DAYS
+            self._days = {ordinal: bucket for ordinal, bucket in self._days.items() if ordinal > oldest}
+            self._today = today
+        return today
+
+    def counts(self, window: Optional[str] = None) -> Dict[str, int]:
+        if window is None:
+            return self.totals
+        today = self._roll()
+        if window == 'last_30_days':
+            buckets = [bucket for ordinal, bucket in self._days.items() if ordinal <= today.toordinal()]
+        elif window == 'this_year':
+            buckets = [bucket for month, bucket in self._months.items() if month <= today.month]
+        else:
+            raise ValueError(f"unknown window {window!r}, expected one of {WINDOWS}")
+        if len(buckets) == 1:
+            return buckets[0]
+        merged: Dict[str, int] = {}
+        for bucket in buckets:
+            for key, count in bucket.items():
+                merged[key] = merged.get(key, 0) + count
+        return merged
+
+    def top(self, limit: int, window: Optional[str] = None,
+            keep: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, int]]:
+        # The limit largest (key, count) pairs, by a bounded heap rather than a full sort
+        items = self.counts(window).items()
+        if keep is not None:
+            items = (item for item in items if keep(item[0]))
+        return heapq.nlargest(limit, items, key=itemgetter(1))
+
+
+class Leaderboards:
+    def __init__(self):
+        self.members = BorrowCounter()
+        self.books = BorrowCounter()
+        self.categories = BorrowCounter()
+
+    def record(self, isbn: str, member_id: str, category: Optional[str], when: datetime.datetime):
+        self.members.add(member_id, when)
+        self.books.add(isbn, when)
+        if category is not None:
+            self.categories.add(category, when)
+
+    def move_book(self, isbn: str, old_category: Optional[str], new_category: Optional[str]):
+        # Moves a book's loans to another category (None: no category, the book is deleted),
+        # so category counts always follow the books' current categories, as build() counts them.
+        # The book counter holds the book's count in every bucket the category counter has
+        books, categories = self.books, self.categories
+        books._roll()
+        categories._roll()
+        pairs = [(books.totals, categories.totals)]
+        pairs += [(bucket, categories._days.setdefault(ordinal, {})) for ordinal, bucket in books._days.items()]
+        pairs += [(bucket, categories._months.setdefault(month, {})) for month, bucket in books._months.items()]
+        for source, target in pairs:
+            count = source.get(isbn)
+            if not count:
+                continue
+            if old_category is not None:
+                left = target.get(old_category, 0) - count
+                if left > 0:
+                    target[old_category] = left
+                else:
+                    target.pop(old_category, None)
+            if new_category is not None:
+                target[new_category] = target.get(new_category, 0) + count
+
+    @classmethod
+    def build(cls, history: LoanHistory, books: Dict) -> 'Leaderboards':
+        # Totals come from counting the interned id columns of the history and of each
+        # archived segment; only loans recent enough for a window are visited one by one,
+        # newest first
+        boards = cls()
+        member_totals: Counter = Counter()
+        isbn_totals: Counter = Counter()
+        for part in history.parts():
+            member_codes: Counter = Counter()
+            isbn_codes: Counter = Counter()
+            for chunk in part.member_ids.buffers():
+                member_codes.update(chunk)
+            for chunk in part.isbn_ids.buffers():
+                isbn_codes.update(chunk)
+            member_totals.update({part.member_table[code]: count for code, count in member_codes.items()})
+            isbn_totals.update({part.isbn_table[code]: count for code, count in isbn_codes.items()})
+        boards.members.totals = dict(member_totals)
+        boards.books.totals = dict(isbn_totals)
+        for isbn, count in boards.books.totals.items():
+            book = books.get(isbn)
+            if book is not None:
+                categories = boards.categories.totals
+                categories[book.category] = categories.get(book.category, 0) + count
+
+        today = datetime.date.today()
+        start = min(datetime.date(today.year, 1, 1), today - datetime.timedelta(days=_RECENT_DAYS))
+        start_micros = to_micros(datetime.datetime.combine(start, datetime.time()))
+        days: Dict[int, Tuple[Counter, Counter]] = {}  # day ordinal -> (member IDs, ISBNs)
+        # Loans are appended in borrow order apart from back-dated imports
+        for part in history.parts(newest_first=True):
+            borrow_times, member_ids, isbn_ids = part.borrow_times, part.member_ids, part.isbn_ids
+            part_days: Dict[int, Tuple[Counter, Counter]] = {}  # day ordinal -> (member codes, ISBN codes)
+            reached_start = False
+            for position in range(len(borrow_times) - 1, -1, -1):
+                borrowed = borrow_times[position]
+                if borrowed < start_micros:
+                    reached_start = True
+                    break
+                ordinal = borrowed // _DAY_MICROS + _EPOCH_ORDINAL
+                day = part_days.get(ordinal)
+                if day is None:
+                    day = part_days[ordinal] = (Counter(), Counter())
+                day[0][member_ids[position]] += 1
+                day[1][isbn_ids[position]] += 1
+            for ordinal, (day_members, day_isbns) in part_days.items():
+                day = days.get(ordinal)
+                if day is None:
+                    day = days[ordinal] = (Counter(), Counter())
+                day[0].update({part.member_table[code]: count for code, count in day_members.items()})
+                day[1].update({part.isbn_table[code]: count for code, count in day_isbns.items()})
+            if reached_start:
+                break
+        for ordinal, (day_members, isbn_counts) in days.items():
+            day = datetime.date.fromordinal(ordinal)
+            boards.members.add_day(day, dict(day_members))
+            boards.books.add_day(day, dict(isbn_counts))
+            category_counts: Dict[str, int] = {}
+            for isbn, count in isbn_counts.items():
+                book = books.get(isbn)
+                if book is not None:
+                    category_counts[book.category] = category_counts.get(book.category, 0) + count
+            boards.categories.add_day(day, category_counts)
+        return boards
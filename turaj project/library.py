@@ -1,8 +1,40 @@
+import bisect
 import datetime
-import pickle
-from typing import List, Dict, Optional
+import functools
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterator, List, Dict, Optional, Tuple
+
+from analytics import LoanColumns
+from counters import LibraryCounters
+from due_index import DAY_MICROS, DueIndex, overdue_cutoff
+from facets import FacetIndex, iter_bits
+from leaderboard import Leaderboards
+from loan_history import NOT_RETURNED, LoanHistory, from_micros, to_micros
+from metrics import Metrics
+from paging import CHUNK_SIZE, take_page
+from query_cache import QueryCache
+from rwlock import ReadWriteLock
+from search_index import NGramIndex, ngrams
+from storage import GroupCommitStorage, Storage, PickleStorage
+
+DATA_FILE = 'library_data.pkl'
+SNAPSHOT_FILE = 'library_data.snap'
+
+class _Slotted:
+    __slots__ = ()
+
+    def __setstate__(self, state):
+        # Slot pickles arrive as (None, slots); snapshots from before __slots__ as a plain dict
+        if isinstance(state, tuple):
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
+
+class Book(_Slotted):
+    __slots__ = ('title', 'author', 'category', 'isbn', 'is_available')
 
-class Book:
     def __init__(self, title: str, author: str, category: str, isbn: str):
         self.title = title
         self.author = author
@@ -10,116 +42,645 @@ class Book:
         self.isbn = isbn
         self.is_available = True
 
-class Member:
+class Member(_Slotted):
+    __slots__ = ('name', 'member_id', 'contact', 'borrowed_books', 'is_active')
+
     def __init__(self, name: str, member_id: str, contact: str):
         self.name = name
         self.member_id = member_id
         self.contact = contact
-        self.borrowed_books: List[str] = []  # List of ISBN numbers
+        self.borrowed_books: Dict[str, None] = {}  # ISBN numbers, kept as an ordered set
         self.is_active = True
 
-class BorrowRecord:
-    def __init__(self, book_isbn: str, member_id: str):
+class BorrowRecord(_Slotted):
+    # Standalone loan value; the history itself lives in a compact LoanHistory
+    __slots__ = ('book_isbn', 'member_id', 'borrow_date', 'return_date')
+
+    def __init__(self, book_isbn: str, member_id: str, borrow_date: Optional[datetime.datetime] = None):
         self.book_isbn = book_isbn
         self.member_id = member_id
-        self.borrow_date = datetime.datetime.now()
+        self.borrow_date = borrow_date or datetime.datetime.now()
         self.return_date: Optional[datetime.datetime] = None
 
+def _reader(method):
+    # Shared lock in thread-safe mode: readers run in parallel with each other
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        if self._lock is None:
+            return method(self, *args, **kwargs)
+        with self._lock.read():
+            return method(self, *args, **kwargs)
+    return locked
+
+def _writer(method):
+    # Exclusive lock in thread-safe mode, so a check and its mutation are atomic
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        if self._lock is None:
+            return method(self, *args, **kwargs)
+        with self._lock.write():
+            return method(self, *args, **kwargs)
+    return locked
+
 class LibrarySystem:
-    def __init__(self):
+    def __init__(self, data_file: str = DATA_FILE, journaled: bool = False,
+                 checkpoint_interval: int = 1000, storage: Optional[Storage] = None,
+                 thread_safe: bool = False, durability: str = 'always', flush_interval_ms: int = 100,
+                 metrics: Optional[Metrics] = None, query_cache: Optional[QueryCache] = None):
         self.books: Dict[str, Book] = {}  # ISBN -> Book
         self.members: Dict[str, Member] = {}  # member_id -> Member
-        self.borrow_records: List[BorrowRecord] = []
+        self.borrow_records = LoanHistory()
+        # Persistence backend; the default is the pickle snapshot, optionally journaled
+        self.storage = storage or PickleStorage(data_file, journaled, checkpoint_interval)
+        # 'interval' and 'shutdown' take writes off the calling thread; see GroupCommitStorage
+        if durability != 'always':
+            self.storage = GroupCommitStorage(self.storage, durability, flush_interval_ms / 1000)
+        # Trigram postings for search_books(); loaded with the data (or built if the backend
+        # did not save them), then kept in sync by the _apply_* methods
+        self.search_index = NGramIndex()
+        self._leaderboards: Optional[Leaderboards] = None  # Borrow counts, built on the first top-k query
+        self._facet_index: Optional[FacetIndex] = None  # Category/author/availability bitmaps, built on first browse
+        self._loan_columns: Optional[LoanColumns] = None  # NumPy projection of the loans, built on the first report
+        self._due_index: Optional[DueIndex] = None  # Open loans by borrow day, built on the first overdue query
+        self._title_index: Dict[str, List[str]] = {}  # lowercased title -> ISBNs
+        self._author_title_index: Dict[Tuple[str, str], List[str]] = {}  # (author, title) -> ISBNs
+        # Sorted keys give the iter_* generators a stable order to resume from; built on first use
+        self._sorted_isbns: Optional[List[str]] = None
+        self._sorted_member_ids: Optional[List[str]] = None
+        self.open_loans: Dict[str, int] = {}  # ISBN -> position of its open loan in borrow_records
+        self.counters = LibraryCounters()  # Totals behind get_statistics(), kept in sync like the indexes
+        self._pending_ops: Optional[List[tuple]] = None  # Ops waiting for the end of a batch()
+        # Reader/writer lock for sharing one library between threads; None skips locking.
+        # The interval flusher is a second thread, so it always needs the lock
+        thread_safe = thread_safe or durability == 'interval'
+        self._lock: Optional[ReadWriteLock] = ReadWriteLock() if thread_safe else None
+        self._build_lock = threading.Lock()  # Lazy indexes can be first needed by two readers at once
+        # Optional instrumentation; when None no method is wrapped and nothing is counted
+        self.metrics = metrics
+        # Optional result cache for searches and reports, invalidated by the _apply_* methods
+        self.query_cache = query_cache
+        if metrics is not None:
+            metrics.instrument(self)
         self.load_data()
 
+    @_writer
     def load_data(self):
-        try:
-            with open('library_data.pkl', 'rb') as f:
-                data = pickle.load(f)
-                self.books = data['books']
-                self.members = data['members']
-                self.borrow_records = data['borrow_records']
-        except FileNotFoundError:
-            pass
+        self._leaderboards = None
+        self._facet_index = None
+        self._loan_columns = None
+        self._due_index = None
+        self._sorted_isbns = None
+        self._sorted_member_ids = None
+        if self.query_cache is not None:
+            self.query_cache.clear()
+        data, pending_ops = self.storage.load()
+        open_loans = search_index = None
+        if data:
+            self.books = data['books']
+            self.members = data['members']
+            self.borrow_records = data['borrow_records']
+            open_loans = data.get('open_loans')
+            search_index = data.get('search_index')
+        self._rebuild_indexes(open_loans, search_index)
+        # Ops logged after the last snapshot (journaled pickle storage)
+        for op in pending_ops:
+            self._apply(op)
 
+    @_writer
     def save_data(self):
-        data = {
-            'books': self.books,
-            'members': self.members,
-            'borrow_records': self.borrow_records
-        }
-        with open('library_data.pkl', 'wb') as f:
-            pickle.dump(data, f)
+        self.storage.save(self)
+
+    @_writer
+    def checkpoint(self):
+        self.storage.checkpoint(self)
+
+    @_writer
+    def flush(self):
+        # Writes ops still held back by the durability level; returns once they are on disk
+        self.storage.flush(self)
+
+    @_writer
+    def close(self):
+        self.storage.close()
+
+    def _commit(self, op: tuple):
+        self._apply(op)
+        if self._pending_ops is not None:
+            self._pending_ops.append(op)
+        else:
+            self.storage.record(self, [op])
+
+    @contextmanager
+    def reading(self):
+        # Holds the shared lock while a caller reads books, members or loans directly
+        if self._lock is None:
+            yield
+            return
+        with self._lock.read():
+            yield
+
+    @contextmanager
+    def writing(self):
+        # Holds the exclusive lock, e.g. while persisting from another thread
+        if self._lock is None:
+            yield
+            return
+        with self._lock.write():
+            yield
+
+    @contextmanager
+    def batch(self):
+        # Mutations inside the block apply immediately but are persisted once, on exit;
+        # in thread-safe mode other threads wait until the batch is done
+        if self._lock is not None:
+            self._lock.acquire_write()
+        try:
+            if self._pending_ops is not None:  # Nested batches join the outer one
+                yield
+                return
+            self._pending_ops = []
+            try:
+                yield
+            finally:
+                ops, self._pending_ops = self._pending_ops, None
+                if ops:
+                    self.storage.record(self, ops)
+        finally:
+            if self._lock is not None:
+                self._lock.release_write()
+
+    def _apply(self, op: tuple):
+        getattr(self, '_apply_' + op[0])(*op[1:])
+
+    def _rebuild_indexes(self, open_loans: Optional[Dict[str, int]] = None,
+                         search_index: Optional[NGramIndex] = None):
+        self._title_index = {}
+        self._author_title_index = {}
+        self.counters = LibraryCounters()
+        for book in self.books.values():
+            self._index_book(book)
+        for member in self.members.values():
+            self.counters.member_added(member)
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        loans_today = self.borrow_records.count_recent(today, today + datetime.timedelta(days=1))
+        self.counters.loan_recorded(today, loans_today)
+        # Scanning the history is the slow path; snapshot storage saves the open loans
+        self.open_loans = open_loans if open_loans is not None else self.borrow_records.open_loans()
+        # Building the search index takes seconds for a few hundred thousand books, so it is
+        # done here rather than under the build lock at the first search; pickle and snapshot
+        # storage save it with the catalogue
+        if search_index is None or len(search_index) != len(self.books):
+            search_index = NGramIndex()
+            for isbn, book in self.books.items():
+                search_index.add(isbn, self._search_fields(book))
+            if self.metrics is not None:
+                self.metrics.increment('search_index_build')
+        self.search_index = search_index
+
+    def _invalidate(self, *scopes):
+        # Scopes: 'books' (any catalog change), ('gram', g) (books whose search fields contain g),
+        # 'catalog' (titles of existing books), 'members', ('member', id) and 'loans'
+        if self.query_cache is not None:
+            self.query_cache.bump(*scopes)
+
+    def _invalidate_book(self, *fields: tuple):
+        # A search result can only change if the book's trigrams cover all of the query's
+        if self.query_cache is not None:
+            grams = set().union(*(ngrams(book_fields) for book_fields in fields))
+            self.query_cache.bump('books', *(('gram', gram) for gram in grams))
+
+    def _cached(self, key: tuple, scopes, compute) -> list:
+        # compute() returns the result and the seconds until it goes stale with the clock, or None.
+        # Returns a copy, so a caller changing the list does not change the cached one
+        cache = self.query_cache
+        if cache is None:
+            return compute()[0]
+        found, value = cache.lookup(key)
+        if self.metrics is not None:
+            self.metrics.increment(f"query_cache_{'hit' if found else 'miss'}")
+        if not found:
+            value, stale_in = compute()
+            cache.store(key, scopes, value, stale_in)
+        return list(value)
+
+    def _index_book(self, book: Book):
+        title = book.title.lower()
+        self._title_index.setdefault(title, []).append(book.isbn)
+        self._author_title_index.setdefault((book.author.lower(), title), []).append(book.isbn)
+        self.counters.book_added(book)
+
+    def _unindex_book(self, book: Book):
+        title = book.title.lower()
+        for index, key in ((self._title_index, title),
+                           (self._author_title_index, (book.author.lower(), title))):
+            isbns = index[key]
+            isbns.remove(book.isbn)
+            if not isbns:
+                del index[key]
+        self.counters.book_removed(book)
+
+    def _apply_add_book(self, title: str, author: str, category: str, isbn: str):
+        book = Book(title, author, category, isbn)
+        self.books[isbn] = book
+        self._index_book(book)
+        self.search_index.add(isbn, self._search_fields(book))
+        if self._sorted_isbns is not None:
+            bisect.insort(self._sorted_isbns, isbn)
+        if self._facet_index is not None:
+            self._facet_index.add(book)
+        if self._leaderboards is not None:  # A re-added ISBN brings back its earlier loans
+            self._leaderboards.move_book(isbn, None, category)
+        if self._loan_columns is not None:
+            self._loan_columns.set_category(isbn, category)
+        self._invalidate_book(self._search_fields(book))
+
+    def _apply_edit_book(self, isbn: str, title: Optional[str], author: Optional[str], category: Optional[str]):
+        book = self.books[isbn]
+        old_fields = self._search_fields(book)
+        old_category, old_author = book.category, book.author
+        self._unindex_book(book)
+        if title:
+            book.title = title
+        if author:
+            book.author = author
+        if category:
+            book.category = category
+        self._index_book(book)
+        self.search_index.update(isbn, old_fields, self._search_fields(book))
+        if self._facet_index is not None:
+            self._facet_index.update(book, old_category, old_author)
+        if self._leaderboards is not None and book.category != old_category:
+            self._leaderboards.move_book(isbn, old_category, book.category)
+        if self._loan_columns is not None and book.category != old_category:
+            self._loan_columns.set_category(isbn, book.category)
+        self._invalidate_book(old_fields, self._search_fields(book))
+        self._invalidate('catalog')
+
+    def _apply_delete_book(self, isbn: str):
+        book = self.books.pop(isbn)
+        self._unindex_book(book)
+        self.search_index.remove(isbn, self._search_fields(book))
+        if self._sorted_isbns is not None:
+            del self._sorted_isbns[bisect.bisect_left(self._sorted_isbns, isbn)]
+        if self._facet_index is not None:
+            self._facet_index.remove(book)
+        if self._leaderboards is not None:
+            self._leaderboards.move_book(isbn, book.category, None)
+        if self._loan_columns is not None:
+            self._loan_columns.set_category(isbn, None)
+        self._invalidate_book(self._search_fields(book))
+        self._invalidate('catalog')
+
+    def _apply_add_member(self, name: str, member_id: str, contact: str, is_active: bool = True):
+        # Journals written before is_active was part of the op replay as active members
+        member = self.members[member_id] = Member(name, member_id, contact)
+        member.is_active = is_active
+        self.counters.member_added(member)
+        if self._sorted_member_ids is not None:
+            bisect.insort(self._sorted_member_ids, member_id)
+        self._invalidate('members', ('member', member_id))
 
+    def _apply_edit_member(self, member_id: str, name: Optional[str], contact: Optional[str]):
+        member = self.members[member_id]
+        if name:
+            member.name = name
+        if contact:
+            member.contact = contact
+        self._invalidate('members')
+
+    def _apply_delete_member(self, member_id: str):
+        self.counters.member_removed(self.members.pop(member_id))
+        if self._sorted_member_ids is not None:
+            del self._sorted_member_ids[bisect.bisect_left(self._sorted_member_ids, member_id)]
+        self._invalidate('members', ('member', member_id))
+
+    def _set_available(self, isbn: str, available: bool):
+        book = self.books[isbn]
+        self.counters.availability_changed(book, available)
+        book.is_available = available
+        if self._facet_index is not None:
+            self._facet_index.set_available(isbn, available)
+
+    def _apply_borrow_book(self, isbn: str, member_id: str, when: datetime.datetime):
+        self._set_available(isbn, False)
+        self.counters.loan_recorded(when)
+        if self._leaderboards is not None:
+            self._leaderboards.record(isbn, member_id, self.books[isbn].category, when)
+        self.members[member_id].borrowed_books[isbn] = None
+        position = self.open_loans[isbn] = self.borrow_records.add(isbn, member_id, when)
+        if self._due_index is not None:
+            self._due_index.add(position, to_micros(when))
+        if self._loan_columns is not None:
+            self._loan_columns.add(isbn, member_id, to_micros(when), NOT_RETURNED, self.books[isbn].category)
+        self._invalidate('loans', ('member', member_id))
+
+    def _apply_return_book(self, isbn: str, member_id: str, when: datetime.datetime):
+        self._set_available(isbn, True)
+        del self.members[member_id].borrowed_books[isbn]
+
+        # Update borrow record
+        position = self.open_loans.pop(isbn, None)
+        if position is not None:
+            if self._due_index is not None:
+                self._due_index.remove(position, self.borrow_records.row(position)[2])
+            self.borrow_records.set_return(position, when)
+            if self._loan_columns is not None:
+                self._loan_columns.set_return(position, to_micros(when))
+        self._invalidate('loans', ('member', member_id))
+
+    def _apply_import_loan(self, isbn: str, member_id: str, borrow_date: datetime.datetime,
+                           return_date: Optional[datetime.datetime]):
+        position = self.borrow_records.add(isbn, member_id, borrow_date, return_date)
+        self.counters.loan_recorded(borrow_date)
+        if self._leaderboards is not None:
+            self._leaderboards.record(isbn, member_id, self.books[isbn].category, borrow_date)
+        if return_date is None:
+            self.open_loans[isbn] = position
+            if self._due_index is not None:
+                self._due_index.add(position, to_micros(borrow_date))
+            self._set_available(isbn, False)
+            self.members[member_id].borrowed_books[isbn] = None
+        if self._loan_columns is not None:
+            self._loan_columns.add(isbn, member_id, to_micros(borrow_date),
+                                   to_micros(return_date) if return_date is not None else NOT_RETURNED,
+                                   self.books[isbn].category)
+        self._invalidate('loans', ('member', member_id))
+
+    @_writer
     def add_book(self, title: str, author: str, category: str, isbn: str) -> bool:
         if isbn in self.books:
             return False
-        self.books[isbn] = Book(title, author, category, isbn)
-        self.save_data()
+        self._commit(('add_book', title, author, category, isbn))
+        return True
+
+    @_writer
+    def edit_book(self, isbn: str, title: str = None, author: str = None, category: str = None) -> bool:
+        if isbn not in self.books:
+            return False
+        self._commit(('edit_book', isbn, title, author, category))
         return True
 
-    def add_member(self, name: str, member_id: str, contact: str) -> bool:
+    @_writer
+    def add_member(self, name: str, member_id: str, contact: str, is_active: bool = True) -> bool:
         if member_id in self.members:
             return False
-        self.members[member_id] = Member(name, member_id, contact)
-        self.save_data()
+        self._commit(('add_member', name, member_id, contact, is_active))
         return True
 
+    @_writer
     def edit_member(self, member_id: str, name: str = None, contact: str = None) -> bool:
         if member_id not in self.members:
             return False
-        member = self.members[member_id]
-        if name:
-            member.name = name
-        if contact:
-            member.contact = contact
-        self.save_data()
+        self._commit(('edit_member', member_id, name, contact))
         return True
 
+    @_writer
     def delete_member(self, member_id: str) -> bool:
         if member_id not in self.members:
             return False
         member = self.members[member_id]
         if member.borrowed_books:  # Can't delete member with borrowed books
             return False
-        del self.members[member_id]
-        self.save_data()
+        self._commit(('delete_member', member_id))
         return True
 
+    @_reader
     def get_member_borrow_history(self, member_id: str) -> List[Dict]:
+        return self._cached(('history', member_id), (('member', member_id), 'catalog'),
+                            lambda: (self._member_borrow_history(member_id), None))
+
+    def _member_borrow_history(self, member_id: str) -> List[Dict]:
         if member_id not in self.members:
             return []
-        history = []
-        for record in self.borrow_records:
-            if record.member_id == member_id:
-                book = self.books[record.book_isbn]
-                history.append({
-                    'book_title': book.title,
-                    'book_isbn': book.isbn,
-                    'borrow_date': record.borrow_date,
-                    'return_date': record.return_date,
-                    'is_returned': record.return_date is not None
-                })
-        return history
+        return [self._history_row(position) for position in self.borrow_records.member_positions(member_id)]
+
+    def _history_row(self, position: int) -> Dict:
+        # Loans outlive their book; once it is deleted the row keeps the ISBN and has no title
+        record = self.borrow_records[position]
+        book = self.books.get(record.book_isbn)
+        return {
+            'book_title': book.title if book is not None else None,
+            'book_isbn': record.book_isbn,
+            'borrow_date': record.borrow_date,
+            'return_date': record.return_date,
+            'is_returned': record.return_date is not None
+        }
 
+    @_reader
     def get_all_members(self) -> List[Dict]:
-        return [{
+        return [self._member_row(member) for member in self.members.values()]
+
+    @staticmethod
+    def _member_row(member: Member) -> Dict:
+        return {
             'member_id': member.member_id,
             'name': member.name,
             'contact': member.contact,
             'is_active': member.is_active,
             'borrowed_books_count': len(member.borrowed_books)
-        } for member in self.members.values()]
+        }
+
+    # Lazy listings. Each yields (cursor, row) pairs in a stable order and reads CHUNK_SIZE
+    # rows per lock acquisition; passing a cursor back as `after` resumes right behind it,
+    # even if the library changed in between. paging.take_page() cuts them into pages.
+
+    def _sorted_keys(self, attribute: str, mapping: Dict) -> List[str]:
+        if getattr(self, attribute) is None:
+            with self._build_lock:
+                if getattr(self, attribute) is None:
+                    setattr(self, attribute, sorted(mapping))
+        return getattr(self, attribute)
+
+    def iter_books(self, available: Optional[bool] = None, after: Optional[str] = None) -> Iterator[Tuple[str, Book]]:
+        # Ordered by ISBN; available=True/False keeps only books on the shelf/on loan
+        while True:
+            with self.reading():
+                isbns = self._sorted_keys('_sorted_isbns', self.books)
+                start = bisect.bisect_right(isbns, after) if after is not None else 0
+                chunk = isbns[start:start + CHUNK_SIZE]
+                books = [self.books[isbn] for isbn in chunk]
+            for book in books:
+                if available is None or book.is_available == available:
+                    yield book.isbn, book
+            if len(chunk) < CHUNK_SIZE:
+                return
+            after = chunk[-1]
+
+    def _get_facet_index(self) -> FacetIndex:
+        if self._facet_index is None:
+            with self._build_lock:
+                if self._facet_index is None:
+                    self._facet_index = FacetIndex.build(self.books.values())
+                    if self.metrics is not None:
+                        self.metrics.increment('facet_index_build')
+        return self._facet_index
+
+    def _browse_filters(self, category: Optional[str], author: Optional[str], available: Optional[bool],
+                        text: Optional[str]) -> Tuple[FacetIndex, Dict[str, int]]:
+        index = self._get_facet_index()
+        filters = index.filters(category, author, available)
+        if text:  # Same matching as search_books, as one more bitmap
+            filters['text'] = index.bitmap_for([book.isbn for book in self.search_books(text)])
+        return index, filters
+
+    @_reader
+    def browse_books(self, category: Optional[str] = None, author: Optional[str] = None,
+                     available: Optional[bool] = None, text: Optional[str] = None, limit: int = 20,
+                     after: Optional[int] = None, facet_limit: int = 10) -> Dict:
+        # Books matching every given filter, in catalogue order, with counts per category,
+        # author and availability; pass next_cursor back as after for the following page
+        index, filters = self._browse_filters(category, author, available, text)
+        matches = index.match(filters)
+        docs = iter_bits(matches, after + 1 if after is not None else 0)
+        books, cursor = take_page(((doc, self.books[index.isbn(doc)]) for doc in docs), limit)
+        return {
+            'total': matches.bit_count(),
+            'books': books,
+            'next_cursor': cursor,
+            'facets': index.facet_counts(filters, facet_limit)
+        }
+
+    def iter_browse(self, category: Optional[str] = None, author: Optional[str] = None,
+                    available: Optional[bool] = None, text: Optional[str] = None,
+                    after: Optional[int] = None) -> Iterator[Tuple[int, Book]]:
+        # The rows of browse_books, a chunk per lock acquisition like the other iter_* methods
+        while True:
+            with self.reading():
+                index, filters = self._browse_filters(category, author, available, text)
+                docs = list(islice(iter_bits(index.match(filters), after + 1 if after is not None else 0),
+                                   CHUNK_SIZE))
+                books = [self.books[index.isbn(doc)] for doc in docs]
+            yield from zip(docs, books)
+            if len(docs) < CHUNK_SIZE:
+                return
+            after = docs[-1]
+
+    def iter_members(self, after: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+        # Ordered by member ID
+        while True:
+            with self.reading():
+                member_ids = self._sorted_keys('_sorted_member_ids', self.members)
+                start = bisect.bisect_right(member_ids, after) if after is not None else 0
+                chunk = member_ids[start:start + CHUNK_SIZE]
+                rows = [self._member_row(self.members[member_id]) for member_id in chunk]
+            yield from zip(chunk, rows)
+            if len(chunk) < CHUNK_SIZE:
+                return
+            after = chunk[-1]
+
+    def iter_member_history(self, member_id: str, after: Optional[int] = None) -> Iterator[Tuple[int, Dict]]:
+        # Oldest loan first; the cursor is the loan's position in borrow_records
+        while True:
+            with self.reading():
+                if member_id not in self.members:
+                    return
+                positions = self.borrow_records.member_positions(member_id)
+                start = bisect.bisect_right(positions, after) if after is not None else 0
+                chunk = positions[start:start + CHUNK_SIZE]
+                rows = [self._history_row(position) for position in chunk]
+            yield from zip(chunk, rows)
+            if len(chunk) < CHUNK_SIZE:
+                return
+            after = chunk[-1]
 
-    def get_top_borrowers(self, limit: int = 5) -> List[Dict]:
-        members_with_counts = [{
+    def iter_overdue(self, days_threshold: int = 14, after: Optional[int] = None) -> Iterator[Tuple[int, Dict]]:
+        # Overdue loans oldest first, as get_overdue_books; the cursor is the loan's position in
+        # borrow_records, and each chunk resumes from that loan's borrow time in the due index
+        while True:
+            with self.reading():
+                history = self.borrow_records
+                if after is not None and after >= len(history):
+                    return
+                current_time = datetime.datetime.now()
+                key = (history.row(after)[2], after) if after is not None else None
+                loans = list(islice(self._get_due_index().walk(overdue_cutoff(current_time, days_threshold), key),
+                                    CHUNK_SIZE))
+                rows = [(position, self._overdue_row(position, current_time, days_threshold))
+                        for _, position in loans]
+            yield from rows
+            if len(loans) < CHUNK_SIZE:
+                return
+            after = loans[-1][1]
+
+    @staticmethod
+    def _seconds_to_midnight() -> float:
+        now = datetime.datetime.now()
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+        return (midnight - now).total_seconds()
+
+    def _overdue_row(self, position: int, current_time: datetime.datetime, days_threshold: int) -> Optional[Dict]:
+        record = self.borrow_records[position]
+        days_borrowed = (current_time - record.borrow_date).days
+        if days_borrowed <= days_threshold:
+            return None
+        book = self.books[record.book_isbn]
+        member = self.members[record.member_id]
+        return {
+            'book_title': book.title,
+            'book_isbn': book.isbn,
+            'member_name': member.name,
             'member_id': member.member_id,
-            'name': member.name,
-            'total_borrows': len([r for r in self.borrow_records if r.member_id == member.member_id])
-        } for member in self.members.values()]
-        
-        return sorted(members_with_counts, key=lambda x: x['total_borrows'], reverse=True)[:limit]
+            'days_overdue': days_borrowed - days_threshold
+        }
+
+    def _get_due_index(self) -> DueIndex:
+        if self._due_index is None:
+            with self._build_lock:
+                if self._due_index is None:
+                    self._due_index = DueIndex.build(self.borrow_records, self.open_loans.values())
+                    if self.metrics is not None:
+                        self.metrics.increment('due_index_build')
+        return self._due_index
+
+    def _get_leaderboards(self) -> Leaderboards:
+        if self._leaderboards is None:
+            with self._build_lock:
+                if self._leaderboards is None:
+                    self._leaderboards = Leaderboards.build(self.borrow_records, self.books)
+                    if self.metrics is not None:
+                        self.metrics.increment('leaderboard_build')
+        return self._leaderboards
+
+    @_reader
+    def get_top_borrowers(self, limit: int = 5, window: Optional[str] = None) -> List[Dict]:
+        # window: None for all time, 'last_30_days' or 'this_year'
+        return self._cached(('top_borrowers', limit, window), ('loans', 'members'),
+                            lambda: (self._top_borrowers(limit, window),
+                                     self._seconds_to_midnight() if window is not None else None))
+
+    def _top_borrowers(self, limit: int, window: Optional[str]) -> List[Dict]:
+        top = self._get_leaderboards().members.top(limit, window, self.members.__contains__)
+        top_borrowers = [{
+            'member_id': member_id,
+            'name': self.members[member_id].name,
+            'total_borrows': count
+        } for member_id, count in top]
+        # Like the full ranking, fill up with members who have not borrowed in the window
+        if len(top_borrowers) < limit:
+            ranked = {member_id for member_id, _ in top}
+            for member in self.members.values():
+                if len(top_borrowers) == limit:
+                    break
+                if member.member_id not in ranked:
+                    top_borrowers.append({'member_id': member.member_id, 'name': member.name, 'total_borrows': 0})
+        return top_borrowers
+
+    @_reader
+    def get_top_books(self, limit: int = 5, window: Optional[str] = None) -> List[Dict]:
+        top = self._get_leaderboards().books.top(limit, window, self.books.__contains__)
+        return [{
+            'book_isbn': isbn,
+            'book_title': self.books[isbn].title,
+            'total_borrows': count
+        } for isbn, count in top]
 
+    @_reader
+    def get_top_categories(self, limit: int = 5, window: Optional[str] = None) -> List[Dict]:
+        # Loans count under their book's current category; loans of deleted books not at all
+        top = self._get_leaderboards().categories.top(limit, window)
+        return [{'category': category, 'total_borrows': count} for category, count in top]
+
+    @_writer
     def borrow_book(self, isbn: str, member_id: str) -> bool:
         if isbn not in self.books or member_id not in self.members:
             return False
@@ -130,88 +691,245 @@ class LibrarySystem:
         if not book.is_available or not member.is_active:
             return False
             
-        book.is_available = False
-        member.borrowed_books.append(isbn)
-        self.borrow_records.append(BorrowRecord(isbn, member_id))
-        self.save_data()
+        self._commit(('borrow_book', isbn, member_id, datetime.datetime.now()))
         return True
 
+    @_writer
     def return_book(self, isbn: str, member_id: str) -> bool:
         if isbn not in self.books or member_id not in self.members:
             return False
             
-        book = self.books[isbn]
         member = self.members[member_id]
         
         if isbn not in member.borrowed_books:
             return False
             
-        book.is_available = True
-        member.borrowed_books.remove(isbn)
-        
-        # Update borrow record
-        for record in self.borrow_records:
-            if record.book_isbn == isbn and record.member_id == member_id and not record.return_date:
-                record.return_date = datetime.datetime.now()
-                break
-                
-        self.save_data()
+        self._commit(('return_book', isbn, member_id, datetime.datetime.now()))
         return True
 
+    @_writer
+    def borrow_books(self, member_id: str, isbns: List[str]) -> Dict[str, str]:
+        # All or nothing: returns {ISBN: reason} for every ISBN that cannot be borrowed and
+        # changes nothing, or {} once every book is borrowed and persisted in one write
+        member = self.members.get(member_id)
+        errors: Dict[str, str] = {}
+        seen = set()
+        for isbn in isbns:
+            book = self.books.get(isbn)
+            if member is None:
+                errors[isbn] = "unknown member"
+            elif not member.is_active:
+                errors[isbn] = "member is not active"
+            elif isbn in seen:
+                errors[isbn] = "listed more than once"
+            elif book is None:
+                errors[isbn] = "unknown book"
+            elif not book.is_available:
+                errors[isbn] = "not available"
+            seen.add(isbn)
+        if errors:
+            return errors
+        when = datetime.datetime.now()
+        with self.batch():
+            for isbn in isbns:
+                self._commit(('borrow_book', isbn, member_id, when))
+        return {}
+
+    @_writer
+    def return_books(self, member_id: str, isbns: List[str]) -> Dict[str, str]:
+        # As borrow_books: nothing is returned unless every ISBN can be
+        member = self.members.get(member_id)
+        errors: Dict[str, str] = {}
+        seen = set()
+        for isbn in isbns:
+            if member is None:
+                errors[isbn] = "unknown member"
+            elif isbn in seen:
+                errors[isbn] = "listed more than once"
+            elif isbn not in self.books:
+                errors[isbn] = "unknown book"
+            elif isbn not in member.borrowed_books:
+                errors[isbn] = "not borrowed by this member"
+            seen.add(isbn)
+        if errors:
+            return errors
+        when = datetime.datetime.now()
+        with self.batch():
+            for isbn in isbns:
+                self._commit(('return_book', isbn, member_id, when))
+        return {}
+
+    @_writer
+    def import_loan(self, isbn: str, member_id: str, borrow_date: datetime.datetime,
+                    return_date: Optional[datetime.datetime] = None) -> bool:
+        # Records a historical loan; an unreturned one checks the book out as borrow_book would
+        if isbn not in self.books or member_id not in self.members:
+            return False
+        if return_date is None and not self.books[isbn].is_available:
+            return False
+        if any(when is not None and when.utcoffset() is not None for when in (borrow_date, return_date)):
+            return False  # Loan times are naive local time
+        if return_date is not None and return_date < borrow_date:
+            return False
+        self._commit(('import_loan', isbn, member_id, borrow_date, return_date))
+        return True
+
+    def _get_loan_columns(self) -> LoanColumns:
+        if self._loan_columns is None:
+            with self._build_lock:
+                if self._loan_columns is None:
+                    self._loan_columns = LoanColumns(self.borrow_records, self.books)
+                    if self.metrics is not None:
+                        self.metrics.increment('loan_columns_build')
+        return self._loan_columns
+
+    # Circulation reports over the whole loan history, archive included; they need NumPy
+
+    @_reader
+    def get_loan_duration_report(self, category: Optional[str] = None) -> Dict:
+        return self._get_loan_columns().duration_report(category)
+
+    @_reader
+    def get_monthly_circulation(self, months: int = 12) -> Dict:
+        return self._get_loan_columns().monthly_circulation(months)
+
+    @_reader
+    def get_lateness_report(self, loan_days: int = 14) -> Dict:
+        return self._get_loan_columns().lateness_report(loan_days)
+
+    @_reader
+    def get_member_cohorts(self, months: int = 12) -> List[Dict]:
+        return self._get_loan_columns().member_cohorts(months)
+
+    @_reader
     def get_overdue_books(self, days_threshold: int = 14) -> List[Dict]:
+        return self._cached(('overdue', days_threshold), ('loans', 'catalog', 'members'),
+                            lambda: self._overdue_books(days_threshold))
+
+    def _overdue_books(self, days_threshold: int) -> Tuple[List[Dict], float]:
+        # Oldest first. Days overdue grow with the clock, so the list also reports when one of
+        # its loans reaches another full day or the next open loan becomes overdue
         overdue_books = []
         current_time = datetime.datetime.now()
-        
-        for record in self.borrow_records:
-            if not record.return_date:  # Book hasn't been returned
-                days_borrowed = (current_time - record.borrow_date).days
-                if days_borrowed > days_threshold:
-                    book = self.books[record.book_isbn]
-                    member = self.members[record.member_id]
-                    overdue_books.append({
-                        'book_title': book.title,
-                        'book_isbn': book.isbn,
-                        'member_name': member.name,
-                        'member_id': member.member_id,
-                        'days_overdue': days_borrowed - days_threshold
-                    })
-        
-        return overdue_books
+        now, cutoff = to_micros(current_time), overdue_cutoff(current_time, days_threshold)
+        index = self._get_due_index()
+        stale_in = DAY_MICROS
+        for borrowed, position in index.between(None, cutoff):
+            stale_in = min(stale_in, DAY_MICROS - (now - borrowed) % DAY_MICROS)
+            overdue_books.append(self._overdue_row(position, current_time, days_threshold))
+        upcoming = index.next_after(cutoff)
+        if upcoming is not None:
+            stale_in = min(stale_in, upcoming - cutoff)
+        return overdue_books, stale_in / 1e6
+
+    @_reader
+    def get_member_overdue(self, member_id: str, days_threshold: int = 14) -> List[Dict]:
+        # Reads only the member's own open loans, for the warning shown when they log in
+        member = self.members.get(member_id)
+        if member is None:
+            return []
+        current_time = datetime.datetime.now()
+        rows = []
+        for position in sorted(self.open_loans[isbn] for isbn in member.borrowed_books):
+            row = self._overdue_row(position, current_time, days_threshold)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    @_reader
+    def get_books_due_soon(self, days: int = 3, days_threshold: int = 14) -> List[Dict]:
+        # Open loans that become overdue within the next `days` days, soonest first
+        cutoff = overdue_cutoff(datetime.datetime.now(), days_threshold)
+        history = self.borrow_records
+        rows = []
+        for borrowed, position in self._get_due_index().between(cutoff, cutoff + days * DAY_MICROS):
+            book = self.books[history.book_isbn(position)]
+            member = self.members[history.member_id(position)]
+            rows.append({
+                'book_title': book.title,
+                'book_isbn': book.isbn,
+                'member_name': member.name,
+                'member_id': member.member_id,
+                'overdue_from': from_micros(borrowed + (days_threshold + 1) * DAY_MICROS)
+            })
+        return rows
+
+    @_reader
+    def get_newly_overdue(self, since: Optional[datetime.datetime],
+                          days_threshold: int = 14) -> Tuple[List[Dict], datetime.datetime]:
+        # Loans that became overdue after `since` (None: every overdue loan), oldest first, and
+        # the time of this check; pass that back as `since` to batch reminders without repeats
+        current_time = datetime.datetime.now()
+        start = None if since is None else overdue_cutoff(since, days_threshold)
+        rows = [self._overdue_row(position, current_time, days_threshold) for _, position in
+                self._get_due_index().between(start, overdue_cutoff(current_time, days_threshold))]
+        return rows, current_time
+
+    @staticmethod
+    def _search_fields(book: Book) -> tuple:
+        return (book.title, book.author, book.isbn)
 
+    @_reader
     def search_books(self, query: str) -> List[Book]:
         query = query.lower()
-        return [book for book in self.books.values()
-                if query in book.title.lower() or
-                   query in book.author.lower() or
-                   query in book.isbn.lower()]
+        # Results hold the live Book objects, so borrows and returns never invalidate them
+        scopes = [('gram', gram) for gram in ngrams([query])] or ['books']
+        return self._cached(('search', query), scopes, lambda: (self._search_books(query), None))
+
+    def _search_books(self, query: str) -> List[Book]:
+        isbns = self.search_index.candidates(query)
+        if isbns is None:  # Query too short for trigrams, fall back to a scan
+            books = self.books.values()
+        else:
+            books = (self.books[isbn] for isbn in isbns)
+        # Candidates share every trigram with the query; confirm the substring match
+        results = [book for book in books
+                   if query in book.title.lower() or
+                      query in book.author.lower() or
+                      query in book.isbn.lower()]
+        if self.metrics is not None:
+            if isbns is None:
+                self.metrics.increment('search_index_miss')
+            else:
+                # Candidates that failed the substring check were wasted work
+                self.metrics.increment('search_index_hit')
+                self.metrics.increment('search_index_false_candidates', len(isbns) - len(results))
+        return results
+
+    @_reader
+    def find_books_by_title(self, title: str) -> List[str]:
+        return list(self._title_index.get(title.lower(), ()))
 
+    @_reader
+    def find_books_by_author_and_title(self, author: str, title: str) -> List[str]:
+        return list(self._author_title_index.get((author.lower(), title.lower()), ()))
+
+    @_reader
     def find_book_by_title(self, title: str) -> Optional[str]:
-        title = title.lower()
-        for isbn, book in self.books.items():
-            if book.title.lower() == title:
-                return isbn
-        return None
+        isbns = self._title_index.get(title.lower())
+        return isbns[0] if isbns else None
 
+    @_reader
     def find_book_by_author_and_title(self, author: str, title: str) -> Optional[str]:
-        author = author.lower()
-        title = title.lower()
-        for isbn, book in self.books.items():
-            if book.author.lower() == author and book.title.lower() == title:
-                return isbn
-        return None
+        isbns = self._author_title_index.get((author.lower(), title.lower()))
+        return isbns[0] if isbns else None
 
+    @_writer
     def delete_book_by_title(self, title: str) -> bool:
-        isbn = self.find_book_by_title(title)
-        if isbn:
-            return self.delete_book(isbn)
+        # Refuse to guess when several ISBNs share the title; use find_books_by_title
+        isbns = self.find_books_by_title(title)
+        if len(isbns) == 1:
+            return self.delete_book(isbns[0])
         return False
 
+    @_writer
     def delete_book_by_author_and_title(self, author: str, title: str) -> bool:
-        isbn = self.find_book_by_author_and_title(author, title)
-        if isbn:
-            return self.delete_book(isbn)
+        isbns = self.find_books_by_author_and_title(author, title)
+        if len(isbns) == 1:
+            return self.delete_book(isbns[0])
         return False
 
+    @_writer
     def delete_book(self, isbn: str) -> bool:
         if isbn not in self.books:
             return False
@@ -221,21 +939,53 @@ class LibrarySystem:
             return False
             
         # Delete the book
-        del self.books[isbn]
-        self.save_data()
+        self._commit(('delete_book', isbn))
         return True
 
+    @_reader
     def get_statistics(self) -> Dict:
+        counters = self.counters
+        return {
+            'total_books': counters.total_books,
+            'available_books': counters.available_books,
+            'books_borrowed': counters.total_books - counters.available_books,
+            'total_members': counters.total_members,
+            'active_members': counters.active_members,
+            'open_loans': len(self.open_loans),
+            'loans_today': counters.loans_today(),
+            'categories': counters.categories()
+        }
+
+    @_reader
+    def count_statistics(self) -> Dict:
+        # The same figures as get_statistics() from a full scan of books, members and loans
         total_books = len(self.books)
         available_books = sum(1 for book in self.books.values() if book.is_available)
-        total_members = len(self.members)
-        active_members = sum(1 for member in self.members.values() if member.is_active)
-        books_borrowed = total_books - available_books
-        
+        categories: Dict[str, Dict[str, int]] = {}
+        for book in self.books.values():
+            counts = categories.setdefault(book.category, {'total': 0, 'available': 0})
+            counts['total'] += 1
+            if book.is_available:
+                counts['available'] += 1
+        history = self.borrow_records
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        start, end = to_micros(today), to_micros(today + datetime.timedelta(days=1))
         return {
             'total_books': total_books,
             'available_books': available_books,
-            'books_borrowed': books_borrowed,
-            'total_members': total_members,
-            'active_members': active_members
-        }
\ No newline at end of file
+            'books_borrowed': total_books - available_books,
+            'total_members': len(self.members),
+            'active_members': sum(1 for member in self.members.values() if member.is_active),
+            'open_loans': len(history.open_loans()),
+            'loans_today': sum(1 for part in history.parts() for borrowed in part.borrow_times.to_array()
+                               if start <= borrowed < end),
+            'categories': categories
+        }
+
+    @_reader
+    def check_statistics(self) -> Dict[str, Tuple]:
+        # Compares the maintained counters with a recount; returns {key: (counter, recount)}
+        # for every figure that disagrees, so an empty dict means they are consistent
+        maintained = self.get_statistics()
+        counted = self.count_statistics()
+        return {key: (maintained[key], counted[key]) for key in counted if maintained[key] != counted[key]}
\ No newline at end of file
@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmark import WORDS
+
+
+class Client:
+    # One keep-alive HTTP/1.1 connection to the library service
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Optional[dict] = None) -> Tuple[int, object]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode() if body is not None else b''
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n").encode() + data)
+        await self.writer.drain()
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split(' ')[1])
+        length = 0
+        closing = False
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+            elif name.lower() == 'connection':
+                closing = value.strip().lower() == 'close'
+        payload = json.loads(await self.reader.readexactly(length)) if length else None
+        if closing:
+            self.close()
+        return status, payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_load(host: str, port: int, clients: int, duration: float, seed: int = 42,
+                   write_ratio: float = 0.2) -> Dict:
+    setup = Client(host, port)
+    _, members = await setup.request('GET', '/members?limit=1000')
+    _, found = await setup.request('GET', '/books?q=&limit=5000')
+    setup.close()
+    member_ids = [member['member_id'] for member in members['members']]
+    isbns = [book['isbn'] for book in found['books']]
+    if not member_ids or not isbns:
+        raise SystemExit("the library needs books and members to generate load")
+
+    latencies: Dict[str, List[float]] = {}
+    statuses: Dict[int, int] = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker(number: int):
+        rng = random.Random(seed + number)
+        client = Client(host, port)
+        borrowed: List[Tuple[str, str]] = []
+        try:
+            while time.perf_counter() < deadline:
+                if rng.random() < write_ratio:
+                    if borrowed and rng.random() < 0.5:
+                        isbn, member_id = borrowed.pop()
+                        name, request = 'return', ('POST', '/return', {'isbn': isbn, 'member_id': member_id})
+                    else:
+                        isbn, member_id = rng.choice(isbns), rng.choice(member_ids)
+                        name, request = 'borrow', ('POST', '/borrow', {'isbn': isbn, 'member_id': member_id})
+                else:
+                    name = rng.choice(['search', 'stats', 'history', 'top-borrowers'])
+                    path = {'search': f"/books?q={rng.choice(WORDS)[:4]}&limit=20",
+                            'stats': '/stats',
+                            'history': f"/members/{rng.choice(member_ids)}/history",
+                            'top-borrowers': '/top-borrowers'}[name]
+                    request = ('GET', path, None)
+                started = time.perf_counter()
+                status, _ = await client.request(*request)
+                latencies.setdefault(name, []).append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+                if name == 'borrow' and status == 200:
+                    borrowed.append((isbn, member_id))
+            # Give back whatever this client still holds so repeated runs start alike
+            for isbn, member_id in borrowed:
+                await client.request('POST', '/return', {'isbn': isbn, 'member_id': member_id})
+        finally:
+            client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(clients)))
+    elapsed = time.perf_counter() - started
+    everything = [latency for values in latencies.values() for latency in values]
+    return {
+        'clients': clients,
+        'requests': len(everything),
+        'elapsed_s': elapsed,
+        'throughput_rps': len(everything) / elapsed,
+        'statuses': statuses,
+        'overall': _summary(everything),
+        'endpoints': {name: _summary(values) for name, values in sorted(latencies.items())}
+    }
+
+
+def _summary(values: List[float]) -> Dict:
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+
+    def percentile(fraction: float) -> float:
+        return values[min(len(values) - 1, int(len(values) * fraction))] * 1e3
+
+    return {'count': len(values), 'p50_ms': percentile(0.5), 'p99_ms': percentile(0.99),
+            'mean_ms': statistics.fmean(values) * 1e3, 'max_ms': values[-1] * 1e3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate load against a running library service (server.py)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--clients', type=int, default=100, help="concurrent keep-alive connections")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to run")
+    parser.add_argument('--write-ratio', type=float, default=0.2, help="share of borrow/return requests")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load(args.host, args.port, args.clients, args.duration, args.seed, args.write_ratio))
+    print(f"{result['requests']} requests from {result['clients']} clients in {result['elapsed_s']:.1f} s: "
+          f"{result['throughput_rps']:.0f} req/s, p50 {result['overall']['p50_ms']:.2f} ms, "
+          f"p99 {result['overall']['p99_ms']:.2f} ms")
+    for name, summary in result['endpoints'].items():
+        print(f"  {name:14} {summary['count']:8} requests  p50 {summary['p50_ms']:8.2f} ms  "
+              f"p99 {summary['p99_ms']:8.2f} ms")
+    print(f"  status codes: {result['statuses']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
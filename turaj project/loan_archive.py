@@ -0,0 +1,299 @@
+import bisect
+import datetime
+import os
+import pickle
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from journal import fsync_directory
+from loan_history import LoanHistory, from_micros, to_micros
+
+INDEX_FILE = 'index'
+
+
+def _month_bounds(micros: int) -> Tuple[str, int, int]:
+    # ('YYYY-MM', first microsecond of the month, first microsecond of the next)
+    when = from_micros(micros)
+    start = datetime.datetime(when.year, when.month, 1)
+    end = datetime.datetime(when.year + when.month // 12, when.month % 12 + 1, 1)
+    return start.strftime('%Y-%m'), to_micros(start), to_micros(end)
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+    fsync_directory(path)
+
+
+def _dump(path: str, value):
+    _write_atomic(path, zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+
+
+def _read(path: str):
+    with open(path, 'rb') as f:
+        return pickle.loads(zlib.decompress(f.read()))
+
+
+# A segment's postings: its member IDs sorted, and offsets into the positions of their
+# loans, so offsets[i]:offsets[i + 1] slices the positions of members[i]
+Postings = Tuple[List[str], array, array]
+
+
+def _pack(by_member: Dict[str, array]) -> Postings:
+    members = sorted(by_member)
+    offsets = array('I', [0])
+    positions = array('I')
+    for member_id in members:
+        positions.extend(by_member[member_id])
+        offsets.append(len(positions))
+    return members, offsets, positions
+
+
+def _unpack(postings: Postings) -> Dict[str, array]:
+    members, offsets, positions = postings
+    return {member_id: positions[offsets[i]:offsets[i + 1]] for i, member_id in enumerate(members)}
+
+
+def _postings(part: LoanHistory) -> Postings:
+    by_code: Dict[int, array] = {}
+    member_ids = part.member_ids
+    for index in range(len(member_ids)):
+        code = member_ids[index]
+        positions = by_code.get(code)
+        if positions is None:
+            positions = by_code[code] = array('I')
+        positions.append(part.base + index)
+    return _pack({part.member_table[code]: positions for code, positions in by_code.items()})
+
+
+class LoanArchive:
+    # Cold storage for the oldest loans of a LoanHistory. Loans keep their positions: each
+    # segment holds a contiguous run of positions borrowed in one month, as a zlib-compressed
+    # pickled LoanHistory whose base is the run's first position, next to a postings file
+    # with the positions of each member in it. The index only lists the segments, so opening
+    # the archive reads no loans; postings are read on the first member history query.
+    #
+    # Each archiving run writes its loans as new segments. Runs of one month are merged like
+    # a binary counter (a segment absorbs the next one once that is as large), and into a
+    # single segment once a later month is archived, so every loan is rewritten a few times
+    # at most and the cost of a run follows the loans it archives, not the archive's size.
+    def __init__(self, directory: str, cached_rows: int = 250000):
+        self.directory = directory
+        self.cached_rows = cached_rows  # Decoded segments are kept until they hold more loans than this
+        # One dict per segment, ordered by position: start, end, month, file, postings,
+        # first, last (borrow times)
+        self.segments: List[Dict] = []
+        self._starts: List[int] = []
+        self._postings: Dict[str, Postings] = {}  # postings file -> its postings, read on first use
+        self._cache: 'OrderedDict[int, LoanHistory]' = OrderedDict()  # start -> decoded segment
+        self._cached = 0  # Loans in the cached segments
+        self._lock = threading.Lock()  # Readers share the library lock, so they can race here
+        index_file = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_file):
+            index = _read(index_file)
+            self.segments = index['segments']
+            self._starts = [segment['start'] for segment in self.segments]
+            if 'members' in index:  # Archives written with one index of every member's positions
+                self._split_members(index['members'])
+
+    @property
+    def end(self) -> int:
+        return self.segments[-1]['end'] if self.segments else 0
+
+    def __len__(self) -> int:
+        return sum(segment['end'] - segment['start'] for segment in self.segments)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self, segment: Dict) -> LoanHistory:
+        with self._lock:
+            part = self._cache.get(segment['start'])
+            if part is not None:
+                self._cache.move_to_end(segment['start'])
+                return part
+        part = _read(self._path(segment['file']))
+        self._keep(part)
+        return part
+
+    def _keep(self, part: LoanHistory):
+        self._forget(part.base)
+        with self._lock:
+            self._cache[part.base] = part
+            self._cached += len(part.borrow_times)
+            while self._cached > self.cached_rows and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached -= len(evicted.borrow_times)
+
+    def _forget(self, start: int):
+        with self._lock:
+            part = self._cache.pop(start, None)
+            if part is not None:
+                self._cached -= len(part.borrow_times)
+
+    def _segment_for(self, position: int) -> Dict:
+        segment_index = bisect.bisect_right(self._starts, position) - 1
+        if segment_index < 0 or position >= self.segments[segment_index]['end']:
+            raise IndexError('loan position not archived')
+        return self.segments[segment_index]
+
+    def row(self, position: int) -> Tuple[str, str, int, int]:
+        return self._load(self._segment_for(position)).row(position)
+
+    def _segments_before(self, end: int) -> List[Dict]:
+        # Segments a history with the given base reads; later ones are left over from an
+        # archiving run whose history was never saved, and discard_from() drops them
+        return [segment for segment in self.segments if segment['start'] < end]
+
+    def parts(self, end: int, newest_first: bool = False) -> Iterator[LoanHistory]:
+        segments = self._segments_before(end)
+        for segment in reversed(segments) if newest_first else segments:
+            yield self._load(segment)
+
+    def _postings_of(self, segment: Dict) -> Postings:
+        postings = self._postings.get(segment['postings'])
+        if postings is None:
+            postings = _read(self._path(segment['postings']))
+            with self._lock:
+                self._postings[segment['postings']] = postings
+        return postings
+
+    def member_positions(self, member_id: str, end: int) -> List[int]:
+        positions: List[int] = []
+        for segment in self._segments_before(end):
+            members, offsets, segment_positions = self._postings_of(segment)
+            index = bisect.bisect_left(members, member_id)
+            if index < len(members) and members[index] == member_id:
+                positions.extend(segment_positions[offsets[index]:offsets[index + 1]])
+        if positions and positions[-1] >= end:
+            return [position for position in positions if position < end]
+        return positions
+
+    def count_recent(self, start_micros: int, end_micros: int, end: int) -> int:
+        count = 0
+        for segment in self._segments_before(end):
+            if segment['last'] >= start_micros and segment['first'] < end_micros:
+                count += self._load(segment).count_recent(from_micros(start_micros), from_micros(end_micros))
+        return count
+
+    def append(self, history: LoanHistory, start: int, end: int):
+        # Copies positions [start, end) of history into new segments, one per month they span
+        os.makedirs(self.directory, exist_ok=True)
+        segments = list(self.segments)
+        removed: List[Dict] = []
+        part: Optional[LoanHistory] = None
+        month, month_start, month_end = None, 0, 0
+        for position in range(start, end):
+            isbn, member_id, borrowed, returned = history.row(position)
+            if part is None or not month_start <= borrowed < month_end:
+                if part is not None:
+                    self._add_segment(segments, removed, part, month)
+                month, month_start, month_end = _month_bounds(borrowed)
+                part = LoanHistory(base=position)
+            part.add_row(isbn, member_id, borrowed, returned)
+        if part is not None:
+            self._add_segment(segments, removed, part, month)
+        self._save_index(segments, removed)
+
+    def _add_segment(self, segments: List[Dict], removed: List[Dict], part: LoanHistory, month: str):
+        last = segments[-1] if segments else None
+        if last is not None and last['month'] != month:
+            self._merge_tail(segments, removed, lambda older, newer: True)  # That month is done
+        segments.append(self._write_segment(part, month, _postings(part)))
+        self._merge_tail(segments, removed, lambda older, newer: older <= newer)
+
+    def _merge_tail(self, segments: List[Dict], removed: List[Dict], merge):
+        # Merges the last segment into the one before while both hold loans of one month
+        # and merge(older size, newer size) agrees
+        while len(segments) > 1:
+            older, newer = segments[-2], segments[-1]
+            if (older['month'] != newer['month'] or older['end'] != newer['start']
+                    or not merge(older['end'] - older['start'], newer['end'] - newer['start'])):
+                return
+            part = LoanHistory(base=older['start'])
+            for segment in (older, newer):
+                source = self._load(segment)
+                for position in range(segment['start'], segment['end']):
+                    part.add_row(*source.row(position))
+                self._forget(segment['start'])
+            postings = _unpack(self._postings_of(older))
+            for member_id, positions in _unpack(self._postings_of(newer)).items():
+                if member_id in postings:
+                    postings[member_id].extend(positions)
+                else:
+                    postings[member_id] = positions
+            del segments[-2:]
+            removed.extend((older, newer))
+            segments.append(self._write_segment(part, older['month'], _pack(postings)))
+
+    def _write_segment(self, part: LoanHistory, month: str, postings: Postings) -> Dict:
+        start, end = part.base, len(part)
+        name = f"loans-{month}-{start:010d}-{end:010d}"
+        _dump(self._path(name + '.seg'), part)
+        _dump(self._path(name + '.members'), postings)
+        self._keep(part)
+        with self._lock:
+            self._postings[name + '.members'] = postings
+        borrow_times = part.borrow_times.tail
+        return {'start': start, 'end': end, 'month': month, 'file': name + '.seg',
+                'postings': name + '.members', 'first': min(borrow_times), 'last': max(borrow_times)}
+
+    def _save_index(self, segments: List[Dict], removed: List[Dict] = ()):
+        # The index is written before the files it no longer lists are deleted, so a crash
+        # in between only leaves unreferenced files behind
+        _dump(self._path(INDEX_FILE), {'segments': segments})
+        self.segments = segments
+        self._starts = [segment['start'] for segment in segments]
+        live = {segment['file'] for segment in segments}
+        for segment in removed:
+            if segment['file'] not in live:
+                for name in (segment['file'], segment['postings']):
+                    if os.path.exists(self._path(name)):
+                        os.remove(self._path(name))
+        starts = set(self._starts)
+        for start in list(self._cache):
+            if start not in starts:
+                self._forget(start)
+        live_postings = {segment['postings'] for segment in segments}
+        with self._lock:
+            self._postings = {name: postings for name, postings in self._postings.items() if name in live_postings}
+
+    def _split_members(self, members: Dict[str, array]):
+        # Moves the single member index of an older archive into per-segment postings files
+        by_segment: List[Dict[str, array]] = [{} for _ in self.segments]
+        for member_id, positions in members.items():
+            for position in positions:
+                postings = by_segment[bisect.bisect_right(self._starts, position) - 1]
+                if member_id not in postings:
+                    postings[member_id] = array('I')
+                postings[member_id].append(position)
+        for segment, postings in zip(self.segments, by_segment):
+            segment['postings'] = segment['file'][:-len('.seg')] + '.members'
+            _dump(self._path(segment['postings']), _pack(postings))
+        self._save_index(self.segments)
+
+    def discard_from(self, base: int):
+        # Forgets segments written by an archiving run that crashed before the history that
+        # points past them was saved; those loans are still in the saved history's columns
+        if self.end <= base:
+            return
+        segments = list(self.segments)
+        removed: List[Dict] = []
+        while segments and segments[-1]['end'] > base:
+            segment = segments.pop()
+            removed.append(segment)
+            if segment['start'] < base:  # Merged past base: keep the part before it
+                old = self._load(segment)
+                part = LoanHistory(base=segment['start'])
+                for position in range(segment['start'], base):
+                    part.add_row(*old.row(position))
+                self._forget(segment['start'])
+                segments.append(self._write_segment(part, segment['month'], _postings(part)))
+        self._save_index(segments, removed)
@@ -0,0 +1,403 @@
+import datetime
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+NOT_RETURNED = -(1 << 63)
+
+COLUMNS = (('isbn_ids', 'I'), ('member_ids', 'I'), ('borrow_times', 'q'), ('return_times', 'q'))
+
+
+def to_micros(when: datetime.datetime) -> int:
+    return (when - _EPOCH) // _MICROSECOND
+
+
+def from_micros(value: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(microseconds=value)
+
+
+def _as_bytes(buffer) -> memoryview:
+    # array.frombytes() only takes byte-formatted buffers
+    return memoryview(buffer).cast('B')
+
+
+class Column:
+    # A typed column: an optional fixed-size base (a memoryview over a mapped
+    # snapshot) followed by an in-memory array of values added since
+    def __init__(self, typecode: str, base: Optional[memoryview] = None):
+        self.typecode = typecode
+        self.base = base
+        self.base_len = len(base) if base is not None else 0
+        self.tail = array(typecode)
+
+    @classmethod
+    def from_array(cls, values: array) -> 'Column':
+        column = cls(values.typecode)
+        column.tail = values
+        return column
+
+    def __len__(self) -> int:
+        return self.base_len + len(self.tail)
+
+    def __getitem__(self, position: int) -> int:
+        if position < self.base_len:
+            return self.base[position]
+        return self.tail[position - self.base_len]
+
+    def __setitem__(self, position: int, value: int):
+        if position < self.base_len:
+            self.base[position] = value
+        else:
+            self.tail[position - self.base_len] = value
+
+    def append(self, value: int):
+        self.tail.append(value)
+
+    def buffers(self) -> list:
+        # Raw chunks in order, for writing the column out without copying it
+        return [self.tail] if self.base is None else [self.base, self.tail]
+
+    def to_array(self) -> array:
+        values = array(self.typecode)
+        for chunk in self.buffers():
+            values.frombytes(_as_bytes(chunk))
+        return values
+
+    def release(self):
+        if self.base is not None:
+            self.base.release()
+        self.base = None
+        self.base_len = 0
+
+    def __getstate__(self) -> dict:
+        return {'typecode': self.typecode, 'tail': self.to_array()}
+
+    def __setstate__(self, state: dict):
+        self.typecode = state['typecode']
+        self.base = None
+        self.base_len = 0
+        self.tail = state['tail']
+
+
+class LoanRecord:
+    # Read/write view of one loan; looks like a BorrowRecord to existing callers
+    __slots__ = ('_history', 'position')
+
+    def __init__(self, history: 'LoanHistory', position: int):
+        self._history = history
+        self.position = position
+
+    @property
+    def book_isbn(self) -> str:
+        return self._history.book_isbn(self.position)
+
+    @property
+    def member_id(self) -> str:
+        return self._history.member_id(self.position)
+
+    @property
+    def borrow_date(self) -> datetime.datetime:
+        return self._history.borrow_date(self.position)
+
+    @property
+    def return_date(self) -> Optional[datetime.datetime]:
+        return self._history.return_date(self.position)
+
+    @return_date.setter
+    def return_date(self, when: Optional[datetime.datetime]):
+        self._history.set_return(self.position, when)
+
+    def __repr__(self) -> str:
+        return f"LoanRecord({self.book_isbn!r}, {self.member_id!r}, {self.borrow_date}, {self.return_date})"
+
+
+class LoanHistory:
+    # ISBNs and member IDs are interned to small integers; dates are stored
+    # as microseconds since 1970-01-01 (naive, like datetime.now()) in typed columns.
+    # Positions number every loan ever recorded. The columns hold the hot part from
+    # `base` on; older loans have been moved to a LoanArchive (see loan_archive.py)
+    def __init__(self, base: int = 0):
+        self.isbn_table: List[str] = []  # interned id -> ISBN
+        self.member_table: List[str] = []  # interned id -> member_id
+        self.isbn_ids = Column('I')
+        self.member_ids = Column('I')
+        self.borrow_times = Column('q')
+        self.return_times = Column('q')  # NOT_RETURNED while the loan is open
+        # Lookup maps and the per-member index are built on first use
+        self._isbn_codes: Optional[Dict[str, int]] = None
+        self._member_codes: Optional[Dict[str, int]] = None
+        # Member index: a CSR block (offsets by member id, positions) covering the
+        # mapped base, plus member id -> positions for the loans after it
+        self._member_offsets: Optional[memoryview] = None
+        self._member_positions: Optional[memoryview] = None
+        self._member_index: Optional[Dict[int, array]] = None
+        self._mapping = None  # Keeps the mapped snapshot open while views point into it
+        self.base = base  # Position of the first loan in the columns
+        self.archive = None  # LoanArchive holding the loans before base
+        # Archived loans that were still open, kept here so open-loan work never reads the
+        # archive: position -> (ISBN, member ID, borrow time)
+        self.archived_open: Dict[int, Tuple[str, str, int]] = {}
+        self.late_returns: Dict[int, int] = {}  # Archived loans returned since: position -> return time
+
+    def __getstate__(self) -> dict:
+        state = self.tables()
+        for name, _ in COLUMNS:
+            state[name] = getattr(self, name).to_array()
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__init__()
+        self.set_tables(state)
+        for name, _ in COLUMNS:
+            setattr(self, name, Column.from_array(state[name]))
+
+    def tables(self) -> dict:
+        # Everything but the columns, for storage backends that write those separately
+        return {'isbn_table': self.isbn_table, 'member_table': self.member_table, 'base': self.base,
+                'archived_open': self.archived_open, 'late_returns': self.late_returns}
+
+    def set_tables(self, tables: dict):
+        self.isbn_table = tables['isbn_table']
+        self.member_table = tables['member_table']
+        # Histories saved before archiving existed start at position 0
+        self.base = tables.get('base', 0)
+        self.archived_open = tables.get('archived_open', {})
+        self.late_returns = tables.get('late_returns', {})
+
+    def attach(self, columns: Dict[str, memoryview], member_offsets: memoryview,
+               member_positions: memoryview, mapping=None):
+        # Points the history at column views of a mapped snapshot holding every loan
+        # recorded so far; nothing is decoded until it is read
+        old_mapping = self._mapping
+        self.release(copy=False)
+        for name, typecode in COLUMNS:
+            setattr(self, name, Column(typecode, columns[name]))
+        self._member_offsets = member_offsets
+        self._member_positions = member_positions
+        self._member_index = {}
+        self._mapping = mapping
+        if old_mapping is not None:
+            old_mapping.close()
+
+    def release(self, copy: bool = True):
+        # Drops every view into the mapped snapshot so the file can be closed or
+        # replaced; with copy the loans are first read into memory
+        for name, typecode in COLUMNS:
+            column = getattr(self, name)
+            if column.base is not None:
+                if copy:
+                    column.tail = column.to_array()
+                column.release()
+        if copy and self._member_offsets is not None:
+            self._member_index = None  # Rebuilt from the in-memory columns when needed
+        for view in (self._member_offsets, self._member_positions):
+            if view is not None:
+                view.release()
+        self._member_offsets = self._member_positions = None
+        if copy and self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+    def __len__(self) -> int:
+        return self.base + len(self.borrow_times)
+
+    def __getitem__(self, position: int) -> LoanRecord:
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('loan position out of range')
+        return LoanRecord(self, position)
+
+    def __iter__(self) -> Iterator[LoanRecord]:
+        for position in range(len(self)):
+            yield LoanRecord(self, position)
+
+    def _isbn_code_map(self) -> Dict[str, int]:
+        if self._isbn_codes is None:
+            self._isbn_codes = {isbn: code for code, isbn in enumerate(self.isbn_table)}
+        return self._isbn_codes
+
+    def _member_code_map(self) -> Dict[str, int]:
+        if self._member_codes is None:
+            self._member_codes = {member_id: code for code, member_id in enumerate(self.member_table)}
+        return self._member_codes
+
+    @staticmethod
+    def _intern(value: str, table: List[str], codes: Dict[str, int]) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(table)
+            table.append(value)
+        return code
+
+    def add(self, isbn: str, member_id: str, borrow_date: datetime.datetime,
+            return_date: Optional[datetime.datetime] = None) -> int:
+        return self.add_row(isbn, member_id, to_micros(borrow_date),
+                            NOT_RETURNED if return_date is None else to_micros(return_date))
+
+    def add_row(self, isbn: str, member_id: str, borrow_time: int, return_time: int) -> int:
+        position = len(self)
+        member_code = self._intern(member_id, self.member_table, self._member_code_map())
+        self.isbn_ids.append(self._intern(isbn, self.isbn_table, self._isbn_code_map()))
+        self.member_ids.append(member_code)
+        self.borrow_times.append(borrow_time)
+        self.return_times.append(return_time)
+        if self._member_index is not None:
+            self._member_index.setdefault(member_code, array('I')).append(position)
+        return position
+
+    def append(self, record):
+        # Accepts a BorrowRecord (or anything shaped like one)
+        self.add(record.book_isbn, record.member_id, record.borrow_date, record.return_date)
+
+    def row(self, position: int) -> Tuple[str, str, int, int]:
+        # (ISBN, member ID, borrow time, return time or NOT_RETURNED), wherever the loan lives
+        if position < self.base:
+            return self._archived_row(position)
+        index = position - self.base
+        return (self.isbn_table[self.isbn_ids[index]], self.member_table[self.member_ids[index]],
+                self.borrow_times[index], self.return_times[index])
+
+    def _archived_row(self, position: int) -> Tuple[str, str, int, int]:
+        loan = self.archived_open.get(position)
+        if loan is not None:
+            return loan + (NOT_RETURNED,)
+        isbn, member_id, borrow_time, return_time = self.archive.row(position)
+        return isbn, member_id, borrow_time, self.late_returns.get(position, return_time)
+
+    def book_isbn(self, position: int) -> str:
+        if position < self.base:
+            return self._archived_row(position)[0]
+        return self.isbn_table[self.isbn_ids[position - self.base]]
+
+    def member_id(self, position: int) -> str:
+        if position < self.base:
+            return self._archived_row(position)[1]
+        return self.member_table[self.member_ids[position - self.base]]
+
+    def borrow_date(self, position: int) -> datetime.datetime:
+        if position < self.base:
+            return from_micros(self._archived_row(position)[2])
+        return from_micros(self.borrow_times[position - self.base])
+
+    def return_date(self, position: int) -> Optional[datetime.datetime]:
+        if position < self.base:
+            value = self._archived_row(position)[3]
+        else:
+            value = self.return_times[position - self.base]
+        return None if value == NOT_RETURNED else from_micros(value)
+
+    def is_open(self, position: int) -> bool:
+        if position < self.base:
+            return position in self.archived_open
+        return self.return_times[position - self.base] == NOT_RETURNED
+
+    def set_return(self, position: int, when: Optional[datetime.datetime]):
+        if position >= self.base:
+            self.return_times[position - self.base] = NOT_RETURNED if when is None else to_micros(when)
+        elif when is not None:
+            self.archived_open.pop(position, None)
+            self.late_returns[position] = to_micros(when)
+        elif position not in self.archived_open:
+            self.archived_open[position] = self._archived_row(position)[:3]
+            self.late_returns.pop(position, None)
+
+    def open_loans(self) -> Dict[str, int]:
+        # ISBN -> position of every unreturned loan; scans the hot part, so callers keep the result
+        loans = {isbn: position for position, (isbn, _, _) in sorted(self.archived_open.items())}
+        return_times = self.return_times
+        for index in range(len(return_times)):
+            if return_times[index] == NOT_RETURNED:
+                loans[self.isbn_table[self.isbn_ids[index]]] = self.base + index
+        return loans
+
+    def parts(self, newest_first: bool = False) -> Iterator['LoanHistory']:
+        # The archived segments and then this history, each a LoanHistory with its own
+        # tables and columns, for scans that read the columns directly
+        if newest_first:
+            yield self
+        if self.archive is not None:
+            yield from self.archive.parts(self.base, newest_first)
+        if not newest_first:
+            yield self
+
+    def archive_before(self, cutoff: datetime.datetime) -> int:
+        # Moves the leading run of loans borrowed before cutoff into the archive and returns
+        # how many moved. Open ones among them stay readable from archived_open
+        cutoff_micros = to_micros(cutoff)
+        borrow_times = self.borrow_times
+        count = 0
+        while count < len(borrow_times) and borrow_times[count] < cutoff_micros:
+            count += 1
+        if not count:
+            return 0
+        self.archive.append(self, self.base, self.base + count)
+        for index in range(count):
+            if self.return_times[index] == NOT_RETURNED:
+                self.archived_open[self.base + index] = self.row(self.base + index)[:3]
+        self.release()  # The columns are about to be cut, so stop pointing into a mapped snapshot
+        for name, _ in COLUMNS:
+            column = getattr(self, name)
+            column.tail = column.tail[count:]
+        self.base += count
+        self._member_index = None
+        return count
+
+    def count_recent(self, start: datetime.datetime, end: datetime.datetime) -> int:
+        # Loans borrowed in [start, end), scanning back from the newest until one is older
+        # than start; loans are appended in borrow order apart from back-dated imports
+        start_micros, end_micros = to_micros(start), to_micros(end)
+        borrow_times = self.borrow_times
+        count = 0
+        for index in range(len(borrow_times) - 1, -1, -1):
+            borrowed = borrow_times[index]
+            if borrowed < start_micros:
+                return count
+            if borrowed < end_micros:
+                count += 1
+        if self.archive is not None:  # Every hot loan is recent enough; go on into the archive
+            count += self.archive.count_recent(start_micros, end_micros, self.base)
+        return count
+
+    def _indexed_tail(self) -> Dict[int, array]:
+        if self._member_index is None:
+            start = self.member_ids.base_len if self._member_offsets is not None else 0
+            index: Dict[int, array] = {}
+            member_ids = self.member_ids
+            for position in range(start, len(member_ids)):
+                code = member_ids[position]
+                positions = index.get(code)
+                if positions is None:
+                    positions = index[code] = array('I')
+                positions.append(self.base + position)
+            self._member_index = index
+        return self._member_index
+
+    def member_positions(self, member_id: str) -> List[int]:
+        positions: List[int] = []
+        if self.archive is not None:
+            positions.extend(self.archive.member_positions(member_id, self.base))
+        code = self._member_code_map().get(member_id)
+        if code is None:
+            return positions
+        offsets = self._member_offsets
+        if offsets is not None and code + 1 < len(offsets):
+            positions.extend(self._member_positions[offsets[code]:offsets[code + 1]])
+        positions.extend(self._indexed_tail().get(code, ()))
+        return positions
+
+    def member_index(self) -> Tuple[array, array]:
+        # The per-member index of the hot part in CSR form: offsets[m]:offsets[m + 1] slices positions
+        tail = self._indexed_tail()
+        base_offsets = self._member_offsets
+        offsets = array('q', [0])
+        positions = array('I')
+        for code in range(len(self.member_table)):
+            if base_offsets is not None and code + 1 < len(base_offsets):
+                positions.frombytes(_as_bytes(self._member_positions[base_offsets[code]:base_offsets[code + 1]]))
+            extra = tail.get(code)
+            if extra:
+                positions.extend(extra)
+            offsets.append(len(positions))
+        return offsets, positions
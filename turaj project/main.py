@@ -1,4 +1,6 @@
-from library import LibrarySystem
+from library import DATA_FILE, SNAPSHOT_FILE, LibrarySystem
+from paging import take_page
+from storage import SnapshotStorage
 
 # تعریف رمز عبور متصدی به صورت متغیر برای تغییر آسان
 LIBRARIAN_PASSWORD = "admin"
@@ -16,17 +18,19 @@ def print_librarian_menu():
     print("9. Delete Member")
     print("10. View Member History")
     print("11. View Top Borrowers")
-    print("12. Exit")
+    print("12. Loan Reports")
+    print("13. Exit")
     print("=" * 25)
 
 def print_member_menu():
     print("\n=== Library Management System (Member) ===")
     print("1. View Available Books")
     print("2. Search Books")
-    print("3. Borrow Book")
-    print("4. Return Book")
+    print("3. Borrow Books")
+    print("4. Return Books")
     print("5. View My Borrowed Books")
-    print("6. Exit")
+    print("6. Browse Books by Category and Author")
+    print("7. Exit")
     print("==========================")
 
 
@@ -39,6 +43,77 @@ def print_delete_book_menu():
     print("0. Back to Main Menu")
     print("==========================")
 
+PAGE_SIZE = 10
+
+def show_pages(fetch, heading, show_row, empty_message):
+    # fetch(after) returns a (cursor, row) iterator starting behind the cursor; print a page
+    # at a time so long listings neither flood the terminal nor load every row up front
+    rows, cursor = take_page(fetch(None), PAGE_SIZE)
+    if not rows:
+        print(empty_message)
+        return
+    print(f"\n=== {heading} ===")
+    while True:
+        for row in rows:
+            show_row(row)
+        if cursor is None:
+            return
+        if input("Press Enter for more, or q to stop: ").strip().lower() == "q":
+            return
+        rows, cursor = take_page(fetch(cursor), PAGE_SIZE)
+
+def list_rows(items):
+    # fetch function for show_pages over a list that is already built; cursors are indexes
+    def fetch(after):
+        start = 0 if after is None else after + 1
+        return enumerate(items[start:], start)
+    return fetch
+
+def show_book(book):
+    print(f"Title: {book.title}")
+    print(f"Author: {book.author}")
+    print(f"Category: {book.category}")
+    print(f"ISBN: {book.isbn}")
+    print(f"Status: {'Available' if book.is_available else 'Borrowed'}")
+    print("-" * 30)
+
+def show_history_record(record):
+    print(f"Book Title: {record['book_title'] or '(deleted)'}")
+    print(f"ISBN: {record['book_isbn']}")
+    print(f"Borrowed: {record['borrow_date']}")
+    if record['is_returned']:
+        print(f"Returned: {record['return_date']}")
+    else:
+        print("Status: Not returned yet")
+    print("-" * 30)
+
+def show_member(member):
+    print(f"Name: {member['name']}")
+    print(f"Member ID: {member['member_id']}")
+    print(f"Contact: {member['contact']}")
+    print(f"Status: {'Active' if member['is_active'] else 'Inactive'}")
+    print(f"Currently Borrowed Books: {member['borrowed_books_count']}")
+    print("-" * 30)
+
+def show_overdue(book):
+    print(f"Title: {book['book_title']}")
+    print(f"ISBN: {book['book_isbn']}")
+    print(f"Member Name: {book['member_name']}")
+    print(f"Member ID: {book['member_id']}")
+    print(f"Days Overdue: {book['days_overdue']}")
+    print("-" * 30)
+
+def choose_isbn(library, isbns):
+    # Several books can share a title; let the librarian pick one by ISBN
+    if len(isbns) <= 1:
+        return isbns[0] if isbns else None
+    print("\nSeveral books match:")
+    for isbn in isbns:
+        book = library.books[isbn]
+        print(f"ISBN: {isbn} - {book.title} by {book.author}")
+    isbn = input("Enter the ISBN of the book to delete: ")
+    return isbn if isbn in isbns else None
+
 def handle_delete_book(library):
     while True:
         print_delete_book_menu()
@@ -54,7 +129,8 @@ def handle_delete_book(library):
             
         elif choice == "2":
             title = input("Enter book title to delete: ")
-            if library.delete_book_by_title(title):
+            isbn = choose_isbn(library, library.find_books_by_title(title))
+            if isbn and library.delete_book(isbn):
                 print("Book deleted successfully.")
             else:
                 print("Error: Book cannot be deleted. It might be borrowed or not exist.")
@@ -63,7 +139,8 @@ def handle_delete_book(library):
         elif choice == "3":
             author = input("Enter book author: ")
             title = input("Enter book title: ")
-            if library.delete_book_by_author_and_title(author, title):
+            isbn = choose_isbn(library, library.find_books_by_author_and_title(author, title))
+            if isbn and library.delete_book(isbn):
                 print("Book deleted successfully.")
             else:
                 print("Error: Book cannot be deleted. It might be borrowed or not exist.")
@@ -76,10 +153,54 @@ def handle_delete_book(library):
         else:
             print("Invalid option. Please try again.")
 
+def show_counts(heading, counts):
+    if counts:
+        print(f"{heading}: " + ", ".join(f"{value or '-'} ({count})" for value, count in counts.items()))
+
+def handle_browse(library):
+    # Narrow the catalogue one filter at a time; each count says how many books choosing it leaves
+    filters = {'category': None, 'author': None, 'available': None, 'text': None}
+    while True:
+        result = library.browse_books(limit=0, **filters)
+        print(f"\n=== Browse: {result['total']} books ===")
+        show_counts("Categories", result['facets']['category'])
+        show_counts("Authors", result['facets']['author'])
+        availability = result['facets']['availability']
+        print(f"Available: {availability['available']}, Borrowed: {availability['borrowed']}")
+        active = ", ".join(f"{name}={value}" for name, value in filters.items() if value is not None)
+        print(f"Filters: {active or 'none'}")
+        print("1. Category  2. Author  3. Only available  4. Text  5. Clear filters  6. Show books  0. Back")
+        choice = input("Please select an option: ")
+        if choice in ("1", "2", "4"):
+            name = {"1": "category", "2": "author", "4": "text"}[choice]
+            filters[name] = input(f"{name.capitalize()} (press Enter for any): ").strip() or None
+        elif choice == "3":
+            filters['available'] = None if filters['available'] else True
+        elif choice == "5":
+            filters = dict.fromkeys(filters)
+        elif choice == "6":
+            show_pages(lambda after: library.iter_browse(after=after, **filters),
+                       "Books", show_book, "No books match these filters.")
+        elif choice == "0":
+            return
+        else:
+            print("Invalid option. Please try again.")
+
+def read_isbns():
+    # One or more ISBNs, separated by commas or spaces
+    return input("Book ISBN(s), separated by commas: ").replace(',', ' ').split()
+
+def report_batch(errors, count, done):
+    if not errors:
+        print(f"{count} book(s) {done} successfully." if count > 1 else f"Book {done} successfully.")
+        return
+    print("Error: No books were " + done + ".")
+    for isbn, reason in errors.items():
+        print(f"  {isbn}: {reason}")
+
 def handle_member_mode(library, member_id):
     # Check for overdue books and show warning
-    overdue_books = library.get_overdue_books()
-    member_overdue = [book for book in overdue_books if book['member_id'] == member_id]
+    member_overdue = library.get_member_overdue(member_id)
     if member_overdue:
         print("\n⚠️ WARNING: You have overdue books!")
         for book in member_overdue:
@@ -92,72 +213,94 @@ def handle_member_mode(library, member_id):
         
         if choice == "1":
             # View available books
-            available_books = [book for book in library.books.values() if book.is_available]
-            if available_books:
-                print("\n=== Available Books ===")
-                for book in available_books:
-                    print(f"Title: {book.title}")
-                    print(f"Author: {book.author}")
-                    print(f"Category: {book.category}")
-                    print(f"ISBN: {book.isbn}")
-                    print("-" * 30)
-            else:
-                print("No books available for borrowing.")
+            show_pages(lambda after: library.iter_books(available=True, after=after),
+                       "Available Books", show_book, "No books available for borrowing.")
                 
         elif choice == "3":
-            isbn = input("Book ISBN: ")
-            if library.borrow_book(isbn, member_id):
-                print("Book borrowed successfully.")
-            else:
-                print("Error: Cannot borrow the book.")
+            isbns = read_isbns()
+            if isbns:
+                report_batch(library.borrow_books(member_id, isbns), len(isbns), "borrowed")
                 
         elif choice == "4":
-            isbn = input("Book ISBN: ")
-            if library.return_book(isbn, member_id):
-                print("Book returned successfully.")
-            else:
-                print("Error: Cannot return the book.")
+            isbns = read_isbns()
+            if isbns:
+                report_batch(library.return_books(member_id, isbns), len(isbns), "returned")
                 
         elif choice == "2":
             query = input("Search term (title, author or ISBN): ")
             results = library.search_books(query)
-            
-            if results:
-                print("\n=== Search Results ===")
-                for book in results:
-                    status = "Available" if book.is_available else "Borrowed"
-                    print(f"Title: {book.title}")
-                    print(f"Author: {book.author}")
-                    print(f"Category: {book.category}")
-                    print(f"ISBN: {book.isbn}")
-                    print(f"Status: {status}")
-                    print("-" * 30)
-            else:
-                print("No books found.")
+            show_pages(list_rows(results), "Search Results", show_book, "No books found.")
                 
         elif choice == "5":
-            history = library.get_member_borrow_history(member_id)
-            
-            if history:
-                print("\n=== Your Borrow History ===")
-                for record in history:
-                    print(f"Book Title: {record['book_title']}")
-                    print(f"ISBN: {record['book_isbn']}")
-                    print(f"Borrowed: {record['borrow_date']}")
-                    if record['is_returned']:
-                        print(f"Returned: {record['return_date']}")
-                    else:
-                        print("Status: Not returned yet")
-                    print("-" * 30)
-            else:
-                print("No borrow history found.")
+            show_pages(lambda after: library.iter_member_history(member_id, after),
+                       "Your Borrow History", show_history_record, "No borrow history found.")
                 
-        elif choice == "4":
+        elif choice == "6":
+            handle_browse(library)
+
+        elif choice == "7":
             break
             
         else:
             print("Invalid option. Please try again.")
 
+def show_duration_report(report):
+    print(f"\n=== Loan Durations ({report['category'] or 'all categories'}) ===")
+    print(f"Returned: {report['returned']}  Still out: {report['open']}")
+    print(f"Mean: {report['mean_days']:.1f} days  Median: {report['median_days']:.1f}  90th percentile: {report['p90_days']:.1f}")
+    for bucket in report['histogram']:
+        print(f"  {bucket['days']:>6} days: {bucket['loans']}")
+
+def show_circulation(report):
+    print("\n=== Monthly Circulation ===")
+    for index, month in enumerate(report['months']):
+        by_category = ", ".join(f"{category or '-'}: {counts[index]}"
+                                for category, counts in report['categories'].items() if counts[index])
+        print(f"{month}: {report['total'][index]}" + (f"  ({by_category})" if by_category else ""))
+
+def show_lateness(report):
+    print(f"\n=== Return Lateness (loan period {report['loan_days']} days) ===")
+    print(f"Returned late: {report['returned_late']} of {report['returned']} ({report['late_ratio']:.1%})")
+    print("Days late: " + "  ".join(f"{name}: {days:.0f}" for name, days in report['percentiles_days'].items()))
+    print(f"Currently overdue: {report['open_overdue']}")
+    for category, counts in sorted(report['categories'].items(), key=lambda item: -item[1]['late_ratio']):
+        print(f"  {category or '-'}: {counts['late']}/{counts['returned']} late ({counts['late_ratio']:.1%})")
+
+def show_cohorts(cohorts):
+    print("\n=== Member Cohorts (by month of first loan) ===")
+    if not cohorts:
+        print("No borrowing history available.")
+    for cohort in cohorts:
+        print(f"{cohort['cohort']}: {cohort['members']} members, active after n months: "
+              + " ".join(str(count) for count in cohort['active']))
+
+def handle_reports(library):
+    while True:
+        print("\n=== Loan Reports ===")
+        print("1. Loan Durations")
+        print("2. Monthly Circulation by Category")
+        print("3. Return Lateness")
+        print("4. Member Cohorts")
+        print("0. Back")
+        choice = input("Please select an option: ")
+        try:
+            if choice == "1":
+                category = input("Category (press Enter for all): ").strip() or None
+                show_duration_report(library.get_loan_duration_report(category))
+            elif choice == "2":
+                show_circulation(library.get_monthly_circulation())
+            elif choice == "3":
+                show_lateness(library.get_lateness_report())
+            elif choice == "4":
+                show_cohorts(library.get_member_cohorts())
+            elif choice == "0":
+                return
+            else:
+                print("Invalid option. Please try again.")
+        except ImportError as error:
+            print(f"Error: {error}")
+            return
+
 def handle_librarian_mode(library):
     while True:
         print_librarian_menu()
@@ -188,34 +331,11 @@ def handle_librarian_mode(library):
         elif choice == "3":
             query = input("Search term (title, author or ISBN): ")
             results = library.search_books(query)
-            
-            if results:
-                print("\n=== Search Results ===")
-                for book in results:
-                    status = "Available" if book.is_available else "Borrowed"
-                    print(f"Title: {book.title}")
-                    print(f"Author: {book.author}")
-                    print(f"Category: {book.category}")
-                    print(f"ISBN: {book.isbn}")
-                    print(f"Status: {status}")
-                    print("-" * 30)
-            else:
-                print("No books found.")
+            show_pages(list_rows(results), "Search Results", show_book, "No books found.")
                 
         elif choice == "4":
-            overdue_books = library.get_overdue_books()
-            
-            if overdue_books:
-                print("\n=== Overdue Books ===")
-                for book in overdue_books:
-                    print(f"Title: {book['book_title']}")
-                    print(f"ISBN: {book['book_isbn']}")
-                    print(f"Member Name: {book['member_name']}")
-                    print(f"Member ID: {book['member_id']}")
-                    print(f"Days Overdue: {book['days_overdue']}")
-                    print("-" * 30)
-            else:
-                print("No overdue books.")
+            show_pages(lambda after: library.iter_overdue(after=after),
+                       "Overdue Books", show_overdue, "No overdue books.")
                 
         elif choice == "5":
             stats = library.get_statistics()
@@ -225,23 +345,16 @@ def handle_librarian_mode(library):
             print(f"Borrowed Books: {stats['books_borrowed']}")
             print(f"Total Members: {stats['total_members']}")
             print(f"Active Members: {stats['active_members']}")
-            
+            print(f"Open Loans: {stats['open_loans']}")
+            print(f"Loans Today: {stats['loans_today']}")
+            for category, counts in sorted(stats['categories'].items()):
+                print(f"  {category or '-'}: {counts['available']}/{counts['total']} available")
+
         elif choice == "6":
             handle_delete_book(library)
                 
         elif choice == "7":
-            members = library.get_all_members()
-            if members:
-                print("\n=== All Members ===")
-                for member in members:
-                    print(f"Name: {member['name']}")
-                    print(f"Member ID: {member['member_id']}")
-                    print(f"Contact: {member['contact']}")
-                    print(f"Status: {'Active' if member['is_active'] else 'Inactive'}")
-                    print(f"Currently Borrowed Books: {member['borrowed_books_count']}")
-                    print("-" * 30)
-            else:
-                print("⚠ No members registered.")
+            show_pages(library.iter_members, "All Members", show_member, "⚠ No members registered.")
 
         elif choice == "8":
             member_id = input("Enter member ID to edit: ")
@@ -262,24 +375,13 @@ def handle_librarian_mode(library):
 
         elif choice == "10":
             member_id = input("Enter member ID: ")
-            history = library.get_member_borrow_history(member_id)
-            
-            if history:
-                print("\n=== Borrow History ===")
-                for record in history:
-                    print(f"Book Title: {record['book_title']}")
-                    print(f"ISBN: {record['book_isbn']}")
-                    print(f"Borrowed: {record['borrow_date']}")
-                    if record['is_returned']:
-                        print(f"Returned: {record['return_date']}")
-                    else:
-                        print("Status: Not returned yet")
-                    print("-" * 30)
-            else:
-                print("No borrow history found.")
+            show_pages(lambda after: library.iter_member_history(member_id, after),
+                       "Borrow History", show_history_record, "No borrow history found.")
                 
         elif choice == "11":
-            top_borrowers = library.get_top_borrowers()
+            print("\nPeriod: 1. All time  2. Last 30 days  3. This year")
+            window = {"2": "last_30_days", "3": "this_year"}.get(input("Choose a period: "))
+            top_borrowers = library.get_top_borrowers(window=window)
             if top_borrowers:
                 print("\n=== Top Borrowers ===")
                 for borrower in top_borrowers:
@@ -289,8 +391,21 @@ def handle_librarian_mode(library):
                     print("-" * 30)
             else:
                 print("No borrowing history available.")
+            top_books = library.get_top_books(window=window)
+            if top_books:
+                print("\n=== Most Borrowed Books ===")
+                for book in top_books:
+                    print(f"{book['book_title']} (ISBN: {book['book_isbn']}): {book['total_borrows']}")
+            top_categories = library.get_top_categories(window=window)
+            if top_categories:
+                print("\n=== Most Borrowed Categories ===")
+                for category in top_categories:
+                    print(f"{category['category'] or '-'}: {category['total_borrows']}")
                 
         elif choice == "12":
+            handle_reports(library)
+
+        elif choice == "13":
             print("Goodbye!")
             break
             
@@ -298,7 +413,9 @@ def handle_librarian_mode(library):
             print("Invalid option. Please try again.")
 
 def main():
-    library = LibrarySystem()
+    # Snapshot storage maps loan history lazily, so startup doesn't grow with it;
+    # an existing library_data.pkl is picked up on the first run
+    library = LibrarySystem(storage=SnapshotStorage(SNAPSHOT_FILE, legacy_file=DATA_FILE))
     
     while True:
         print("\n=== Welcome to Library Management System ===")
@@ -324,6 +441,7 @@ def main():
             else:
                 print("Error: Invalid Member ID")
         elif role_choice == "0":
+            library.checkpoint()
             print("Goodbye!")
             break
         else:
@@ -0,0 +1,237 @@
+import bisect
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+# Latency bucket upper bounds in seconds, Prometheus style (each bucket counts calls <= bound)
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Context managers and helpers that are not worth a histogram of their own
+_NOT_INSTRUMENTED = {'batch', 'reading', 'writing'}
+_STORAGE_METHODS = ('load', 'record', 'save', 'checkpoint', 'flush')
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # The last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th call; an estimate, like Prometheus'
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'sum_s': self.total,
+            'mean_ms': self.total / self.count * 1e3 if self.count else 0.0,
+            'p50_ms': self.quantile(0.5) * 1e3,
+            'p99_ms': self.quantile(0.99) * 1e3,
+            'buckets': {str(bound): count for bound, count in zip(BUCKETS + ('+Inf',), self.counts)}
+        }
+
+
+class Metrics:
+    # Opt-in instrumentation: LibrarySystem(metrics=Metrics()) wraps the public methods of
+    # that one instance and of its storage, so a library built without it runs unchanged code.
+    # With profile_threshold_ms set, outermost calls run under cProfile and the profiles
+    # of calls slower than the threshold are kept in slow_calls. Python 3.12+ allows one
+    # active profiler per process, so a call that starts while another is profiled runs
+    # unprofiled; profiling never changes what a call returns or raises.
+    def __init__(self, profile_threshold_ms: Optional[float] = None, keep_profiles: int = 20,
+                 profile_dir: Optional[str] = None):
+        self.latency: Dict[str, Histogram] = {}  # 'borrow_book', 'storage.record', ...
+        self.events: Dict[str, int] = {}  # 'search_index_hit', 'save_data_bytes', ...
+        self.profile_threshold = profile_threshold_ms / 1e3 if profile_threshold_ms is not None else None
+        self.profile_dir = profile_dir
+        self.slow_calls: Deque[Dict] = deque(maxlen=keep_profiles)
+        self._storage = None
+        self._lock = threading.Lock()
+        self._local = threading.local()  # Call depth, so nested calls are not profiled twice
+        self._profiling = threading.Lock()  # Held by the one call being profiled
+        self._exporter: Optional[threading.Thread] = None
+        self._stop_export = threading.Event()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.latency.get(name)
+            if histogram is None:
+                histogram = self.latency[name] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, event: str, amount: int = 1):
+        with self._lock:
+            self.events[event] = self.events.get(event, 0) + amount
+
+    def instrument(self, library):
+        for name, method in inspect.getmembers(type(library), inspect.isfunction):
+            if name.startswith('_') or name in _NOT_INSTRUMENTED:
+                continue
+            bound = getattr(library, name)
+            if inspect.isgeneratorfunction(inspect.unwrap(method)):
+                setattr(library, name, self._timed_generator(name, bound))
+            else:
+                setattr(library, name, self._timed(name, bound))
+        self.instrument_storage(library.storage)
+
+    def instrument_storage(self, storage):
+        self._storage = storage
+        for name in _STORAGE_METHODS:
+            setattr(storage, name, self._timed('storage.' + name, getattr(storage, name)))
+
+    def _timed(self, name: str, method: Callable) -> Callable:
+        counts_bytes = name in ('save_data', 'checkpoint')
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            local = self._local
+            depth = getattr(local, 'depth', 0)
+            profiler = None
+            if not depth and self.profile_threshold is not None:
+                profiler = self._start_profile()
+            local.depth = depth + 1
+            bytes_before = self._storage.bytes_written if counts_bytes else 0
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                local.depth = depth
+                if profiler is not None:
+                    self._stop_profile(name, elapsed, profiler)
+                self.observe(name, elapsed)
+                if counts_bytes:
+                    self.increment(name + '_bytes', self._storage.bytes_written - bytes_before)
+        return timed
+
+    def _start_profile(self) -> Optional[cProfile.Profile]:
+        # A running profiler, or None if another call (or another tool) is profiling
+        if not self._profiling.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # "Another profiling tool is already active"
+            self._profiling.release()
+            return None
+        return profiler
+
+    def _stop_profile(self, name: str, elapsed: float, profiler: cProfile.Profile):
+        try:
+            profiler.disable()
+            if elapsed >= self.profile_threshold:
+                self._keep_profile(name, elapsed, profiler)
+        except Exception:  # A lost profile must not fail the call it measured
+            self.increment('profile_errors')
+        finally:
+            self._profiling.release()
+
+    def _timed_generator(self, name: str, method: Callable) -> Callable:
+        # Counts the time spent producing rows, not the time the consumer holds the generator
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            rows = method(*args, **kwargs)
+            spent = 0.0
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        row = next(rows)
+                    except StopIteration:
+                        return
+                    finally:
+                        spent += time.perf_counter() - started
+                    yield row
+            finally:
+                rows.close()
+                self.observe(name, spent)
+        return timed
+
+    def _keep_profile(self, name: str, elapsed: float, profiler: cProfile.Profile):
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(25)
+        call = {'method': name, 'ms': elapsed * 1e3, 'at': time.time(), 'profile': text.getvalue()}
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            call['file'] = os.path.join(self.profile_dir, f"{name}-{int(call['at'] * 1000)}.prof")
+            profiler.dump_stats(call['file'])
+        with self._lock:
+            self.slow_calls.append(call)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'latency': {name: histogram.to_dict() for name, histogram in sorted(self.latency.items())},
+                'events': dict(sorted(self.events.items())),
+                'storage_bytes_written': self._storage.bytes_written if self._storage is not None else 0,
+                'slow_calls': [{key: value for key, value in call.items() if key != 'profile'}
+                               for call in self.slow_calls]
+            }
+
+    def to_prometheus(self, prefix: str = 'library') -> str:
+        lines: List[str] = []
+        with self._lock:
+            lines.append(f"# TYPE {prefix}_call_duration_seconds histogram")
+            for name, histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_call_duration_seconds_bucket{{method="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_call_duration_seconds_sum{{method="{name}"}} {histogram.total}')
+                lines.append(f'{prefix}_call_duration_seconds_count{{method="{name}"}} {histogram.count}')
+            lines.append(f"# TYPE {prefix}_events_total counter")
+            for event, count in sorted(self.events.items()):
+                lines.append(f'{prefix}_events_total{{event="{event}"}} {count}')
+            if self._storage is not None:
+                lines.append(f"# TYPE {prefix}_storage_bytes_written_total counter")
+                lines.append(f"{prefix}_storage_bytes_written_total {self._storage.bytes_written}")
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path: str):
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_file, path)
+
+    def start_json_export(self, path: str, interval: float = 10.0):
+        # Rewrites path every interval seconds until stop_json_export()
+        def export():
+            while not self._stop_export.wait(interval):
+                self.write_json(path)
+            self.write_json(path)
+
+        self._stop_export.clear()
+        self._exporter = threading.Thread(target=export, name='metrics-export', daemon=True)
+        self._exporter.start()
+
+    def stop_json_export(self):
+        if self._exporter is not None:
+            self._stop_export.set()
+            self._exporter.join()
+            self._exporter = None
+
+    def report(self, top: int = 15) -> List[Tuple[str, Dict]]:
+        # Methods by total time spent, for a quick look at where time goes
+        with self._lock:
+            ranked = sorted(self.latency.items(), key=lambda item: item[1].total, reverse=True)[:top]
+            return [(name, histogram.to_dict()) for name, histogram in ranked]
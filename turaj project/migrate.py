@@ -0,0 +1,33 @@
+import argparse
+
+from library import DATA_FILE, LibrarySystem
+from storage import PickleStorage, SQLiteStorage, SnapshotStorage
+
+
+def migrate_pickle_to_sqlite(pickle_file: str, db_file: str):
+    # Journaled storage also replays any ops still waiting in the journal
+    if pickle_file.endswith('.snap'):
+        source = SnapshotStorage(pickle_file)
+    else:
+        source = PickleStorage(pickle_file, journaled=True)
+    library = LibrarySystem(storage=source)
+    target = SQLiteStorage(db_file)
+    target.save(library)
+    target.close()
+    library.close()
+    return library.get_statistics(), len(library.borrow_records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the pickle data file into an SQLite database")
+    parser.add_argument('--pickle', default=DATA_FILE, help="source pickle (.pkl) or snapshot (.snap) file")
+    parser.add_argument('--sqlite', default='library.db', help="target SQLite database")
+    args = parser.parse_args()
+
+    stats, loans = migrate_pickle_to_sqlite(args.pickle, args.sqlite)
+    print(f"Migrated {stats['total_books']} books, {stats['total_members']} members "
+          f"and {loans} borrow records into {args.sqlite}")
+
+
+if __name__ == "__main__":
+    main()
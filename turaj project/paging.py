@@ -0,0 +1,20 @@
+from itertools import islice
+from typing import Iterable, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+C = TypeVar('C')
+
+CHUNK_SIZE = 256  # Rows read per lock acquisition by the LibrarySystem.iter_* generators
+
+
+def take_page(rows: Iterable[Tuple[C, T]], limit: int) -> Tuple[List[T], Optional[C]]:
+    # rows yields (cursor, item) pairs in a stable order. Returns up to limit items and
+    # the cursor to pass back as `after` for the next page, or None on the last page.
+    items: List[T] = []
+    last = None
+    for cursor, item in islice(rows, limit + 1):
+        if len(items) == limit:  # One row beyond the page: there is a next page
+            return items, last
+        items.append(item)
+        last = cursor
+    return items, None
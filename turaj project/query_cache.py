@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+
+class QueryCache:
+    # Bounded LRU of query results with a TTL. Instead of being flushed on every write, each
+    # entry remembers the versions of the scopes it was computed from ('loans', ('member', id),
+    # ('gram', 'abc'), ...); a write bumps only the scopes it touches, and an entry whose
+    # versions no longer match is dropped when it is next looked up.
+    def __init__(self, max_entries: int = 1024, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (value, expires at, ((scope, version), ...)); the oldest used entry comes first
+        self._entries: 'OrderedDict[Tuple, Tuple[object, float, Tuple]]' = OrderedDict()
+        self._versions: Dict[Hashable, int] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}  # kind -> hits, misses, invalidated, expired, evicted
+        self._lock = threading.Lock()  # Readers share the library lock, so they can race here
+
+    def _count(self, kind: str, event: str):
+        counts = self._stats.get(kind)
+        if counts is None:
+            counts = self._stats[kind] = {'hits': 0, 'misses': 0, 'invalidated': 0, 'expired': 0, 'evicted': 0}
+        counts[event] += 1
+
+    def lookup(self, key: Tuple) -> Tuple[bool, object]:
+        # key[0] is the kind of query; returns (found, value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._count(key[0], 'misses')
+                return False, None
+            value, expires, dependencies = entry
+            if time.monotonic() >= expires:
+                event = 'expired'
+            elif any(self._versions.get(scope, 0) != version for scope, version in dependencies):
+                event = 'invalidated'
+            else:
+                self._entries.move_to_end(key)
+                self._count(key[0], 'hits')
+                return True, value
+            del self._entries[key]
+            self._count(key[0], event)
+            self._count(key[0], 'misses')
+            return False, None
+
+    def store(self, key: Tuple, scopes: Iterable[Hashable], value: object, ttl: Optional[float] = None):
+        # Called under the library's read lock, so no write has bumped a scope since value was computed.
+        # ttl shortens the lifetime of results that go stale with the clock
+        lifetime = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            dependencies = tuple((scope, self._versions.get(scope, 0)) for scope in scopes)
+            self._entries[key] = (value, time.monotonic() + lifetime, dependencies)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._count(evicted[0], 'evicted')
+
+    def bump(self, *scopes: Hashable):
+        with self._lock:
+            versions = self._versions
+            for scope in scopes:
+                versions[scope] = versions.get(scope, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            kinds = {}
+            for kind, counts in sorted(self._stats.items()):
+                lookups = counts['hits'] + counts['misses']
+                kinds[kind] = dict(counts, hit_ratio=counts['hits'] / lookups if lookups else 0.0)
+            hits = sum(counts['hits'] for counts in self._stats.values())
+            lookups = hits + sum(counts['misses'] for counts in self._stats.values())
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_s': self.ttl,
+                'hit_ratio': hits / lookups if lookups else 0.0,
+                'kinds': kinds
+            }
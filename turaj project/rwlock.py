@@ -0,0 +1,79 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    # Many readers or one writer. A waiting writer holds back new readers so a
+    # steady stream of reports cannot starve checkouts. Re-entrant per thread:
+    # readers may read again, and the writer may read or write again.
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None  # Ident of the thread holding the write lock
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def acquire_read(self):
+        if self._writer == threading.get_ident():
+            self._write_depth += 1
+            return
+        depth = getattr(self._local, 'reads', 0)
+        if not depth:
+            with self._cond:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+                self._readers += 1
+        self._local.reads = depth + 1
+
+    def release_read(self):
+        if self._writer == threading.get_ident():
+            self._write_depth -= 1
+            return
+        self._local.reads -= 1
+        if not self._local.reads:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            self._write_depth += 1
+            return
+        if getattr(self._local, 'reads', 0):
+            # Two readers upgrading at once would wait on each other forever
+            raise RuntimeError("cannot take the write lock while holding the read lock")
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -0,0 +1,109 @@
+import bisect
+from array import array
+from typing import Dict, Iterable, List, Optional, Set
+
+
+def ngrams(fields: Iterable[str], n: int = 3) -> Set[str]:
+    grams = set()
+    for text in fields:
+        text = text.lower()
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+def _contains(posting: array, doc_id: int) -> bool:
+    index = bisect.bisect_left(posting, doc_id)
+    return index < len(posting) and posting[index] == doc_id
+
+
+class NGramIndex:
+    # Postings are sorted arrays of doc ids (4 bytes each rather than a set entry and an int
+    # object), and the index pickles them as one flat array so storage backends can save it
+    # with the catalogue instead of rebuilding it at the first search
+    def __init__(self, n: int = 3):
+        self.n = n
+        self._postings: Dict[str, array] = {}  # n-gram -> sorted doc ids
+        self._doc_ids: Dict[str, int] = {}  # key -> doc id
+        self._keys: Dict[int, str] = {}  # doc id -> key
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def __getstate__(self) -> dict:
+        grams = list(self._postings)
+        offsets = array('q', [0])
+        doc_ids = array('I')
+        for gram in grams:
+            doc_ids.extend(self._postings[gram])
+            offsets.append(len(doc_ids))
+        return {'n': self.n, 'grams': grams, 'offsets': offsets, 'doc_ids': doc_ids,
+                'keys': list(self._doc_ids), 'key_ids': array('I', self._doc_ids.values()),
+                'next_id': self._next_id}
+
+    def __setstate__(self, state: dict):
+        self.n = state['n']
+        offsets, doc_ids = state['offsets'], state['doc_ids']
+        self._postings = {gram: doc_ids[offsets[i]:offsets[i + 1]] for i, gram in enumerate(state['grams'])}
+        self._doc_ids = dict(zip(state['keys'], state['key_ids']))
+        self._keys = dict(zip(state['key_ids'], state['keys']))
+        self._next_id = state['next_id']
+
+    def _grams(self, fields: Iterable[str]) -> Set[str]:
+        return ngrams(fields, self.n)
+
+    def add(self, key: str, fields: Iterable[str]):
+        # Doc ids grow with insertion, so sorting by id keeps insertion order
+        doc_id = self._doc_ids.get(key)
+        if doc_id is None:
+            doc_id = self._next_id
+            self._next_id += 1
+            self._doc_ids[key] = doc_id
+            self._keys[doc_id] = key
+        for gram in self._grams(fields):
+            posting = self._postings.get(gram)
+            if posting is None:
+                self._postings[gram] = array('I', [doc_id])
+            elif posting[-1] < doc_id:  # A new key has the largest id, so it goes last
+                posting.append(doc_id)
+            elif not _contains(posting, doc_id):
+                posting.insert(bisect.bisect_left(posting, doc_id), doc_id)
+
+    def remove(self, key: str, fields: Iterable[str], keep_id: bool = False):
+        doc_id = self._doc_ids.get(key)
+        if doc_id is None:
+            return
+        for gram in self._grams(fields):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                index = bisect.bisect_left(posting, doc_id)
+                if index < len(posting) and posting[index] == doc_id:
+                    del posting[index]
+                if not posting:
+                    del self._postings[gram]
+        if not keep_id:
+            del self._doc_ids[key]
+            del self._keys[doc_id]
+
+    def update(self, key: str, old_fields: Iterable[str], new_fields: Iterable[str]):
+        self.remove(key, old_fields, keep_id=True)
+        self.add(key, new_fields)
+
+    def candidates(self, query: str) -> Optional[List[str]]:
+        # None means the query is shorter than n and cannot use the index
+        if len(query) < self.n:
+            return None
+        postings = []
+        for gram in self._grams([query]):
+            posting = self._postings.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        # Check the ids of the shortest posting against the others by binary search; they stay sorted
+        matches = postings[0]
+        for posting in postings[1:]:
+            matches = [doc_id for doc_id in matches if _contains(posting, doc_id)]
+            if not matches:
+                return []
+        return [self._keys[doc_id] for doc_id in matches]
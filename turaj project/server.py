@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import datetime
+import json
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from library import DATA_FILE, SNAPSHOT_FILE, LibrarySystem
+from metrics import Metrics
+from paging import take_page
+from query_cache import QueryCache
+from storage import DURABILITY_LEVELS, SQLiteStorage, SnapshotStorage
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"cannot serialise {type(value).__name__}")
+
+
+def _book_dict(book) -> Dict:
+    return {'isbn': book.isbn, 'title': book.title, 'author': book.author,
+            'category': book.category, 'is_available': book.is_available}
+
+
+def _int_param(params: Dict[str, str], name: str, default: int) -> int:
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        raise HTTPError(400, f"{name} must be an integer")
+
+
+def _page(rows, params: Dict[str, str], key: str, default_limit: int) -> Dict:
+    items, cursor = take_page(rows, _int_param(params, 'limit', default_limit))
+    return {key: items, 'next_cursor': cursor}
+
+
+def _fields(body: Optional[dict], *names: str) -> List[str]:
+    if not isinstance(body, dict):
+        raise HTTPError(400, "expected a JSON object body")
+    values = [body.get(name) for name in names]
+    if not all(isinstance(value, str) and value for value in values):
+        raise HTTPError(400, f"{', '.join(names)} are required")
+    return values
+
+
+class LibraryService:
+    # Routes HTTP/JSON requests to a thread-safe LibrarySystem. Library calls never run on
+    # the event loop: they can wait on the library lock or on storage, so reads go to a
+    # thread pool and writes to a single thread (they are serialised by the lock anyway).
+    def __init__(self, library: LibrarySystem, readers: int = 8):
+        self.library = library
+        self.read_pool = ThreadPoolExecutor(readers, thread_name_prefix='library-read')
+        self.write_pool = ThreadPoolExecutor(1, thread_name_prefix='library-write')
+        self.routes: List[Tuple[str, Tuple[str, ...], bool, Callable]] = [
+            # (method, path pattern, writes, handler); '*' matches one path segment
+            ('GET', ('books',), False, self.search_books),
+            ('GET', ('books', '*'), False, self.get_book),
+            ('GET', ('browse',), False, self.browse_books),
+            ('POST', ('borrow',), True, self.borrow_book),
+            ('POST', ('return',), True, self.return_book),
+            ('GET', ('members',), False, self.list_members),
+            ('GET', ('members', '*', 'history'), False, self.member_history),
+            ('GET', ('overdue',), False, self.overdue),
+            ('GET', ('overdue', 'new'), False, self.newly_overdue),
+            ('GET', ('due-soon',), False, self.due_soon),
+            ('GET', ('stats',), False, self.statistics),
+            ('GET', ('top-borrowers',), False, self.top_borrowers),
+            ('GET', ('metrics',), False, self.metrics),
+            ('GET', ('cache',), False, self.cache)
+        ]
+
+    def route(self, method: str, path: str) -> Tuple[bool, Callable, List[str]]:
+        segments = tuple(unquote(part) for part in path.strip('/').split('/') if part)
+        allowed = False
+        for route_method, pattern, writes, handler in self.routes:
+            if len(pattern) != len(segments) or not all(p in ('*', s) for p, s in zip(pattern, segments)):
+                continue
+            if route_method == method:
+                return writes, handler, [s for p, s in zip(pattern, segments) if p == '*']
+            allowed = True
+        if allowed:
+            raise HTTPError(405, f"{method} not allowed on {path}")
+        raise HTTPError(404, f"no such endpoint {path}")
+
+    async def handle(self, method: str, target: str, body: Optional[dict]) -> Tuple[int, object]:
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        writes, handler, args = self.route(method, url.path)
+        pool = self.write_pool if writes else self.read_pool
+        return await asyncio.get_running_loop().run_in_executor(pool, handler, params, body, *args)
+
+    def search_books(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        limit = _int_param(params, 'limit', 50)
+        books = self.library.search_books(params.get('q', ''))
+        return 200, {'count': len(books), 'books': [_book_dict(book) for book in books[:limit]]}
+
+    def get_book(self, params: Dict[str, str], body, isbn: str) -> Tuple[int, object]:
+        with self.library.reading():
+            book = self.library.books.get(isbn)
+            if book is None:
+                raise HTTPError(404, f"no book with ISBN {isbn}")
+            return 200, _book_dict(book)
+
+    def browse_books(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        # ?category=&author=&available=true|false&q=, each optional; facets count the other filters
+        available = params.get('available')
+        if available not in (None, 'true', 'false'):
+            raise HTTPError(400, "available must be true or false")
+        cursor = _int_param(params, 'cursor', -1)
+        result = self.library.browse_books(params.get('category'), params.get('author'),
+                                           None if available is None else available == 'true', params.get('q'),
+                                           _int_param(params, 'limit', 20), cursor if cursor >= 0 else None,
+                                           _int_param(params, 'facets', 10))
+        result['books'] = [_book_dict(book) for book in result['books']]
+        return 200, result
+
+    def borrow_book(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        if isinstance(body, dict) and 'isbns' in body:
+            return self._batch(body, self.library.borrow_books, 'borrowed')
+        isbn, member_id = _fields(body, 'isbn', 'member_id')
+        if not self.library.borrow_book(isbn, member_id):
+            raise HTTPError(409, "book is not available or member cannot borrow")
+        return 200, {'isbn': isbn, 'member_id': member_id, 'borrowed': True}
+
+    def return_book(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        if isinstance(body, dict) and 'isbns' in body:
+            return self._batch(body, self.library.return_books, 'returned')
+        isbn, member_id = _fields(body, 'isbn', 'member_id')
+        if not self.library.return_book(isbn, member_id):
+            raise HTTPError(409, "member does not have this book")
+        return 200, {'isbn': isbn, 'member_id': member_id, 'returned': True}
+
+    @staticmethod
+    def _batch(body: dict, apply: Callable, done: str) -> Tuple[int, object]:
+        # {"member_id": ..., "isbns": [...]}: all or nothing, 409 with the reason for each failing ISBN
+        member_id, = _fields(body, 'member_id')
+        isbns = body['isbns']
+        if not isinstance(isbns, list) or not isbns or not all(isinstance(isbn, str) and isbn for isbn in isbns):
+            raise HTTPError(400, "isbns must be a non-empty list of ISBNs")
+        errors = apply(member_id, isbns)
+        if errors:
+            return 409, {'member_id': member_id, done: False, 'errors': errors}
+        return 200, {'member_id': member_id, 'isbns': isbns, done: True}
+
+    # Listings are paged: pass next_cursor back as ?cursor= to get the following page
+
+    def list_members(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        return 200, _page(self.library.iter_members(params.get('cursor')), params, 'members', 100)
+
+    def member_history(self, params: Dict[str, str], body, member_id: str) -> Tuple[int, object]:
+        with self.library.reading():
+            if member_id not in self.library.members:
+                raise HTTPError(404, f"no member with ID {member_id}")
+        cursor = _int_param(params, 'cursor', -1)
+        rows = self.library.iter_member_history(member_id, cursor if cursor >= 0 else None)
+        return 200, _page(rows, params, 'history', 100)
+
+    def overdue(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        if 'member' in params:  # One member's loans only, unpaged
+            return 200, {'overdue': self.library.get_member_overdue(params['member'], _int_param(params, 'days', 14)),
+                         'next_cursor': None}
+        cursor = _int_param(params, 'cursor', -1)
+        rows = self.library.iter_overdue(_int_param(params, 'days', 14), cursor if cursor >= 0 else None)
+        return 200, _page(rows, params, 'overdue', 100)
+
+    def newly_overdue(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        # ?since= takes the checked_at of the previous call
+        since = None
+        if 'since' in params:
+            try:
+                since = datetime.datetime.fromisoformat(params['since'])
+            except ValueError:
+                raise HTTPError(400, "since must be an ISO date and time")
+            if since.utcoffset() is not None:
+                raise HTTPError(400, "since must be a naive local time, like checked_at")
+        rows, checked_at = self.library.get_newly_overdue(since, _int_param(params, 'days', 14))
+        return 200, {'overdue': rows, 'checked_at': checked_at}
+
+    def due_soon(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        return 200, {'due': self.library.get_books_due_soon(_int_param(params, 'within', 3),
+                                                            _int_param(params, 'days', 14))}
+
+    def statistics(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        return 200, self.library.get_statistics()
+
+    def top_borrowers(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        window = params.get('window')
+        if window not in (None, 'last_30_days', 'this_year'):
+            raise HTTPError(400, "window must be last_30_days or this_year")
+        return 200, self.library.get_top_borrowers(_int_param(params, 'limit', 5), window)
+
+    def metrics(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        # Prometheus text by default, ?format=json for the same data as JSON
+        if self.library.metrics is None:
+            raise HTTPError(404, "metrics are disabled; start the server with --metrics")
+        if params.get('format') == 'json':
+            return 200, self.library.metrics.snapshot()
+        return 200, self.library.metrics.to_prometheus()
+
+    def cache(self, params: Dict[str, str], body) -> Tuple[int, object]:
+        # Hit ratios per query kind, for tuning --cache-size
+        if self.library.query_cache is None:
+            raise HTTPError(404, "the query cache is disabled; start the server with --cache-size")
+        return 200, self.library.query_cache.stats()
+
+    async def serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # One connection, possibly several keep-alive requests
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break  # Client closed the connection
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 413, {'error': "request headers too large"}, False)
+                    break
+                keep_alive = await self._serve_request(reader, writer, head)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                             head: bytes) -> bool:
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            await self._respond(writer, 400, {'error': "malformed request line"}, False)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name:
+                headers[name.strip().lower()] = value.strip()
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY_BYTES:
+            await self._respond(writer, 413 if length > 0 else 400, {'error': "bad Content-Length"}, False)
+            return False
+        data = await reader.readexactly(length) if length else b''
+
+        try:
+            body = json.loads(data) if data else None
+        except ValueError:
+            status, payload = 400, {'error': "body is not valid JSON"}
+        else:
+            try:
+                status, payload = await self.handle(method, target, body)
+            except HTTPError as error:
+                status, payload = error.status, {'error': error.message}
+            except Exception as error:
+                status, payload = 500, {'error': repr(error)}
+        await self._respond(writer, status, payload, keep_alive)
+        return keep_alive
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: object, keep_alive: bool):
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body = json.dumps(payload, default=_json_default, ensure_ascii=False).encode()
+            content_type = 'application/json; charset=utf-8'
+        writer.write((f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                      f"Content-Type: {content_type}\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    def shutdown(self):
+        self.read_pool.shutdown()
+        self.write_pool.shutdown()
+
+
+async def serve(library: LibrarySystem, host: str = '127.0.0.1', port: int = 8080, readers: int = 8,
+                backlog: int = 4096, ready: Optional[Callable[[asyncio.AbstractServer], None]] = None):
+    service = LibraryService(library, readers)
+    server = await asyncio.start_server(service.serve_client, host, port, backlog=backlog,
+                                        limit=MAX_HEADER_BYTES)
+    if ready is not None:
+        ready(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.shutdown()
+
+
+async def _serve_until_terminated(library: LibrarySystem, host: str, port: int, readers: int):
+    # A service manager stops the server with SIGTERM; stop serving and return normally so
+    # main() still flushes the library
+    serving = asyncio.ensure_future(serve(library, host, port, readers))
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    except NotImplementedError:  # No loop signal handlers on Windows
+        pass
+    try:
+        await serving
+    except asyncio.CancelledError:
+        if not serving.cancelled():
+            raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the library as an HTTP/JSON API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--readers', type=int, default=8, help="threads running read requests")
+    parser.add_argument('--snapshot', default=SNAPSHOT_FILE, help="snapshot data file used by main.py")
+    parser.add_argument('--sqlite', help="use this SQLite database instead of the snapshot file")
+    parser.add_argument('--durability', choices=DURABILITY_LEVELS, default='always',
+                        help="when changes reach disk: on every write, every --flush-ms, or on shutdown")
+    parser.add_argument('--flush-ms', type=int, default=100, help="flush interval for --durability interval")
+    parser.add_argument('--metrics', action='store_true', help="record call latencies, served at /metrics")
+    parser.add_argument('--profile-ms', type=float,
+                        help="with --metrics, keep cProfile output of calls slower than this")
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help="cache this many search and report results (0 disables); stats at /cache")
+    parser.add_argument('--cache-ttl', type=float, default=60.0, help="seconds a cached result may be served")
+    args = parser.parse_args()
+
+    storage = SQLiteStorage(args.sqlite) if args.sqlite else SnapshotStorage(args.snapshot, legacy_file=DATA_FILE)
+    metrics = Metrics(profile_threshold_ms=args.profile_ms, profile_dir='profiles') if args.metrics else None
+    query_cache = QueryCache(args.cache_size, args.cache_ttl) if args.cache_size > 0 else None
+    library = LibrarySystem(storage=storage, thread_safe=True, durability=args.durability,
+                            flush_interval_ms=args.flush_ms, metrics=metrics, query_cache=query_cache)
+    print(f"Serving {len(library.books)} books on http://{args.host}:{args.port}/")
+    try:
+        asyncio.run(_serve_until_terminated(library, args.host, args.port, args.readers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        library.checkpoint()
+        library.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import mmap
+import os
+import pickle
+import struct
+from typing import Dict, List, Tuple
+
+from loan_history import COLUMNS, LoanHistory
+
+# Layout: header, segment table, then 8-byte aligned segments.
+# Pickled segments hold the catalogue and small metadata and are read eagerly;
+# raw segments hold loan columns and the member index and are memory-mapped.
+MAGIC = b'LIBSNAP1'
+_HEADER = struct.Struct('<8sI')  # magic, segment count
+_SEGMENT = struct.Struct('<16sQQ')  # name, offset, length
+_RAW_SEGMENTS = dict(COLUMNS, member_offsets='q', member_positions='I')
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def write_snapshot(path: str, meta: dict, books: dict, members: dict,
+                   open_loans: Dict[str, int], history: LoanHistory, search_index=None):
+    member_offsets, member_positions = history.member_index()
+    segments: List[Tuple[str, list]] = [
+        ('meta', [pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL)]),
+        ('catalog', [pickle.dumps({'books': books, 'members': members}, protocol=pickle.HIGHEST_PROTOCOL)]),
+        ('open_loans', [pickle.dumps(open_loans, protocol=pickle.HIGHEST_PROTOCOL)]),
+        ('loan_tables', [pickle.dumps(history.tables(), protocol=pickle.HIGHEST_PROTOCOL)]),
+        ('member_offsets', [member_offsets]),
+        ('member_positions', [member_positions])
+    ]
+    if search_index is not None:
+        segments.append(('search_index', [pickle.dumps(search_index, protocol=pickle.HIGHEST_PROTOCOL)]))
+    segments += [(name, getattr(history, name).buffers()) for name, _ in COLUMNS]
+
+    table = []
+    offset = _align(_HEADER.size + _SEGMENT.size * len(segments))
+    for name, chunks in segments:
+        length = sum(memoryview(chunk).nbytes for chunk in chunks)
+        table.append(_SEGMENT.pack(name.encode(), offset, length))
+        offset = _align(offset + length)
+
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(segments)))
+        f.write(b''.join(table))
+        for name, chunks in segments:
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            for chunk in chunks:
+                f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class SnapshotFile:
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        view = memoryview(self.mapping)
+        magic, count = _HEADER.unpack_from(view)
+        if magic != MAGIC:
+            view.release()
+            self.mapping.close()
+            raise ValueError(f"{path} is not a library snapshot")
+        self.segments: Dict[str, Tuple[int, int]] = {}
+        for i in range(count):
+            name, offset, length = _SEGMENT.unpack_from(view, _HEADER.size + i * _SEGMENT.size)
+            self.segments[name.rstrip(b'\0').decode()] = (offset, length)
+        view.release()
+
+    def load(self, name: str):
+        offset, length = self.segments[name]
+        return pickle.loads(self.mapping[offset:offset + length])
+
+    def view(self, name: str) -> memoryview:
+        # Zero-copy view; pages are only read from disk when touched
+        offset, length = self.segments[name]
+        with memoryview(self.mapping) as whole:
+            return whole[offset:offset + length].cast(_RAW_SEGMENTS[name])
+
+    def attach_history(self, history: LoanHistory):
+        columns = {name: self.view(name) for name, _ in COLUMNS}
+        history.attach(columns, self.view('member_offsets'), self.view('member_positions'), self.mapping)
+
+    def load_history(self) -> LoanHistory:
+        tables = self.load('loan_tables')
+        history = LoanHistory()
+        history.set_tables(tables)
+        self.attach_history(history)
+        return history
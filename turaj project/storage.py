@@ -0,0 +1,527 @@
+import atexit
+import datetime
+import itertools
+import os
+import pickle
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from journal import MutationJournal, fsync_directory
+from loan_archive import LoanArchive
+from loan_history import NOT_RETURNED, LoanHistory, to_micros, from_micros
+from snapshot import SnapshotFile, write_snapshot
+
+
+class Storage:
+    # A backend loads the library state and persists the ops applied to it.
+    # Ops are the tuples LibrarySystem._commit() applies, e.g. ('add_book', title, author, category, isbn)
+    bytes_written = 0  # Bytes written to disk so far, for backends that can tell
+    checkpoint_saves = True  # checkpoint() writes the whole library, not just what was recorded
+
+    def load(self) -> Tuple[Optional[dict], Iterable[tuple]]:
+        # Returns (state, ops to replay on top of it); state holds books, members and
+        # borrow_records, and optionally open_loans (ISBN -> position) and search_index
+        # (an NGramIndex of the books) if the backend saved them
+        raise NotImplementedError
+
+    def record(self, library, ops: List[tuple]):
+        raise NotImplementedError
+
+    def save(self, library):
+        raise NotImplementedError
+
+    def checkpoint(self, library):
+        self.save(library)
+
+    def set_durability(self, durability: str):
+        # Told by GroupCommitStorage when ops may reach the disk later than record() returns;
+        # a backend can then sync less often
+        pass
+
+    def flush(self, library):
+        # Persists anything recorded but not yet written; a no-op for backends that write at once
+        pass
+
+    def close(self):
+        pass
+
+
+class PickleStorage(Storage):
+    def __init__(self, data_file: str, journaled: bool = False, checkpoint_interval: int = 1000,
+                 archive_after_days: Optional[int] = 90):
+        self.data_file = data_file
+        # In journaled mode ops are appended to a log and folded into
+        # the snapshot every `checkpoint_interval` records
+        self.journal = MutationJournal(data_file + '.journal') if journaled else None
+        self.checkpoint_interval = checkpoint_interval
+        # Each save moves loans borrowed more than archive_after_days ago out of the
+        # history into the archive; None keeps them all in the history
+        self.archive = LoanArchive(data_file + '.archive')
+        self.archive_after_days = archive_after_days
+        self._saved_bytes = 0
+
+    @property
+    def bytes_written(self) -> int:
+        return self._saved_bytes + (self.journal.bytes_written if self.journal else 0)
+
+    def load(self) -> Tuple[Optional[dict], Iterable[tuple]]:
+        state = self._read_state()
+        if state:
+            history = state['borrow_records']
+            self.archive.discard_from(history.base)
+            history.archive = self.archive
+        if self.journal is None:
+            return state, ()
+        return state, self.journal.replay(state.get('journal_seq', 0) if state else 0)
+
+    def _read_state(self) -> Optional[dict]:
+        try:
+            with open(self.data_file, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        if isinstance(state['borrow_records'], list):  # Snapshots written before LoanHistory
+            history = LoanHistory()
+            for record in state['borrow_records']:
+                history.append(record)
+            state['borrow_records'] = history
+        for member in state['members'].values():
+            if isinstance(member.borrowed_books, list):  # Snapshots written before the ordered set
+                member.borrowed_books = dict.fromkeys(member.borrowed_books)
+        return state
+
+    def record(self, library, ops: List[tuple]):
+        if self.journal is None:
+            self.save(library)
+            return
+        self.journal.append_many(ops)
+        if self.journal.entries >= self.checkpoint_interval:
+            self.checkpoint(library)
+
+    def _archive_old_loans(self, history: LoanHistory):
+        if history.archive is not self.archive:
+            # A history this backend did not load (a new library, or one read from another
+            # file): start the archive afresh and copy over whatever it had archived
+            self.archive.discard_from(0)
+            if history.base:
+                self.archive.append(history, 0, history.base)
+            history.archive = self.archive
+        if self.archive_after_days is not None:
+            history.archive_before(datetime.datetime.now() - datetime.timedelta(days=self.archive_after_days))
+
+    def save(self, library):
+        self._archive_old_loans(library.borrow_records)
+        data = {
+            'books': library.books,
+            'members': library.members,
+            'borrow_records': library.borrow_records,
+            'search_index': library.search_index,
+            'journal_seq': self.journal.last_seq if self.journal else 0
+        }
+        # Write to a temp file and rename so a crash never leaves a torn snapshot
+        tmp_file = self.data_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+            self._saved_bytes += f.tell()
+        os.replace(tmp_file, self.data_file)
+        fsync_directory(self.data_file)
+
+    def checkpoint(self, library):
+        # Fold the journal into a fresh snapshot, then compact the log away. save() has made
+        # the rename durable, so a power cut cannot bring back the old snapshot once the
+        # journal that completes it is gone
+        self.save(library)
+        if self.journal:
+            self.journal.reset()
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+
+
+class SnapshotStorage(PickleStorage):
+    # Segmented binary snapshot (see snapshot.py): books and members load eagerly,
+    # loan history stays memory-mapped and is only read when a query touches it
+    def __init__(self, snapshot_file: str, journaled: bool = True, checkpoint_interval: int = 1000,
+                 legacy_file: Optional[str] = None, archive_after_days: Optional[int] = 90):
+        super().__init__(snapshot_file, journaled, checkpoint_interval, archive_after_days)
+        self.legacy_file = legacy_file  # Pickle data file to start from if there is no snapshot yet
+
+    def load(self) -> Tuple[Optional[dict], Iterable[tuple]]:
+        if self.legacy_file and not os.path.exists(self.data_file) and os.path.exists(self.legacy_file):
+            # First run after switching formats: the old pickle and its journal come first,
+            # then anything already journaled here; the next checkpoint writes the snapshot
+            state, legacy_ops = PickleStorage(self.legacy_file, journaled=True).load()
+            ops = self.journal.replay(0) if self.journal else ()
+            return state, itertools.chain(legacy_ops, ops)
+        return super().load()
+
+    def _read_state(self) -> Optional[dict]:
+        try:
+            snapshot = SnapshotFile(self.data_file)
+        except FileNotFoundError:
+            return None
+        catalog = snapshot.load('catalog')
+        return {
+            'books': catalog['books'],
+            'members': catalog['members'],
+            'borrow_records': snapshot.load_history(),
+            'open_loans': snapshot.load('open_loans'),
+            # Snapshots written before the index was saved lack it; the library builds it
+            'search_index': snapshot.load('search_index') if 'search_index' in snapshot.segments else None,
+            'journal_seq': snapshot.load('meta')['journal_seq']
+        }
+
+    def save(self, library):
+        history = library.borrow_records
+        self._archive_old_loans(history)
+        tmp_file = self.data_file + '.tmp'
+        write_snapshot(tmp_file, {'journal_seq': self.journal.last_seq if self.journal else 0},
+                       library.books, library.members, library.open_loans, history, library.search_index)
+        self._saved_bytes += os.path.getsize(tmp_file)
+        if os.name == 'nt':  # Windows cannot replace a file that is still mapped
+            history.release()
+        os.replace(tmp_file, self.data_file)
+        fsync_directory(self.data_file)
+        # The new file holds every loan, so map it in place of the old one
+        SnapshotFile(self.data_file).attach_history(history)
+
+
+DURABILITY_LEVELS = ('always', 'interval', 'shutdown')
+
+
+class GroupCommitStorage(Storage):
+    # Wraps another backend and decides when recorded ops reach it:
+    #   'always'   - on every record, as if unwrapped
+    #   'interval' - a background thread writes whatever accumulated every `interval`
+    #                seconds, or sooner once `max_pending` ops are waiting
+    #   'shutdown' - only on flush(), checkpoint(), close() or interpreter exit
+    # Each write hands the wrapped backend all pending ops at once, so a journal
+    # appends them with one fsync and SQLite commits them in one transaction.
+    def __init__(self, storage: Storage, durability: str = 'interval', interval: float = 0.1,
+                 max_pending: int = 1000):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability must be one of {DURABILITY_LEVELS}")
+        self.storage = storage
+        self.durability = durability
+        storage.set_durability(durability)
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: List[tuple] = []
+        self._library = None  # Set on the first record; the flusher thread and exit hook need it
+        self._wakeup = threading.Condition()
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = False
+
+    @property
+    def bytes_written(self) -> int:
+        return self.storage.bytes_written
+
+    def __getattr__(self, name: str):
+        # Backend-specific queries (SQLiteStorage.search_books...) see only flushed ops
+        return getattr(self.storage, name)
+
+    def load(self) -> Tuple[Optional[dict], Iterable[tuple]]:
+        return self.storage.load()
+
+    def record(self, library, ops: List[tuple]):
+        if self.durability == 'always':
+            self.storage.record(library, ops)
+            return
+        with self._wakeup:
+            self._pending.extend(ops)
+            if self._library is None:
+                self._library = library
+                atexit.register(self._flush_at_exit)
+                if self.durability == 'interval':
+                    self._flusher = threading.Thread(target=self._run_flusher, name='library-flusher', daemon=True)
+                    self._flusher.start()
+            if len(self._pending) >= self.max_pending:
+                self._wakeup.notify()
+
+    def _run_flusher(self):
+        library = self._library
+        while True:
+            with self._wakeup:
+                self._wakeup.wait_for(lambda: self._pending or self._closed)
+                # Let more ops join this write unless enough are already waiting
+                self._wakeup.wait_for(lambda: len(self._pending) >= self.max_pending or self._closed,
+                                      self.interval)
+                if self._closed:
+                    return
+            # The library lock keeps mutations out while a write (possibly a full save) runs
+            with library.writing():
+                if self._closed:
+                    return
+                self.flush(library)
+
+    def flush(self, library):
+        # Callers hold the library's write lock in thread-safe mode
+        with self._wakeup:
+            ops, self._pending = self._pending, []
+        if ops:
+            self.storage.record(library, ops)
+        self.storage.flush(library)
+
+    def save(self, library):
+        # A full save already contains every pending op
+        with self._wakeup:
+            self._pending = []
+        self.storage.save(library)
+
+    def checkpoint(self, library):
+        with self._wakeup:
+            ops, self._pending = self._pending, []
+        # A checkpoint that only compacts (SQLite's WAL) would drop ops that were never recorded
+        if ops and not self.storage.checkpoint_saves:
+            self.storage.record(library, ops)
+        self.storage.checkpoint(library)
+
+    def _flush_at_exit(self):
+        if not self._closed and self._library is not None:
+            self._library.flush()
+
+    def close(self):
+        # No join: the flusher may be waiting for the lock our caller holds; it exits once it sees _closed
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+        if self._library is not None:
+            self.flush(self._library)
+            atexit.unregister(self._flush_at_exit)
+        self.storage.close()
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS books (
+    isbn TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    category TEXT NOT NULL,
+    is_available INTEGER NOT NULL DEFAULT 1,
+    title_lc TEXT NOT NULL,
+    author_lc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_title_lc ON books (title_lc);
+CREATE INDEX IF NOT EXISTS books_author_title_lc ON books (author_lc, title_lc);
+CREATE INDEX IF NOT EXISTS books_available ON books (is_available);
+CREATE TABLE IF NOT EXISTS members (
+    member_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    contact TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS borrow_records (
+    id INTEGER PRIMARY KEY,
+    isbn TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    borrow_time INTEGER NOT NULL,
+    return_time INTEGER
+);
+CREATE INDEX IF NOT EXISTS borrow_records_member ON borrow_records (member_id, id);
+CREATE INDEX IF NOT EXISTS borrow_records_open ON borrow_records (isbn) WHERE return_time IS NULL;
+CREATE INDEX IF NOT EXISTS borrow_records_open_by_time ON borrow_records (borrow_time) WHERE return_time IS NULL;
+'''
+
+# Statements are constant strings so sqlite3's statement cache keeps them prepared
+_INSERT_BOOK = ('INSERT INTO books (isbn, title, author, category, is_available, title_lc, author_lc) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)')
+_UPDATE_BOOK = ('UPDATE books SET title = COALESCE(?1, title), author = COALESCE(?2, author), '
+                'category = COALESCE(?3, category), title_lc = lower(COALESCE(?1, title)), '
+                'author_lc = lower(COALESCE(?2, author)) WHERE isbn = ?4')
+_DELETE_BOOK = 'DELETE FROM books WHERE isbn = ?'
+# Borrows and returns only flip a book that is in the state this process expects, and a
+# return closes exactly one open loan; anything else means a second writer got there first
+_SET_AVAILABLE = 'UPDATE books SET is_available = ?1 WHERE isbn = ?2 AND is_available = 1 - ?1'
+_INSERT_MEMBER = 'INSERT INTO members (member_id, name, contact, is_active) VALUES (?, ?, ?, ?)'
+_UPDATE_MEMBER = ('UPDATE members SET name = COALESCE(?, name), contact = COALESCE(?, contact) '
+                  'WHERE member_id = ?')
+_DELETE_MEMBER = 'DELETE FROM members WHERE member_id = ?'
+_INSERT_LOAN = 'INSERT INTO borrow_records (isbn, member_id, borrow_time, return_time) VALUES (?, ?, ?, ?)'
+_RETURN_LOAN = ('UPDATE borrow_records SET return_time = ? WHERE id = ('
+                'SELECT id FROM borrow_records WHERE isbn = ? AND member_id = ? AND return_time IS NULL '
+                'ORDER BY id LIMIT 1)')
+
+
+class SQLiteStorage(Storage):
+    # One writer process per database: LibrarySystem checks borrow and return rules against
+    # the copy it loaded. Borrows and returns are guarded UPDATEs, so if a second writer has
+    # changed the same book, record() raises and rolls back instead of recording a double
+    # loan; the library's copy is then stale and has to be reloaded. Other processes may
+    # read at any time, e.g. through the query methods at the end.
+    checkpoint_saves = False  # Ops are already rows; checkpoint() only folds the WAL into the database
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+        # WAL lets other processes read while this one writes
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # FULL syncs the WAL on every commit, so a recorded op survives a power cut as
+        # durability='always' promises; see set_durability()
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.executescript(_SCHEMA)
+
+    def set_durability(self, durability: str):
+        # Under 'interval' and 'shutdown' recent ops may be lost anyway, and NORMAL only
+        # risks the last commits on power loss while never corrupting the database
+        self.conn.execute('PRAGMA synchronous=FULL' if durability == 'always' else 'PRAGMA synchronous=NORMAL')
+
+    def load(self) -> Tuple[Optional[dict], Iterable[tuple]]:
+        from library import Book, Member  # library imports this module
+
+        books: Dict[str, Book] = {}
+        for isbn, title, author, category, is_available in self.conn.execute(
+                'SELECT isbn, title, author, category, is_available FROM books ORDER BY rowid'):
+            book = Book(title, author, category, isbn)
+            book.is_available = bool(is_available)
+            books[isbn] = book
+        members: Dict[str, Member] = {}
+        for member_id, name, contact, is_active in self.conn.execute(
+                'SELECT member_id, name, contact, is_active FROM members ORDER BY rowid'):
+            member = Member(name, member_id, contact)
+            member.is_active = bool(is_active)
+            members[member_id] = member
+        history = LoanHistory()
+        for isbn, member_id, borrow_time, return_time in self.conn.execute(
+                'SELECT isbn, member_id, borrow_time, return_time FROM borrow_records ORDER BY id'):
+            history.add(isbn, member_id, from_micros(borrow_time),
+                        None if return_time is None else from_micros(return_time))
+            if return_time is None and member_id in members:
+                members[member_id].borrowed_books[isbn] = None
+        if not books and not members and not len(history):
+            return None, ()
+        return {'books': books, 'members': members, 'borrow_records': history}, ()
+
+    def _execute_guarded(self, statement: str, params: tuple, op: tuple):
+        if self.conn.execute(statement, params).rowcount != 1:
+            raise RuntimeError(f"{op[0]} of {op[1]} does not match {self.db_file}; another process "
+                               f"has written to it, reload the library")
+
+    def _execute_op(self, op: tuple):
+        kind, args = op[0], op[1:]
+        execute = self.conn.execute
+        if kind == 'add_book':
+            title, author, category, isbn = args
+            execute(_INSERT_BOOK, (isbn, title, author, category, 1, title.lower(), author.lower()))
+        elif kind == 'edit_book':
+            isbn, title, author, category = args
+            execute(_UPDATE_BOOK, (title or None, author or None, category or None, isbn))
+        elif kind == 'delete_book':
+            execute(_DELETE_BOOK, args)
+        elif kind == 'add_member':
+            name, member_id, contact = args[:3]
+            is_active = args[3] if len(args) > 3 else True  # Older ops have no is_active
+            execute(_INSERT_MEMBER, (member_id, name, contact, int(is_active)))
+        elif kind == 'edit_member':
+            member_id, name, contact = args
+            execute(_UPDATE_MEMBER, (name or None, contact or None, member_id))
+        elif kind == 'delete_member':
+            execute(_DELETE_MEMBER, args)
+        elif kind == 'borrow_book':
+            isbn, member_id, when = args
+            self._execute_guarded(_SET_AVAILABLE, (0, isbn), op)
+            execute(_INSERT_LOAN, (isbn, member_id, to_micros(when), None))
+        elif kind == 'return_book':
+            isbn, member_id, when = args
+            self._execute_guarded(_SET_AVAILABLE, (1, isbn), op)
+            self._execute_guarded(_RETURN_LOAN, (to_micros(when), isbn, member_id), op)
+        elif kind == 'import_loan':
+            isbn, member_id, borrow_date, return_date = args
+            if return_date is None:
+                self._execute_guarded(_SET_AVAILABLE, (0, isbn), op)
+            execute(_INSERT_LOAN, (isbn, member_id, to_micros(borrow_date),
+                                   None if return_date is None else to_micros(return_date)))
+        else:
+            raise ValueError(f"Unknown op: {kind}")
+
+    def record(self, library, ops: List[tuple]):
+        with self.conn:
+            self.conn.execute('BEGIN')
+            for op in ops:
+                self._execute_op(op)
+
+    def save(self, library):
+        # Full rewrite; normal operation only ever writes the rows an op touches
+        history = library.borrow_records
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute('DELETE FROM books')
+            self.conn.execute('DELETE FROM members')
+            self.conn.execute('DELETE FROM borrow_records')
+            self.conn.executemany(_INSERT_BOOK, (
+                (book.isbn, book.title, book.author, book.category, int(book.is_available),
+                 book.title.lower(), book.author.lower())
+                for book in library.books.values()))
+            self.conn.executemany(_INSERT_MEMBER, (
+                (member.member_id, member.name, member.contact, int(member.is_active))
+                for member in library.members.values()))
+            # row() also reads loans a pickle or snapshot backend has archived
+            self.conn.executemany(_INSERT_LOAN, (
+                (isbn, member_id, borrow_time, None if return_time == NOT_RETURNED else return_time)
+                for isbn, member_id, borrow_time, return_time in map(history.row, range(len(history)))))
+
+    def checkpoint(self, library):
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        self.conn.close()
+
+    # Queries answered by SQL, without loading the library into memory
+
+    def search_books(self, query: str) -> List[dict]:
+        query = query.lower()
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        rows = self.conn.execute(
+            "SELECT isbn, title, author, category, is_available FROM books "
+            "WHERE title_lc LIKE ?1 ESCAPE '\\' OR author_lc LIKE ?1 ESCAPE '\\' "
+            "OR lower(isbn) LIKE ?1 ESCAPE '\\' ORDER BY rowid", (pattern,))
+        # LIKE folds ASCII case only, so confirm with Python's lower()
+        return [{'isbn': isbn, 'title': title, 'author': author, 'category': category,
+                 'is_available': bool(is_available)}
+                for isbn, title, author, category, is_available in rows
+                if query in title.lower() or query in author.lower() or query in isbn.lower()]
+
+    def member_history(self, member_id: str) -> List[Dict]:
+        # As LibrarySystem.get_member_borrow_history: loans of deleted books have no title
+        rows = self.conn.execute(
+            'SELECT b.title, r.isbn, r.borrow_time, r.return_time FROM borrow_records r '
+            'LEFT JOIN books b ON b.isbn = r.isbn WHERE r.member_id = ? ORDER BY r.id', (member_id,))
+        return [{
+            'book_title': title,
+            'book_isbn': isbn,
+            'borrow_date': from_micros(borrow_time),
+            'return_date': None if return_time is None else from_micros(return_time),
+            'is_returned': return_time is not None
+        } for title, isbn, borrow_time, return_time in rows]
+
+    def overdue(self, days_threshold: int = 14, now: Optional[datetime.datetime] = None) -> List[Dict]:
+        now = now or datetime.datetime.now()
+        # days_borrowed > threshold  <=>  borrowed before now - (threshold + 1) days
+        cutoff = to_micros(now - datetime.timedelta(days=days_threshold + 1))
+        rows = self.conn.execute(
+            'SELECT b.title, r.isbn, m.name, r.member_id, r.borrow_time FROM borrow_records r '
+            'JOIN books b ON b.isbn = r.isbn JOIN members m ON m.member_id = r.member_id '
+            'WHERE r.return_time IS NULL AND r.borrow_time <= ? ORDER BY r.id', (cutoff,))
+        return [{
+            'book_title': title,
+            'book_isbn': isbn,
+            'member_name': name,
+            'member_id': member_id,
+            'days_overdue': (now - from_micros(borrow_time)).days - days_threshold
+        } for title, isbn, name, member_id, borrow_time in rows]
+
+    def statistics(self) -> Dict:
+        total_books, available_books = self.conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(is_available), 0) FROM books').fetchone()
+        total_members, active_members = self.conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(is_active), 0) FROM members').fetchone()
+        return {
+            'total_books': total_books,
+            'available_books': available_books,
+            'books_borrowed': total_books - available_books,
+            'total_members': total_members,
+            'active_members': active_members
+        }
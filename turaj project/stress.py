@@ -0,0 +1,152 @@
+import argparse
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from benchmark import generate_library, make_storage
+from library import LibrarySystem
+from query_cache import QueryCache
+
+
+def run_stress(library: LibrarySystem, threads: int = 8, readers: int = 4, operations: int = 2000,
+               seed: int = 42) -> Dict[str, int]:
+    # Writers borrow and return random books from a small pool so they collide on the same
+    # books and members; readers search and report meanwhile. Every successful call is counted
+    # per ISBN, so lost updates or double loans show up when the totals are compared afterwards.
+    isbns = list(library.books)[:max(1, len(library.books) // 20)]
+    member_ids = list(library.members)
+    borrows: Dict[str, int] = {isbn: 0 for isbn in isbns}
+    returns: Dict[str, int] = {isbn: 0 for isbn in isbns}
+    tally_lock = threading.Lock()
+    errors: List[str] = []
+    loans_before = len(library.borrow_records)
+    open_before = {isbn: isbn in library.open_loans for isbn in isbns}
+    writers_done = threading.Event()
+
+    def writer(number: int):
+        rng = random.Random(seed + number)
+        try:
+            for _ in range(operations):
+                isbn, member_id = rng.choice(isbns), rng.choice(member_ids)
+                if rng.random() < 0.5:
+                    if library.borrow_book(isbn, member_id):
+                        with tally_lock:
+                            borrows[isbn] += 1
+                else:
+                    with library.reading():
+                        holder = library.open_loans.get(isbn)
+                        if holder is not None:
+                            member_id = library.borrow_records.member_id(holder)
+                    if library.return_book(isbn, member_id):
+                        with tally_lock:
+                            returns[isbn] += 1
+        except Exception as error:
+            errors.append(f"writer {number}: {error!r}")
+
+    def reader(number: int):
+        rng = random.Random(seed - number)
+        try:
+            while not writers_done.is_set():
+                library.search_books(rng.choice(isbns)[-6:])
+                library.get_statistics()
+                library.get_top_borrowers()
+                library.get_member_borrow_history(rng.choice(member_ids))
+        except Exception as error:
+            errors.append(f"reader {number}: {error!r}")
+
+    workers = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+    watchers = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    started = time.perf_counter()
+    for thread in workers + watchers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    writers_done.set()
+    for thread in watchers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    problems = list(errors)
+    for isbn in isbns:
+        # Each book alternates borrowed/returned, so the counts can differ by at most one
+        outstanding = open_before[isbn] + borrows[isbn] - returns[isbn]
+        if outstanding not in (0, 1):
+            problems.append(f"{isbn}: {borrows[isbn]} borrows but {returns[isbn]} returns")
+        elif (outstanding == 1) == library.books[isbn].is_available:
+            problems.append(f"{isbn}: availability does not match its loans")
+        elif (outstanding == 1) != (isbn in library.open_loans):
+            problems.append(f"{isbn}: open loan index does not match its loans")
+    recorded = len(library.borrow_records) - loans_before
+    if recorded != sum(borrows.values()):
+        problems.append(f"{recorded} loans recorded for {sum(borrows.values())} successful borrows")
+    for key, (counter, recount) in library.check_statistics().items():
+        problems.append(f"statistics {key}: counter {counter}, recount {recount}")
+    if library.query_cache is not None:
+        # Whatever the readers left in the cache must match a fresh computation
+        cached = [library.get_member_borrow_history(member_id) for member_id in member_ids]
+        top = library.get_top_borrowers()
+        library.query_cache.clear()
+        if cached != [library.get_member_borrow_history(member_id) for member_id in member_ids]:
+            problems.append("cached borrow histories are stale")
+        if top != library.get_top_borrowers():
+            problems.append("cached top borrowers are stale")
+    for problem in problems:
+        print(problem)
+    return {
+        'borrows': sum(borrows.values()),
+        'returns': sum(returns.values()),
+        'elapsed_ms': int(elapsed * 1000),
+        'problems': len(problems)
+    }
+
+
+def check_reload(library: LibrarySystem, storage: str, directory: str) -> List[str]:
+    # What was persisted must match what the threads saw; call after library.close()
+    try:
+        reloaded = LibrarySystem(storage=make_storage(storage, directory))
+    except Exception as error:
+        return [f"Reloading failed: {error!r}"]
+    mismatched = [isbn for isbn, book in library.books.items()
+                  if reloaded.books[isbn].is_available != book.is_available]
+    reloaded.close()
+    if mismatched:
+        return [f"{len(mismatched)} books differ after reloading, e.g. {mismatched[0]}"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer a thread-safe LibrarySystem from many threads "
+                                                 "and check that no borrow or return was lost")
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--members', type=int, default=200)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8, help="borrow/return threads")
+    parser.add_argument('--readers', type=int, default=4, help="search/report threads")
+    parser.add_argument('--operations', type=int, default=2000, help="calls per writer thread")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--storage', choices=['pickle', 'journal', 'snapshot', 'sqlite'], default='snapshot')
+    parser.add_argument('--cache-size', type=int, default=0, help="also run readers through a query cache")
+    parser.add_argument('--unsafe', action='store_true', help="run without locking, to see what breaks")
+    args = parser.parse_args()
+
+    sys.setswitchinterval(1e-5)  # Switch threads often to provoke races
+    with tempfile.TemporaryDirectory() as directory:
+        query_cache = QueryCache(args.cache_size) if args.cache_size > 0 else None
+        library = LibrarySystem(storage=make_storage(args.storage, directory), thread_safe=not args.unsafe,
+                                query_cache=query_cache)
+        generate_library(library, args.books, args.members, args.loans, args.seed)
+        result = run_stress(library, args.threads, args.readers, args.operations, args.seed)
+        library.close()
+        for problem in check_reload(library, args.storage, directory):
+            print(problem)
+            result['problems'] += 1
+    print(f"{result['borrows']} borrows and {result['returns']} returns in {result['elapsed_ms']} ms, "
+          f"{result['problems']} problems")
+    sys.exit(1 if result['problems'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from analytics import LoanColumns, np
+from library import LibrarySystem
+from metrics import Metrics
+from storage import PickleStorage
+
+
+@unittest.skipIf(np is None, "loan reports need NumPy")
+class LoanColumnsTest(unittest.TestCase):
+    # Columns kept up to date by mutations match columns built from the history afresh, and
+    # mutations never make the next report rebuild them
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.metrics = Metrics()
+        self.library = LibrarySystem(storage=PickleStorage(os.path.join(self.directory, 'library.pkl')),
+                                     metrics=self.metrics)
+        for number in range(6):
+            self.library.add_book(f"Title {number}", 'Author', ('Fiction', 'History', 'Science')[number % 3],
+                                  f"isbn-{number}")
+            self.library.add_member(f"Member {number}", f"m{number}", 'contact')
+        borrowed = datetime.datetime.now() - datetime.timedelta(days=40)
+        for number in range(4):
+            self.library.import_loan(f"isbn-{number}", f"m{number}", borrowed,
+                                     borrowed + datetime.timedelta(days=number * 7))
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.directory)
+
+    def _reports(self, library: LibrarySystem):
+        return (library.get_loan_duration_report(), library.get_loan_duration_report('Poetry'),
+                library.get_monthly_circulation(3), library.get_lateness_report(),
+                library.get_member_cohorts(3))
+
+    def _assert_matches_rebuild(self):
+        columns = self.library._loan_columns
+        rebuilt = LoanColumns(self.library.borrow_records, self.library.books)
+        self.assertEqual(len(columns), len(rebuilt))
+        for codes, names in (('isbn', 'isbns'), ('member', 'members'), ('category', 'categories')):
+            self.assertEqual([getattr(columns, names)[code] for code in getattr(columns, codes)],
+                             [getattr(rebuilt, names)[code] for code in getattr(rebuilt, codes)])
+        self.assertEqual(columns.borrowed.tolist(), rebuilt.borrowed.tolist())
+        self.assertEqual(columns.returned.tolist(), rebuilt.returned.tolist())
+
+    def test_mutations_update_columns(self):
+        before = self._reports(self.library)
+        self.assertEqual(self.metrics.events['loan_columns_build'], 1)
+        self.assertTrue(self.library.borrow_book('isbn-4', 'm1'))
+        self.assertTrue(self.library.borrow_book('isbn-5', 'm2'))
+        self.assertTrue(self.library.return_book('isbn-4', 'm1'))
+        borrowed = datetime.datetime.now() - datetime.timedelta(days=3)
+        self.assertTrue(self.library.import_loan('isbn-0', 'm5', borrowed, borrowed + datetime.timedelta(days=2)))
+        self.assertTrue(self.library.edit_book('isbn-1', category='Poetry'))
+        self.assertTrue(self.library.delete_book('isbn-2'))
+        self._assert_matches_rebuild()
+
+        after = self._reports(self.library)
+        self.assertNotEqual(after, before)
+        self.assertEqual(self.metrics.events['loan_columns_build'], 1)
+        self.library._loan_columns = None
+        self.assertEqual(self._reports(self.library), after)
+
+    def test_growing_past_capacity(self):
+        self._reports(self.library)
+        for _ in range(700):  # Past the first 1024 rows of spare capacity
+            self.assertTrue(self.library.borrow_book('isbn-5', 'm3'))
+            self.assertTrue(self.library.return_book('isbn-5', 'm3'))
+        self.assertTrue(self.library.borrow_book('isbn-5', 'm4'))
+        self._assert_matches_rebuild()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from library import LibrarySystem
+from storage import PickleStorage, SQLiteStorage
+
+BACKENDS = {
+    'journaled': lambda directory: PickleStorage(os.path.join(directory, 'library.pkl'), journaled=True),
+    'sqlite': lambda directory: SQLiteStorage(os.path.join(directory, 'library.db')),
+}
+
+
+class BatchTest(unittest.TestCase):
+    # borrow_books and return_books change nothing, in memory or on disk, when one ISBN of
+    # the batch is bad, and persist the whole batch otherwise
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _open(self, backend: str, directory: str) -> LibrarySystem:
+        library = LibrarySystem(storage=BACKENDS[backend](directory))
+        if not library.books:
+            for number in range(4):
+                library.add_book(f"Title {number}", 'Author', 'Fiction', f"isbn-{number}")
+            library.add_member('Member', 'm1', 'contact')
+            library.add_member('Other', 'm2', 'contact')
+            library.borrow_book('isbn-3', 'm2')
+        return library
+
+    @staticmethod
+    def _state(library: LibrarySystem):
+        history = library.borrow_records
+        return ({isbn: book.is_available for isbn, book in library.books.items()},
+                {member_id: list(member.borrowed_books) for member_id, member in library.members.items()},
+                [history.row(position) for position in range(len(history))],
+                dict(library.open_loans), library.get_statistics())
+
+    def test_one_bad_isbn_rolls_back(self):
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                directory = tempfile.mkdtemp(dir=self.directory)
+                library = self._open(backend, directory)
+                before = self._state(library)
+                written = library.storage.bytes_written
+
+                self.assertEqual(library.borrow_books('m1', ['isbn-0', 'isbn-9', 'isbn-1']),
+                                 {'isbn-9': "unknown book"})
+                self.assertEqual(library.borrow_books('m1', ['isbn-0', 'isbn-3']), {'isbn-3': "not available"})
+                self.assertEqual(library.return_books('m2', ['isbn-3', 'isbn-0']),
+                                 {'isbn-0': "not borrowed by this member"})
+                self.assertEqual(self._state(library), before)
+                self.assertEqual(library.storage.bytes_written, written)
+                library.close()
+                reloaded = self._open(backend, directory)
+                self.assertEqual(self._state(reloaded), before)
+
+                self.assertEqual(reloaded.borrow_books('m1', ['isbn-0', 'isbn-1']), {})
+                self.assertEqual(reloaded.return_books('m2', ['isbn-3']), {})
+                after = self._state(reloaded)
+                self.assertEqual(after[1], {'m1': ['isbn-0', 'isbn-1'], 'm2': []})
+                reloaded.close()
+                reloaded = self._open(backend, directory)
+                self.assertEqual(self._state(reloaded), after)
+                reloaded.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from bulk import EXPORTERS, IMPORTERS, export_books, import_loans
+from library import LibrarySystem
+from storage import PickleStorage, SQLiteStorage
+
+
+class ImportLoansTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.library = LibrarySystem(storage=PickleStorage(os.path.join(self.directory, 'library.pkl')))
+        for number in range(3):
+            self.library.add_book(f"Title {number}", 'Author', 'Fiction', f"isbn-{number}")
+        self.library.add_member('Member', 'm1', 'm1@example.com')
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.directory)
+
+    def _write(self, name: str, text: str) -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_dates_with_offset_are_rejected(self):
+        path = self._write('loans.csv', 'isbn,member_id,borrow_date,return_date\n'
+                                        'isbn-0,m1,2024-01-02T10:00:00+00:00,\n'
+                                        'isbn-1,m1,2024-01-02T10:00:00,2024-01-05T10:00:00+03:30\n'
+                                        'isbn-2,m1,2024-01-02T10:00:00,2024-01-05T10:00:00\n')
+        report = import_loans(self.library, path)
+        self.assertEqual(report.accepted, 1)
+        self.assertEqual([(line, reason) for line, reason, _ in report.rejected],
+                         [(2, "dates must be naive local ISO 8601"), (3, "dates must be naive local ISO 8601")])
+        self.assertEqual(len(self.library.borrow_records), 1)
+        self.assertTrue(self.library.books['isbn-0'].is_available)
+
+    def test_import_loan_rejects_aware_dates(self):
+        aware = datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc)
+        self.assertFalse(self.library.import_loan('isbn-0', 'm1', aware))
+        self.assertFalse(self.library.import_loan('isbn-0', 'm1', datetime.datetime(2024, 1, 1), aware))
+        self.assertEqual(len(self.library.borrow_records), 0)
+
+
+class RoundTripTest(unittest.TestCase):
+    # Exporting books, members and loans and importing them in that order gives back the same library
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.library = LibrarySystem(storage=PickleStorage(os.path.join(self.directory, 'library.pkl')))
+        for number in range(4):
+            self.library.add_book(f"Title {number}", f"Author {number}", 'Fiction', f"isbn-{number}")
+        self.library.add_member('Active', 'm1', 'm1@example.com')
+        self.library.add_member('Inactive', 'm2', 'm2@example.com', is_active=False)
+        borrowed = datetime.datetime(2024, 1, 2, 10, 30)
+        self.library.import_loan('isbn-0', 'm1', borrowed, borrowed + datetime.timedelta(days=3))
+        self.library.import_loan('isbn-1', 'm2', borrowed)
+        self.library.borrow_book('isbn-2', 'm1')
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def _state(library: LibrarySystem):
+        history = library.borrow_records
+        return ({isbn: (book.title, book.author, book.category, book.is_available)
+                 for isbn, book in library.books.items()},
+                {member_id: (member.name, member.contact, member.is_active, list(member.borrowed_books))
+                 for member_id, member in library.members.items()},
+                [history.row(position) for position in range(len(history))],
+                library.get_statistics())
+
+    def test_round_trip(self):
+        for extension in ('csv', 'jsonl'):
+            with self.subTest(extension=extension):
+                db_file = os.path.join(self.directory, f"copy-{extension}.db")
+                copy = LibrarySystem(storage=SQLiteStorage(db_file))
+                for kind in ('books', 'members', 'loans'):
+                    path = os.path.join(self.directory, f"{kind}.{extension}")
+                    EXPORTERS[kind](self.library, path)
+                    report = IMPORTERS[kind](copy, path)
+                    self.assertEqual(report.rejected, [])
+                self.assertEqual(self._state(copy), self._state(self.library))
+                copy.close()
+                reloaded = LibrarySystem(storage=SQLiteStorage(db_file))
+                self.assertEqual(self._state(reloaded), self._state(self.library))
+                reloaded.close()
+
+    def test_json_files_are_refused(self):
+        path = os.path.join(self.directory, 'books.json')
+        with self.assertRaises(ValueError):
+            export_books(self.library, path)
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from library import LibrarySystem
+from storage import PickleStorage
+
+
+class OverdueOrderTest(unittest.TestCase):
+    # The due index lists overdue loans in the order, and with the rows, of a brute-force scan
+    # of the open loans, also once loans are imported out of order and returned between pages
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.library = LibrarySystem(storage=PickleStorage(os.path.join(self.directory, 'library.pkl')))
+        rng = random.Random(5)
+        now = datetime.datetime.now()
+        with self.library.batch():
+            for number in range(5):
+                self.library.add_member(f"Member {number}", f"m{number}", 'contact')
+            for number in range(60):
+                self.library.add_book(f"Title {number}", 'Author', 'Fiction', f"isbn-{number}")
+                # Imported in ISBN order, so borrow order differs from history order; a few
+                # loans share a borrow time
+                borrowed = now - datetime.timedelta(days=rng.randrange(40), hours=rng.choice((0, 3)))
+                returned = borrowed + datetime.timedelta(days=1) if number % 7 == 0 else None
+                self.library.import_loan(f"isbn-{number}", f"m{number % 5}", borrowed, returned)
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.directory)
+
+    def _scan(self, days_threshold: int = 14) -> list:
+        # Every open loan out more than days_threshold full days, oldest first
+        current_time = datetime.datetime.now()
+        loans = []
+        for position in self.library.open_loans.values():
+            record = self.library.borrow_records[position]
+            if (current_time - record.borrow_date).days > days_threshold:
+                loans.append((record.borrow_date, position, record.book_isbn, record.member_id))
+        return [(position, isbn, member_id) for _, position, isbn, member_id in sorted(loans)]
+
+    @staticmethod
+    def _keys(rows: list) -> list:
+        return [(row['book_isbn'], row['member_id']) for row in rows]
+
+    def _assert_matches_scan(self):
+        expected = self._scan()
+        self.assertGreater(len(expected), 10)
+        self.assertEqual(self._keys(self.library.get_overdue_books()),
+                         [(isbn, member_id) for _, isbn, member_id in expected])
+        self.assertEqual(self._keys(self.library.get_newly_overdue(None)[0]),
+                         [(isbn, member_id) for _, isbn, member_id in expected])
+        self.assertEqual([(position, row['book_isbn'], row['member_id'])
+                          for position, row in self.library.iter_overdue()], expected)
+        self.assertEqual(self._keys(self.library.get_member_overdue('m2')),
+                         sorted(((isbn, member_id) for position, isbn, member_id in expected if member_id == 'm2'),
+                                key=lambda key: self.library.open_loans[key[0]]))
+
+    def test_matches_scan(self):
+        self._assert_matches_scan()
+        returned = self._scan()[3]
+        self.assertTrue(self.library.return_book(returned[1], returned[2]))
+        self.assertTrue(self.library.borrow_book('isbn-0', 'm4'))
+        self.assertTrue(self.library.import_loan('isbn-7', 'm1', datetime.datetime.now() - datetime.timedelta(days=90)))
+        self._assert_matches_scan()
+
+    def test_pages_resume_after_returned_loan(self):
+        expected = self._scan()
+        with mock.patch('library.CHUNK_SIZE', 4):
+            pages = self.library.iter_overdue()
+            seen = [next(pages) for _ in range(8)]  # Two chunks; the last loan is the cursor
+            # The cursor loan and the next one go away while the caller holds the page
+            for position, _, member_id in expected[7:9]:
+                self.assertTrue(self.library.return_book(self.library.borrow_records[position].book_isbn, member_id))
+            seen += list(pages)
+        self.assertEqual([(position, row['book_isbn'], row['member_id']) for position, row in seen],
+                         expected[:8] + expected[9:])
+
+
+if __name__ == '__main__':
+    unittest.main()
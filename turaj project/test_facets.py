@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+from library import LibrarySystem
+from storage import PickleStorage
+
+CATEGORIES = ('Fiction', 'History', 'Science')
+
+
+class BrowseTest(unittest.TestCase):
+    # Facet counts and pages kept up to date by borrows and returns match a scan of the books
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.library = LibrarySystem(storage=PickleStorage(os.path.join(self.directory, 'library.pkl')))
+        for number in range(30):
+            self.library.add_book(f"Title {number}", f"Author {number % 4}", CATEGORIES[number % 3],
+                                  f"isbn-{number:02d}")
+        self.library.add_member('Member', 'm1', 'contact')
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.directory)
+
+    def _pages(self, limit: int, **filters) -> list:
+        isbns, after = [], None
+        while True:
+            page = self.library.browse_books(limit=limit, after=after, **filters)
+            self.assertLessEqual(len(page['books']), limit)
+            isbns.extend(book.isbn for book in page['books'])
+            after = page['next_cursor']
+            if after is None:
+                return isbns
+
+    def _assert_matches_scan(self, category=None, available=None):
+        books = [book for book in self.library.books.values()
+                 if category in (None, book.category) and available in (None, book.is_available)]
+        self.assertEqual(self._pages(4, category=category, available=available), [book.isbn for book in books])
+        page = self.library.browse_books(category=category, available=available)
+        self.assertEqual(page['total'], len(books))
+        by_category = [book for book in self.library.books.values() if available in (None, book.is_available)]
+        self.assertEqual(page['facets']['category'], dict(Counter(book.category for book in by_category)))
+        by_availability = [book for book in self.library.books.values() if category in (None, book.category)]
+        available_count = sum(book.is_available for book in by_availability)
+        self.assertEqual(page['facets']['availability'],
+                         {'available': available_count, 'borrowed': len(by_availability) - available_count})
+        self.assertEqual(page['facets']['author'], dict(Counter(book.author for book in books).most_common(10)))
+
+    def test_borrow_and_return(self):
+        self._assert_matches_scan(available=True)  # Builds the index before the loans
+        for isbn in ('isbn-00', 'isbn-03', 'isbn-04', 'isbn-27'):
+            self.assertTrue(self.library.borrow_book(isbn, 'm1'))
+        for category in (None, 'Fiction'):
+            for available in (None, True, False):
+                with self.subTest(category=category, available=available, step='borrowed'):
+                    self._assert_matches_scan(category, available)
+        self.assertTrue(self.library.return_book('isbn-03', 'm1'))
+        for category in (None, 'Fiction'):
+            for available in (None, True, False):
+                with self.subTest(category=category, available=available, step='returned'):
+                    self._assert_matches_scan(category, available)
+
+
+if __name__ == '__main__':
+    unittest.main()
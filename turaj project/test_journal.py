@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from journal import MutationJournal
+from library import LibrarySystem
+from storage import PickleStorage
+
+
+class TornTailTest(unittest.TestCase):
+    # A crash mid-append leaves part of a record at the end of the journal; replay stops
+    # before it, cuts it off and later records follow the last whole one
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'library.journal')
+        journal = MutationJournal(self.path)
+        journal.append_many([('op', number) for number in range(3)])
+        journal.close()
+        self.whole = os.path.getsize(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _tear(self, tail: bytes):
+        with open(self.path, 'ab') as f:
+            f.write(tail)
+
+    def _assert_replays_whole_records(self):
+        journal = MutationJournal(self.path)
+        self.assertEqual(list(journal.replay()), [('op', 0), ('op', 1), ('op', 2)])
+        self.assertEqual(os.path.getsize(self.path), self.whole)
+        self.assertEqual(journal.append(('op', 3)), 4)
+        journal.close()
+        self.assertEqual(list(MutationJournal(self.path).replay()), [('op', number) for number in range(4)])
+
+    def test_partial_header(self):
+        self._tear(b'\x10\x00')
+        self._assert_replays_whole_records()
+
+    def test_partial_payload(self):
+        journal = MutationJournal(self.path + '.next')
+        journal.last_seq = 3
+        journal.append(('op', 'lost'))
+        journal.close()
+        with open(self.path + '.next', 'rb') as f:
+            record = f.read()
+        self._tear(record[:-3])
+        self._assert_replays_whole_records()
+
+    def test_corrupt_payload(self):
+        journal = MutationJournal(self.path + '.next')
+        journal.last_seq = 3
+        journal.append(('op', 'lost'))
+        journal.close()
+        with open(self.path + '.next', 'rb') as f:
+            record = bytearray(f.read())
+        record[-1] ^= 0xFF
+        self._tear(bytes(record))
+        self._assert_replays_whole_records()
+
+    def test_library_reloads_after_torn_append(self):
+        data_file = os.path.join(self.directory, 'library.pkl')
+        library = LibrarySystem(storage=PickleStorage(data_file, journaled=True))
+        library.add_book('Title', 'Author', 'Fiction', 'isbn-0')
+        library.add_member('Member', 'm1', 'contact')
+        library.borrow_book('isbn-0', 'm1')
+        library.close()
+        with open(data_file + '.journal', 'ab') as f:
+            f.write(b'\x40\x00\x00\x00\x00')
+
+        reloaded = LibrarySystem(storage=PickleStorage(data_file, journaled=True))
+        self.assertFalse(reloaded.books['isbn-0'].is_available)
+        self.assertTrue(reloaded.return_book('isbn-0', 'm1'))
+        reloaded.close()
+        reloaded = LibrarySystem(storage=PickleStorage(data_file, journaled=True))
+        self.assertTrue(reloaded.books['isbn-0'].is_available)
+        self.assertEqual(len(reloaded.borrow_records), 1)
+        reloaded.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
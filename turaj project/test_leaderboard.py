@@ -0,0 +1,60 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from leaderboard import WINDOWS
+from library import LibrarySystem
+from storage import PickleStorage
+
+
+class TopCategoriesTest(unittest.TestCase):
+    # Counts kept up to date by mutations match counts rebuilt from the history after a restart
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.directory, 'library.pkl')
+        self.library = LibrarySystem(storage=PickleStorage(self.data_file))
+        for number in range(6):
+            self.library.add_book(f"Title {number}", 'Author', ('Fiction', 'History', 'Science')[number % 3],
+                                  f"isbn-{number}")
+            self.library.add_member(f"Member {number}", f"m{number}", 'contact')
+        now = datetime.datetime.now()
+        for days_ago in (400, 200, 20, 3):
+            for number in range(days_ago % 5 + 2):
+                borrowed = now - datetime.timedelta(days=days_ago, hours=number)
+                self.library.import_loan(f"isbn-{number}", f"m{number}", borrowed,
+                                         borrowed + datetime.timedelta(hours=1))
+        self.library.borrow_book('isbn-4', 'm1')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _top_categories(self, library: LibrarySystem):
+        return {window: sorted((row['category'], row['total_borrows'])
+                               for row in library.get_top_categories(10, window))
+                for window in (None, *WINDOWS)}
+
+    def _assert_same_after_reload(self):
+        reloaded = LibrarySystem(storage=PickleStorage(self.data_file))
+        self.assertEqual(self._top_categories(self.library), self._top_categories(reloaded))
+        reloaded.close()
+
+    def test_counts_follow_category_edits(self):
+        self._top_categories(self.library)  # Builds the counts before the edits
+        self.assertTrue(self.library.edit_book('isbn-0', category='Poetry'))
+        self.assertTrue(self.library.edit_book('isbn-1', category='History'))
+        self._assert_same_after_reload()
+        self.assertIn(('Poetry', 4), self._top_categories(self.library)[None])
+
+    def test_counts_follow_delete_and_re_add(self):
+        self._top_categories(self.library)
+        self.assertTrue(self.library.delete_book('isbn-2'))
+        self._assert_same_after_reload()
+        self.assertTrue(self.library.add_book('Title 2', 'Author', 'Poetry', 'isbn-2'))
+        self._assert_same_after_reload()
+
+
+if __name__ == '__main__':
+    unittest.main()
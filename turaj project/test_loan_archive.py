@@ -0,0 +1,99 @@
+import datetime
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+import zlib
+from array import array
+
+from loan_archive import INDEX_FILE, LoanArchive
+from loan_history import NOT_RETURNED, LoanHistory, to_micros
+
+DAY_MICROS = 24 * 3600 * 10 ** 6
+START = datetime.datetime(2024, 1, 1)
+
+
+class LoanArchiveTest(unittest.TestCase):
+    # Archiving in many small runs, as checkpoints do, keeps every loan readable by position,
+    # by member and by time, also after reopening the archive
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = random.Random(3)
+        self.rows = []
+        for number in range(3000):
+            borrowed = to_micros(START) + number * DAY_MICROS // 10 + rng.randrange(DAY_MICROS // 10)
+            returned = NOT_RETURNED if rng.random() < 0.05 else borrowed + rng.randrange(1, 20) * DAY_MICROS
+            self.rows.append((f"isbn-{rng.randrange(200)}", f"m{rng.randrange(40)}", borrowed, returned))
+        self.history = LoanHistory()
+        for row in self.rows:
+            self.history.add_row(*row)
+        self.history.archive = LoanArchive(os.path.join(self.directory, 'archive'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _archive_in_runs(self, runs: int, days: int = 300):
+        for run in range(1, runs + 1):
+            self.history.archive_before(START + datetime.timedelta(days=days * run / runs))
+
+    def _assert_matches(self, history: LoanHistory):
+        self.assertEqual([history.row(position) for position in range(len(history))], self.rows)
+        for member_id in ('m0', 'm7', 'm39', 'unknown'):
+            self.assertEqual(history.member_positions(member_id),
+                             [position for position, row in enumerate(self.rows) if row[1] == member_id])
+        self.assertEqual(sum(len(part.borrow_times) for part in history.parts()), len(self.rows))
+        start, end = START + datetime.timedelta(days=20), START + datetime.timedelta(days=250)
+        self.assertEqual(history.count_recent(start, end),
+                         sum(1 for row in self.rows if to_micros(start) <= row[2] < to_micros(end)))
+
+    def test_many_small_runs(self):
+        self._archive_in_runs(200)
+        archive = self.history.archive
+        self.assertGreater(self.history.base, 2500)
+        self._assert_matches(self.history)
+        # Runs of a month are merged as they come, and a month is one segment once it is done
+        months = [segment['month'] for segment in archive.segments]
+        done = months[:len(months) - months.count(months[-1])]
+        self.assertEqual(len(done), len(set(done)))
+        self.assertLessEqual(months.count(months[-1]), 8)
+        self.assertEqual(len(archive), self.history.base)
+
+        self.history.archive = LoanArchive(archive.directory)
+        self._assert_matches(self.history)
+        files = set(os.listdir(archive.directory))
+        listed = {INDEX_FILE} | {segment[key] for segment in archive.segments for key in ('file', 'postings')}
+        self.assertEqual(files, listed)
+
+    def test_discard_from_drops_unsaved_runs(self):
+        self._archive_in_runs(10, days=150)
+        base = self.history.base
+        self._archive_in_runs(10, days=250)  # Archived, but say the history was never saved
+        archive = LoanArchive(self.history.archive.directory)
+        archive.discard_from(base)
+        self.assertEqual(archive.end, base)
+        self.assertEqual([archive.row(position) for position in range(base)], self.rows[:base])
+        self.assertEqual(archive.member_positions('m7', base),
+                         [position for position, row in enumerate(self.rows[:base]) if row[1] == 'm7'])
+
+    def test_single_member_index_is_split(self):
+        # Archives written before postings files kept every member's positions in the index
+        self._archive_in_runs(20)
+        directory = self.history.archive.directory
+        segments = self.history.archive.segments
+        members = {}
+        for position in range(self.history.base):
+            members.setdefault(self.rows[position][1], array('I')).append(position)
+        for segment in segments:
+            os.remove(os.path.join(directory, segment.pop('postings')))
+        with open(os.path.join(directory, INDEX_FILE), 'wb') as f:
+            f.write(zlib.compress(pickle.dumps({'segments': segments, 'members': members})))
+
+        self.history.archive = LoanArchive(directory)
+        self._assert_matches(self.history)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from library import LibrarySystem
+from metrics import Metrics
+from storage import PickleStorage
+
+THREADS = 8
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_concurrent_profiled_calls_succeed(self):
+        # Python 3.12+ refuses a second active profiler; calls must still run and return normally
+        metrics = Metrics(profile_threshold_ms=0)
+        library = LibrarySystem(storage=PickleStorage(os.path.join(self.directory, 'library.pkl'), journaled=True),
+                                thread_safe=True, metrics=metrics)
+        for number in range(THREADS):
+            library.add_book(f"Title {number}", 'Author', 'Fiction', f"isbn-{number}")
+            library.add_member(f"Member {number}", f"m{number}", 'contact')
+        errors = []
+        start = threading.Barrier(THREADS)
+
+        def worker(number: int):
+            try:
+                start.wait()
+                for _ in range(50):
+                    self.assertEqual(len(library.search_books('title')), THREADS)
+                    self.assertTrue(library.borrow_book(f"isbn-{number}", f"m{number}"))
+                    self.assertTrue(library.return_book(f"isbn-{number}", f"m{number}"))
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        library.close()
+        self.assertEqual(errors, [])
+        self.assertEqual(metrics.latency['borrow_book'].count, THREADS * 50)
+        self.assertTrue(metrics.slow_calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
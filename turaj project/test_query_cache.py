@@ -0,0 +1,95 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from library import LibrarySystem
+from query_cache import QueryCache
+from storage import PickleStorage
+
+
+class QueryCacheTest(unittest.TestCase):
+    # Cached searches and reports are served again until a write touches what they read,
+    # and results that age with the clock expire on their own
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = QueryCache(64)
+        self.library = LibrarySystem(storage=PickleStorage(os.path.join(self.directory, 'library.pkl')),
+                                     query_cache=self.cache)
+        for title, isbn in (('Dune', 'isbn-0'), ('Emma', 'isbn-1'), ('Ulysses', 'isbn-2')):
+            self.library.add_book(title, 'Author', 'Fiction', isbn)
+        for number in range(2):
+            self.library.add_member(f"Member {number}", f"m{number}", 'contact')
+        borrowed = datetime.datetime.now() - datetime.timedelta(days=20, hours=5)
+        self.library.import_loan('isbn-2', 'm1', borrowed)
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.directory)
+
+    def _counts(self, kind: str) -> dict:
+        return self.cache.stats()['kinds'][kind]
+
+    def test_repeated_queries_hit(self):
+        first = self.library.search_books('emma')
+        self.assertEqual([book.isbn for book in first], ['isbn-1'])
+        self.assertEqual(self.library.search_books('emma'), first)
+        self.library.get_member_borrow_history('m1')
+        self.library.get_member_borrow_history('m1')
+        self.assertEqual((self._counts('search')['hits'], self._counts('search')['misses']), (1, 1))
+        self.assertEqual((self._counts('history')['hits'], self._counts('history')['misses']), (1, 1))
+
+    def test_writes_invalidate_only_their_scopes(self):
+        self.library.search_books('emma')
+        self.library.search_books('dune')
+        self.library.get_member_borrow_history('m0')
+        self.library.get_member_borrow_history('m1')
+
+        self.assertTrue(self.library.borrow_book('isbn-0', 'm0'))
+        self.library.search_books('emma')
+        self.library.search_books('dune')  # Results hold live books, so a borrow leaves searches alone
+        self.library.get_member_borrow_history('m1')
+        self.assertEqual(self._counts('search')['hits'], 2)
+        self.assertEqual(self._counts('history')['hits'], 1)
+        self.assertEqual(len(self.library.get_member_borrow_history('m0')), 1)
+        self.assertEqual(self._counts('history')['invalidated'], 1)
+
+        self.assertTrue(self.library.edit_book('isbn-0', title='Dune Messiah'))
+        self.assertEqual([book.isbn for book in self.library.search_books('emma')], ['isbn-1'])
+        self.assertEqual([book.isbn for book in self.library.search_books('messiah')], ['isbn-0'])
+        self.assertEqual([book.isbn for book in self.library.search_books('dune')], ['isbn-0'])
+        self.assertEqual(self._counts('search')['hits'], 3)
+        self.assertEqual(self._counts('search')['invalidated'], 1)
+
+    def test_overdue_list_expires_with_the_clock(self):
+        self.cache.ttl = 7 * 24 * 3600
+        now = 1000.0
+        with mock.patch('query_cache.time', mock.Mock(monotonic=lambda: now)):
+            rows = self.library.get_overdue_books(14)
+            self.assertEqual([row['book_isbn'] for row in rows], ['isbn-2'])
+            _, expires, _ = self.cache._entries[('overdue', 14)]
+            # Stale once the loan is overdue by another full day, well before the cache TTL
+            self.assertLessEqual(expires - now, 24 * 3600)
+            now = expires - 0.5
+            self.assertEqual(self.library.get_overdue_books(14), rows)
+            now = expires
+            self.assertEqual(self.library.get_overdue_books(14), rows)
+        self.assertEqual(self._counts('overdue')['hits'], 1)
+        self.assertEqual(self._counts('overdue')['expired'], 1)
+
+    def test_callers_get_copies(self):
+        results = self.library.search_books('emma')
+        results.clear()
+        self.assertEqual(len(self.library.search_books('emma')), 1)
+        rows = self.library.get_overdue_books(14)
+        rows.append({'book_isbn': 'bogus'})
+        self.assertEqual(len(self.library.get_overdue_books(14)), 1)
+        self.assertEqual(self._counts('search')['hits'], 1)
+        self.assertEqual(self._counts('overdue')['hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
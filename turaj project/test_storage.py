@@ -0,0 +1,170 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from library import LibrarySystem
+from metrics import Metrics
+from storage import DURABILITY_LEVELS, PickleStorage, SQLiteStorage, SnapshotStorage
+
+BACKENDS = {
+    'pickle': lambda directory: PickleStorage(os.path.join(directory, 'library.pkl')),
+    'journaled': lambda directory: PickleStorage(os.path.join(directory, 'library.pkl'), journaled=True),
+    'snapshot': lambda directory: SnapshotStorage(os.path.join(directory, 'library.snap')),
+    'sqlite': lambda directory: SQLiteStorage(os.path.join(directory, 'library.db')),
+}
+
+
+class CheckpointTest(unittest.TestCase):
+    # Every backend at every durability level keeps what was done before checkpoint() and
+    # close(), the sequence the server runs on shutdown
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _fill(self, library: LibrarySystem):
+        for number in range(5):
+            library.add_book(f"Title {number}", f"Author {number % 2}", 'Fiction', f"isbn-{number}")
+            library.add_member(f"Member {number}", f"m{number}", f"m{number}@example.com")
+        library.borrow_book('isbn-0', 'm0')
+        library.borrow_book('isbn-1', 'm1')
+        library.return_book('isbn-0', 'm0')
+        library.edit_member('m2', name='Renamed')
+
+    def test_checkpoint_close_reload(self):
+        for backend, make_storage in BACKENDS.items():
+            for durability in DURABILITY_LEVELS:
+                with self.subTest(backend=backend, durability=durability):
+                    directory = tempfile.mkdtemp(dir=self.directory)
+                    library = LibrarySystem(storage=make_storage(directory), durability=durability)
+                    self._fill(library)
+                    library.checkpoint()
+                    library.close()
+
+                    reloaded = LibrarySystem(storage=make_storage(directory))
+                    self.assertEqual(len(reloaded.books), 5)
+                    self.assertEqual(len(reloaded.members), 5)
+                    self.assertEqual(len(reloaded.borrow_records), 2)
+                    self.assertFalse(reloaded.books['isbn-1'].is_available)
+                    self.assertTrue(reloaded.books['isbn-0'].is_available)
+                    self.assertEqual(reloaded.members['m2'].name, 'Renamed')
+                    self.assertEqual(list(reloaded.members['m1'].borrowed_books), ['isbn-1'])
+                    reloaded.close()
+
+
+class SearchIndexTest(unittest.TestCase):
+    # Pickle and snapshot storage save the search index with the catalogue, so a reloaded
+    # library searches without rebuilding it, and journaled edits still reach it
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reload_keeps_index(self):
+        for backend in ('pickle', 'journaled', 'snapshot'):
+            with self.subTest(backend=backend):
+                directory = tempfile.mkdtemp(dir=self.directory)
+                library = LibrarySystem(storage=BACKENDS[backend](directory))
+                for number in range(20):
+                    library.add_book(f"Title {number}", f"Author {number % 3}", 'Fiction', f"isbn-{number}")
+                library.checkpoint()
+                library.edit_book('isbn-4', title='Another Story')
+                library.delete_book('isbn-5')
+                library.add_book('Last Story', 'Author 9', 'Fiction', 'isbn-20')
+                library.close()
+
+                metrics = Metrics()
+                reloaded = LibrarySystem(storage=BACKENDS[backend](directory), metrics=metrics)
+                self.assertNotIn('search_index_build', metrics.snapshot()['events'])
+                for query in ('story', 'title 1', 'author 2', 'isbn-5', 'isbn-20'):
+                    expected = [isbn for isbn, book in reloaded.books.items()
+                                if query in f"{book.title}|{book.author}|{book.isbn}".lower()]
+                    self.assertEqual([book.isbn for book in reloaded.search_books(query)], expected)
+                reloaded.close()
+
+
+class DeletedBookHistoryTest(unittest.TestCase):
+    # A member's history keeps loans of books deleted since, with the ISBN and no title, both
+    # from the library and from SQLite's own query
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_history_keeps_deleted_book(self):
+        for backend, make_storage in BACKENDS.items():
+            with self.subTest(backend=backend):
+                directory = tempfile.mkdtemp(dir=self.directory)
+                library = LibrarySystem(storage=make_storage(directory))
+                library.add_book('Kept', 'Author', 'Fiction', 'isbn-0')
+                library.add_book('Deleted', 'Author', 'Fiction', 'isbn-1')
+                library.add_member('Member', 'm1', 'contact')
+                for isbn in ('isbn-0', 'isbn-1'):
+                    library.borrow_book(isbn, 'm1')
+                    library.return_book(isbn, 'm1')
+                self.assertTrue(library.delete_book('isbn-1'))
+                expected = [('Kept', 'isbn-0', True), (None, 'isbn-1', True)]
+                rows = library.get_member_borrow_history('m1')
+                self.assertEqual([(row['book_title'], row['book_isbn'], row['is_returned']) for row in rows],
+                                 expected)
+                self.assertEqual([row for _, row in library.iter_member_history('m1')], rows)
+                if backend == 'sqlite':
+                    self.assertEqual(library.storage.member_history('m1'), rows)
+                library.close()
+
+
+class SQLiteWriterTest(unittest.TestCase):
+    # 'always' syncs every commit, and a second writer's stale borrow or return is refused
+    # instead of recording a double loan
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.directory, 'library.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_synchronous_follows_durability(self):
+        for durability, expected in (('always', 2), ('interval', 1), ('shutdown', 1)):
+            with self.subTest(durability=durability):
+                library = LibrarySystem(storage=SQLiteStorage(self.db_file), durability=durability)
+                self.assertEqual(library.storage.conn.execute('PRAGMA synchronous').fetchone()[0], expected)
+                library.close()
+
+    def test_second_writer_fails_loudly(self):
+        first = LibrarySystem(storage=SQLiteStorage(self.db_file))
+        for number in range(2):
+            first.add_book(f"Title {number}", 'Author', 'Fiction', f"isbn-{number}")
+        first.add_member('First', 'm1', 'contact')
+        first.add_member('Second', 'm2', 'contact')
+        first.borrow_book('isbn-1', 'm2')
+        second = LibrarySystem(storage=SQLiteStorage(self.db_file))
+
+        self.assertTrue(first.borrow_book('isbn-0', 'm1'))
+        with self.assertRaises(RuntimeError):
+            second.borrow_book('isbn-0', 'm2')
+        self.assertTrue(first.return_book('isbn-1', 'm2'))
+        with self.assertRaises(RuntimeError):
+            second.return_book('isbn-1', 'm2')
+        second.close()
+        first.close()
+
+        reloaded = LibrarySystem(storage=SQLiteStorage(self.db_file))
+        history = reloaded.borrow_records
+        self.assertEqual([history.row(position)[:2] for position in range(len(history))],
+                         [('isbn-1', 'm2'), ('isbn-0', 'm1')])
+        self.assertEqual(reloaded.open_loans, {'isbn-0': 1})
+        self.assertEqual(list(reloaded.members['m2'].borrowed_books), [])
+        self.assertTrue(reloaded.books['isbn-1'].is_available)
+        reloaded.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import shutil
+import sys
+import tempfile
+import unittest
+
+from benchmark import generate_library, make_storage
+from library import LibrarySystem
+from query_cache import QueryCache
+from stress import check_reload, run_stress
+
+
+class StressTest(unittest.TestCase):
+    # A small, seeded run of stress.py: no double loans, lost updates or stale cache entries
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)  # Switch threads often to provoke races
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+        shutil.rmtree(self.directory)
+
+    def _run(self, storage: str, query_cache=None):
+        library = LibrarySystem(storage=make_storage(storage, self.directory), thread_safe=True,
+                                query_cache=query_cache)
+        generate_library(library, books=200, members=30, loans=1000, seed=7)
+        result = run_stress(library, threads=4, readers=2, operations=200, seed=7)
+        library.close()
+        self.assertEqual(result['problems'], 0)
+        self.assertGreater(result['borrows'], 0)
+        self.assertGreater(result['returns'], 0)
+        self.assertEqual(check_reload(library, storage, self.directory), [])
+
+    def test_journal(self):
+        self._run('journal')
+
+    def test_snapshot_with_query_cache(self):
+        self._run('snapshot', QueryCache(256))
+
+    def test_sqlite(self):
+        self._run('sqlite')
+
+
+if __name__ == '__main__':
+    unittest.main()